@@ -10,3 +10,10 @@ from .optimize import *
 from .replicas import *
 from .show import *
 from .snapshot import *
+from .throttle import *
+from .cache import *
+from .restore import *
+from .parallel import *
+from .instrument import *
+from .metrics import *
+from .profiler import *
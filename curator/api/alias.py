@@ -1,15 +1,21 @@
 from .utils import *
 import elasticsearch
+import json
 import logging
 logger = logging.getLogger(__name__)
 
-def add_to_alias(client, index_name, alias=None):
+# The largest update_aliases request body, in bytes, sent at once.
+MAX_ALIAS_BODY_SIZE = 1048576
+
+def add_to_alias(client, index_name, alias=None, metadata=None):
     """
     Add indicated index to the specified alias.
 
     :arg client: The Elasticsearch client connection
     :arg index_name: The index name
     :arg alias: Alias name to operate on.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
     :rtype: bool
     """
     if check_csv(index_name):
@@ -18,13 +24,13 @@ def add_to_alias(client, index_name, alias=None):
     if not alias: # This prevents _all from being aliased by accident...
         logger.error('No alias provided.')
         return False
-    if not client.indices.exists_alias(alias):
+    indices_in_alias = get_alias(client, alias, metadata=metadata)
+    if not indices_in_alias:
         logger.error('Skipping index {0}: Alias {1} does not exist.'.format(index_name, alias))
         return False
     else:
-        indices_in_alias = get_alias(client, alias)
         if not index_name in indices_in_alias:
-            if index_closed(client, index_name):
+            if index_closed(client, index_name, metadata=metadata):
                 logger.error('Failed to add index {0} to alias {1} because it is closed.'.format(index_name, alias))
                 return False
             else:
@@ -38,13 +44,15 @@ def add_to_alias(client, index_name, alias=None):
             logger.info('Skipping index {0}: Index already exists in alias {1}...'.format(index_name, alias))
             return True
 
-def remove_from_alias(client, index_name, alias=None):
+def remove_from_alias(client, index_name, alias=None, metadata=None):
     """
     Remove the indicated index from the specified alias.
 
     :arg client: The Elasticsearch client connection
     :arg index_name: The index name
     :arg alias: Alias name to operate on.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
     :rtype: bool
     """
     if check_csv(index_name):
@@ -53,7 +61,7 @@ def remove_from_alias(client, index_name, alias=None):
     if not alias:
         logger.error('No alias provided.')
         return False
-    indices_in_alias = get_alias(client, alias)
+    indices_in_alias = get_alias(client, alias, metadata=metadata)
     if not indices_in_alias:
         logger.error("Index {0} not found in alias {1}".format(index_name, alias))
         return False
@@ -68,23 +76,77 @@ def remove_from_alias(client, index_name, alias=None):
         logger.warn('Index {0} does not exist in alias {1}; skipping.'.format(index_name, alias))
         return False
 
-def alias(client, indices, alias=None, remove=False):
+def chunk_alias_actions(actions, max_body_size=MAX_ALIAS_BODY_SIZE):
+    """
+    Split a list of ``update_aliases`` actions into lists whose JSON request
+    body stays under `max_body_size` bytes.
+
+    :arg actions: A list of ``add`` or ``remove`` alias actions
+    :arg max_body_size: The maximum request body size, in bytes.
+    :rtype: list of lists
+    """
+    chunks = []
+    chunk = []
+    size = len(json.dumps({'actions': []}))
+    for action in actions:
+        action_size = len(json.dumps(action)) + 2
+        if chunk and size + action_size > max_body_size:
+            chunks.append(chunk)
+            chunk = []
+            size = len(json.dumps({'actions': []}))
+        chunk.append(action)
+        size += action_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def alias(client, indices, alias=None, remove=False, metadata=None):
     """
     Helper method called by the CLI.
 
+    All indices are added to (or removed from) the alias with a single,
+    atomic ``update_aliases`` request, unless the request body would exceed
+    ``MAX_ALIAS_BODY_SIZE``, in which case it is split into as few requests as
+    possible.
+
     :arg client: The Elasticsearch client connection
     :arg indices: A list of indices to act on
     :arg alias: Alias name to operate on.
     :arg remove: If true, remove the alias.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult.  If omitted, one is fetched.
     :rtype: bool
     """
+    if not alias:
+        logger.error('No alias provided.')
+        return False
+    if not metadata:
+        metadata = ClusterMetadataSnapshot(client)
+    indices_in_alias = get_alias(client, alias, metadata=metadata)
+    if not indices_in_alias:
+        logger.error('Alias {0} does not exist.'.format(alias))
+        return False
     retval = True
+    actions = []
     for i in ensure_list(indices):
         if remove:
-            success = remove_from_alias(client, i, alias=alias)
+            if i in indices_in_alias:
+                actions.append({ 'remove': { 'index': i, 'alias': alias}})
+            else:
+                logger.warn('Index {0} does not exist in alias {1}; skipping.'.format(i, alias))
+                retval = False
         else:
-            success = add_to_alias(client, i, alias=alias)
-        # if we fail once, we fail completely
-        if not success:
+            if i in indices_in_alias:
+                logger.info('Skipping index {0}: Index already exists in alias {1}...'.format(i, alias))
+            elif metadata.is_closed(i):
+                logger.error('Failed to add index {0} to alias {1} because it is closed.'.format(i, alias))
+                retval = False
+            else:
+                actions.append({ 'add': { 'index': i, 'alias': alias}})
+    for chunk in chunk_alias_actions(actions):
+        try:
+            client.indices.update_aliases(body={'actions': chunk})
+        except Exception as e:
+            logger.error("Error updating alias {0}.  Exception: {1}  Check logs for more information.".format(alias, e))
             retval = False
     return retval
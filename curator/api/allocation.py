@@ -3,7 +3,7 @@ import elasticsearch
 import logging
 logger = logging.getLogger(__name__)
 
-def apply_allocation_rule(client, indices, rule=None):
+def apply_allocation_rule(client, indices, rule=None, metadata=None):
     """
     Apply a required allocation rule to a list of indices.
 
@@ -12,6 +12,8 @@ def apply_allocation_rule(client, indices, rule=None):
     :arg rule: The routing allocation rule to apply, e.g. ``tag=ssd``.  Must be
         in the format of ``key=value``, and should match values declared on the
         correlating nodes in your cluster.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
     :rtype: bool
 
     .. note::
@@ -23,7 +25,7 @@ def apply_allocation_rule(client, indices, rule=None):
         return False
     key = rule.split('=')[0]
     value = rule.split('=')[1]
-    indices = prune_allocated(client, indices, key, value)
+    indices = prune_allocated(client, indices, key, value, metadata=metadata)
     if not indices:
         logger.warn("No indices to act on.")
         return False
@@ -37,7 +39,7 @@ def apply_allocation_rule(client, indices, rule=None):
         logger.error("Error in updating index settings with allocation rule.  Check logs for more information.")
         return False
 
-def allocation(client, indices, rule=None):
+def allocation(client, indices, rule=None, metadata=None):
     """
     Helper method called by the CLI.
 
@@ -46,6 +48,8 @@ def allocation(client, indices, rule=None):
     :arg rule: The routing allocation rule to apply, e.g. ``tag=ssd``.  Must be
         in the format of ``key=value``, and should match values declared on the
         correlating nodes in your cluster.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
     :rtype: bool
     """
-    return apply_allocation_rule(client, indices, rule=rule)
+    return apply_allocation_rule(client, indices, rule=rule, metadata=metadata)
@@ -4,7 +4,7 @@ import time
 import logging
 logger = logging.getLogger(__name__)
 
-def disable_bloom_filter(client, indices, delay=None):
+def disable_bloom_filter(client, indices, delay=None, metadata=None):
     """
     Disable the bloom filter cache for the list of indices.
     This method will ignore closed indices.
@@ -12,9 +12,11 @@ def disable_bloom_filter(client, indices, delay=None):
     :arg client: The Elasticsearch client connection
     :arg indices: A list of indices to act on
     :arg delay: Pause *n* seconds after operating on each index
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
     :rtype: bool
     """
-    indices = prune_closed(client, indices)
+    indices = prune_closed(client, indices, metadata=metadata)
     no_more_bloom = (1, 4, 0)
     version_number = get_version(client)
     if version_number >= no_more_bloom:
@@ -36,7 +38,8 @@ def disable_bloom_filter(client, indices, delay=None):
 def loop_bloom(client, indices, delay):
     """
     Iterate over list of indices.  Only called from within
-    :py:func:`curator.api.disable_bloom_filter`
+    :py:func:`curator.api.disable_bloom_filter`, which has already pruned
+    closed indices and checked the Elasticsearch version.
 
     :arg client: The Elasticsearch client connection
     :arg indices: A list of indices to act on
@@ -44,22 +47,27 @@ def loop_bloom(client, indices, delay):
     :rtype: bool
     """
     retval = True
-    for i in indices:
-        success = disable_bloom_filter(client, i)
-        # If fail on even one iteration, we fail period
-        if not success:
+    for i in ensure_list(indices):
+        try:
+            client.indices.put_settings(index=i,
+                body='index.codec.bloom.load=false')
+        except Exception:
+            logger.error("Error disabling bloom filter for index {0}.  Check logs for more information.".format(i))
+            # If fail on even one iteration, we fail period
             retval = False
         time.sleep(delay)
     return retval
 
-def bloom(client, indices, delay=None):
+def bloom(client, indices, delay=None, metadata=None):
     """
     Helper method called by the CLI.
 
     :arg client: The Elasticsearch client connection
     :arg indices: A list of indices to act on
     :arg delay: Pause *n* seconds after operating on each index
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
     :rtype: bool
     """
 
-    return disable_bloom_filter(client, indices, delay=delay)
+    return disable_bloom_filter(client, indices, delay=delay, metadata=metadata)
@@ -0,0 +1,319 @@
+from .utils import *
+import os
+import re
+import json
+import time
+import tempfile
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_TTL = 300
+# The fields of each index's metadata which curator reads, and so caches.
+CACHED_INDEX_FIELDS = ['state', 'aliases', 'settings']
+
+def read_json_file(filename):
+    """
+    Return the contents of a JSON file, or `None` if it is missing or can't be
+    read.
+
+    :arg filename: The file to read
+    """
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def write_json_file(filename, data):
+    """
+    Write `data` to a JSON file, replacing it in one step so that a
+    concurrent reader never sees a partial file.  The directory is created if
+    needed.  Failures are logged, not raised.
+
+    :arg filename: The file to write
+    :arg data: A JSON-serializable value
+    """
+    path = os.path.dirname(filename)
+    try:
+        if path and not os.path.isdir(path):
+            os.makedirs(path)
+        fd, tmp = tempfile.mkstemp(dir=path or None, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        try:
+            os.rename(tmp, filename)
+        except OSError:
+            # Windows won't rename over an existing file.
+            os.remove(filename)
+            os.rename(tmp, filename)
+    except (IOError, OSError) as e:
+        logger.warn('Unable to write {0}: {1}'.format(filename, e))
+
+def client_address(client):
+    """
+    Return the ``host:port`` of the first node `client` connects to, or
+    `None` if it can't be told.
+
+    :arg client: The Elasticsearch client connection
+    :rtype: str
+    """
+    try:
+        host = client.transport.hosts[0]
+        return '{0}:{1}'.format(host.get('host', 'localhost'), host.get('port', 9200))
+    except (AttributeError, IndexError, KeyError, TypeError):
+        return None
+
+class MetadataCache(object):
+    """
+    Keep the cluster metadata, Elasticsearch version and snapshot lists on
+    disk between runs, so that frequent runs against a cluster which hasn't
+    changed don't download them again.
+
+    There is one cache file per cluster, named after the cluster name and
+    the address the client connects to, so that clusters which kept the
+    default name don't share one.  Only the state, aliases and settings of
+    each index are kept, not mappings.  Before anything is read from it, the
+    cluster state version and elected master node are fetched with a single,
+    small ``cluster.state`` call.  If either differs from when the file was
+    written, or the cluster UUID of fresh metadata differs from the cached one,
+    the whole file is discarded.  Each entry also expires after `ttl` seconds.
+
+    :arg path: The directory to keep cache files in.  It is created if needed.
+    :arg ttl: Re-read an entry after this many seconds, even if the cluster
+        state hasn't changed. (default: 300)
+    """
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.key = None
+        self.filename = None
+        self.data = None
+
+    def _identity(self, client):
+        state = client.cluster.state(metric='version,master_node')
+        return {
+            'cluster_name': state.get('cluster_name'),
+            'version': state.get('version'),
+            'master_node': state.get('master_node'),
+        }
+
+    def validate(self, client):
+        """
+        Check the cache file against the current cluster state, once per
+        instance, and discard it if it is out of date.
+
+        :arg client: The Elasticsearch client connection
+        """
+        if self.data is not None:
+            return
+        identity = self._identity(client)
+        name = identity['cluster_name'] or 'elasticsearch'
+        address = client_address(client)
+        if address:
+            name = '{0}-{1}'.format(name, address)
+        self.key = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        self.filename = os.path.join(self.path, '{0}.json'.format(self.key))
+        data = self._read()
+        if data and data.get('identity') == identity:
+            logger.debug('Cluster state version {0} matches the cache.'.format(identity['version']))
+            self.data = data
+        else:
+            if data:
+                logger.info('Cluster state has changed.  Discarding the metadata cache.')
+            self.data = {'identity': identity, 'cluster_uuid': None, 'entries': {}}
+
+    def cluster_key(self, client):
+        """
+        Return the cluster name and address which this cluster's cache file
+        is named after, e.g. ``logs-es1_9200``, so that other files kept in
+        the same directory can be named after the cluster too.
+
+        :arg client: The Elasticsearch client connection
+        :rtype: str
+        """
+        self.validate(client)
+        return self.key
+
+    def refresh(self):
+        """
+        Forget what has been read, so that the next read checks the cluster
+        state again.  Call this between runs that share one instance.
+        """
+        self.data = None
+
+    def _read(self):
+        return read_json_file(self.filename)
+
+    def _write(self):
+        write_json_file(self.filename, self.data)
+
+    def get(self, client, key):
+        """
+        Return the cached value of `key`, or `None` if it is missing, expired
+        or out of date.
+
+        :arg client: The Elasticsearch client connection
+        :arg key: The entry name
+        """
+        self.validate(client)
+        entry = self.data['entries'].get(key)
+        if entry is None or time.time() - entry['saved'] > self.ttl:
+            return None
+        logger.debug('Using cached {0}.'.format(key))
+        return entry['value']
+
+    def put(self, client, key, value):
+        """
+        Save `value` as the entry `key`.
+
+        :arg client: The Elasticsearch client connection
+        :arg key: The entry name
+        :arg value: A JSON-serializable value
+        """
+        self.validate(client)
+        self.data['entries'][key] = {'saved': time.time(), 'value': value}
+        self._write()
+
+    def invalidate(self, key=None):
+        """
+        Discard the entry `key`, or the whole cache if `key` is omitted.  Call
+        this after changing the cluster.
+
+        :arg key: The entry name
+        """
+        if self.data is None:
+            # Not read yet, so the file is simply removed.
+            if key is None and self.filename and os.path.exists(self.filename):
+                os.remove(self.filename)
+            return
+        if key is None:
+            self.data['entries'] = {}
+        else:
+            self.data['entries'].pop(key, None)
+        self._write()
+
+    def get_metadata(self, client):
+        """
+        Return a :py:class:`curator.api.ClusterMetadataSnapshot` of all
+        indices, from the cache if it is still current.
+
+        :arg client: The Elasticsearch client connection
+        :rtype: :py:class:`curator.api.ClusterMetadataSnapshot`
+        """
+        state = self.get(client, 'metadata')
+        if state is None:
+            state = client.cluster.state(metric='version,master_node,metadata')
+            cluster_uuid = state['metadata'].get('cluster_uuid')
+            if self.data['cluster_uuid'] not in (None, cluster_uuid):
+                logger.info('Cluster UUID has changed.  Discarding the metadata cache.')
+                self.data['entries'] = {}
+            self.data['cluster_uuid'] = cluster_uuid
+            self.data['identity'] = {
+                'cluster_name': state.get('cluster_name'),
+                'version': state.get('version'),
+                'master_node': state.get('master_node'),
+            }
+            self.put(client, 'metadata', {
+                'version': state.get('version'),
+                'metadata': {'indices': dict(
+                    (name, dict(
+                        (k, v) for k, v in index.items()
+                        if k in CACHED_INDEX_FIELDS
+                    ))
+                    for name, index in state['metadata']['indices'].items()
+                )},
+            })
+        return ClusterMetadataSnapshot(client, state=state)
+
+    def get_version(self, client):
+        """
+        Return the Elasticsearch version number as a tuple, from the cache if
+        it is still current.
+
+        :arg client: The Elasticsearch client connection
+        :rtype: tuple
+        """
+        version = self.get(client, 'es_version')
+        if version is None:
+            version = get_version(client)
+            self.put(client, 'es_version', list(version))
+        return tuple(version)
+
+    def get_snapshots(self, client, repository):
+        """
+        Return the list of snapshots in `repository`, from the cache if it is
+        still current.
+
+        :arg client: The Elasticsearch client connection
+        :arg repository: The Elasticsearch snapshot repository to use
+        :rtype: list of strings
+        """
+        key = 'snapshots/{0}'.format(repository)
+        snapshots = self.get(client, key)
+        if snapshots is None:
+            snapshots = get_snapshots(client, repository=repository)
+            if snapshots is not False:
+                self.put(client, key, snapshots)
+        return snapshots
+
+class SnapshotManifest(object):
+    """
+    Remember, on disk, the fingerprint (see
+    :py:func:`curator.api.get_index_fingerprints`) of each index in each
+    snapshot taken to a repository, so that later snapshots can leave out
+    indices which haven't changed.  Elasticsearch 1.x has nowhere to keep
+    this in the repository itself.
+
+    Repositories on different clusters may share a name, so the manifest
+    file is named after the cluster as well as the repository, e.g.
+    ``logs-es1_9200-backups.snapshots.json``.
+
+    :arg path: The directory to keep manifest files in.  It is created if
+        needed.
+    :arg repository: The Elasticsearch snapshot repository
+    :arg cluster: The cluster the repository belongs to, as returned by
+        :py:meth:`curator.api.MetadataCache.cluster_key`
+    """
+    def __init__(self, path, repository, cluster=None):
+        name = repository
+        if cluster:
+            name = '{0}-{1}'.format(cluster, repository)
+        self.filename = os.path.join(
+            os.path.expanduser(path),
+            '{0}.snapshots.json'.format(re.sub(r'[^A-Za-z0-9_.-]', '_', name))
+        )
+        self.snapshots = read_json_file(self.filename) or {}
+
+    def fingerprints(self, snapshot):
+        """
+        Return the recorded fingerprints of the indices in `snapshot`, keyed by
+        index name.
+
+        :arg snapshot: The snapshot name
+        :rtype: dict
+        """
+        return self.snapshots.get(snapshot, {})
+
+    def record(self, snapshot, fingerprints):
+        """
+        Record the fingerprints of the indices in `snapshot`, and save the
+        manifest.
+
+        :arg snapshot: The snapshot name
+        :arg fingerprints: A dictionary of fingerprints, keyed by index name
+        """
+        self.snapshots[snapshot] = fingerprints
+        write_json_file(self.filename, self.snapshots)
+
+    def prune(self, snapshots):
+        """
+        Forget snapshots which are not in the list `snapshots`, e.g. ones
+        which have been deleted, and save the manifest if any were.
+
+        :arg snapshots: A list of the snapshots in the repository
+        """
+        gone = set(self.snapshots) - set(snapshots)
+        if gone:
+            for snapshot in gone:
+                del self.snapshots[snapshot]
+            write_json_file(self.filename, self.snapshots)
@@ -1,5 +1,7 @@
 from .utils import *
+from .metrics import get_run_metrics
 from datetime import timedelta, datetime, date
+from collections import OrderedDict
 import time
 import re
 import logging
@@ -17,6 +19,101 @@ DATE_REGEX = {
     'S' : '2',
 }
 
+# The same patterns ``time.strptime`` uses for these directives, as named
+# captures, so that a compiled timestring splits a timestamp exactly as
+# ``strptime`` would.
+TIMESTRING_REGEX = {
+    'Y' : r'(?P<Y>\d\d\d\d)',
+    'y' : r'(?P<y>\d\d)',
+    'm' : r'(?P<m>1[0-2]|0[1-9]|[1-9])',
+    'W' : r'(?P<W>5[0-3]|[0-4]\d|\d)',
+    'U' : r'(?P<U>5[0-3]|[0-4]\d|\d)',
+    'd' : r'(?P<d>3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])',
+    'H' : r'(?P<H>2[0-3]|[0-1]\d|\d)',
+    'M' : r'(?P<M>[0-5]\d|\d)',
+    'S' : r'(?P<S>6[0-1]|[0-5]\d|\d)',
+}
+
+# The number of parsed timestamps each TimestringParser remembers.
+TIMESTRING_CACHE_SIZE = 4096
+
+def compile_filter(
+    pattern=None, exclude=False, groupname=None, timestring=None,
+    time_unit=None, method=None, value=None, utc_now=None):
+    """
+    Compile a single filter into a predicate function which takes an index or
+    snapshot name and returns `True` if it passes the filter.  The regular
+    expression is compiled, and the cutoff for time-based filters is
+    calculated, only once.
+
+    The arguments are the same as for :py:func:`curator.api.regex_iterate`.
+
+    :rtype: function
+    """
+    if not pattern:
+        logger.error("Missing required pattern parameter.")
+        return None
+    p = re.compile(pattern)
+    if exclude:
+        return lambda item: not p.search(item)
+    if not groupname:
+        return lambda item: bool(p.match(item))
+    if groupname != "date":
+        return lambda item: False
+    cutoff = get_cutoff(unit_count=value, time_unit=time_unit, utc_now=utc_now)
+    def date_filter(item):
+        m = p.search(item)
+        if m and m.group(groupname):
+            return timestamp_check(
+                m.group(groupname), timestring=timestring,
+                time_unit=time_unit, method=method, value=value,
+                cutoff=cutoff,
+            )
+        return False
+    return date_filter
+
+class FilterPipeline(object):
+    """
+    A list of filters (as collected by the CLI) compiled once and applied in a
+    single pass over the provided items.  An item is kept only if it passes
+    every filter, which is the same result as calling
+    :py:func:`curator.api.regex_iterate` once per filter.
+
+    :arg filters: A list of dictionaries of
+        :py:func:`curator.api.regex_iterate` keyword arguments.
+    :arg utc_now: Used for testing.  Overrides current time with specified time.
+    """
+    def __init__(self, filters=None, utc_now=None):
+        self.predicates = []
+        for f in filters or []:
+            kwargs = dict(f)
+            kwargs.setdefault('utc_now', utc_now)
+            self.predicates.append(compile_filter(**kwargs))
+
+    def __len__(self):
+        return len(self.predicates)
+
+    def matches(self, item):
+        """
+        Return `True` if `item` passes every filter.
+
+        :arg item: An index or snapshot name
+        :rtype: bool
+        """
+        for predicate in self.predicates:
+            if predicate is None or not predicate(item):
+                return False
+        return True
+
+    def apply(self, items):
+        """
+        Return the list of `items` which pass every filter.
+
+        :arg items: A list of indices or snapshots to act on
+        :rtype: list
+        """
+        return [item for item in ensure_list(items) if self.matches(item)]
+
 def regex_iterate(
     items, pattern=None, exclude=False, groupname=None, timestring=None,
     time_unit=None, method=None, value=None, utc_now=None):
@@ -37,35 +134,14 @@ def regex_iterate(
         used for time-based filtering.
     :arg utc_now: Used for testing.  Overrides current time with specified time.
     """
-    if not pattern:
-        logger.error("Missing required pattern parameter.")
+    predicate = compile_filter(
+        pattern=pattern, exclude=exclude, groupname=groupname,
+        timestring=timestring, time_unit=time_unit, method=method,
+        value=value, utc_now=utc_now,
+    )
+    if not predicate:
         return None
-    p = re.compile(pattern)
-    if exclude:
-        return list(filter(lambda x: not p.search(x), items))
-    result = []
-    items = ensure_list(items)
-    for item in items:
-        match = False
-        if groupname:
-            m = p.search(item)
-            if m:
-                if m.group(groupname):
-                    if groupname == "date":
-                        timestamp = m.group(groupname)
-                        # Get a boolean result
-                        match = timestamp_check(
-                            timestamp, timestring=timestring,
-                            time_unit=time_unit, method=method,
-                            value=value, utc_now=utc_now,
-                            )
-        else:
-            m = p.match(item)
-            if m:
-                match = True
-        if match == True:
-            result.append(item)
-    return result
+    return [item for item in ensure_list(items) if predicate(item)]
 
 def get_date_regex(timestring):
     """
@@ -87,6 +163,137 @@ def get_date_regex(timestring):
     logger.debug("regex = {0}".format(regex))
     return regex
 
+class TimestringParser(object):
+    """
+    A reusable parser for timestamps matching an strftime `timestring`.  The
+    timestring is compiled once into a regular expression with named captures,
+    and the :py:class:`datetime.datetime` is built directly from the integer
+    values, which is much faster than calling ``strptime`` for every index.
+    Parsed timestamps are kept in a least-recently-used cache, as many indices
+    (e.g. hourly indices of the same day) share the same timestamp prefix.
+
+    Timestrings with directives not in ``TIMESTRING_REGEX`` are handed to
+    ``strptime`` unchanged.
+
+    :arg timestring: An strftime pattern
+    :arg cache_size: The number of parsed timestamps to remember.
+    """
+    def __init__(self, timestring, cache_size=TIMESTRING_CACHE_SIZE):
+        self.timestring = timestring
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.fields = []
+        self.regex = self._compile(timestring)
+
+    def _compile(self, timestring):
+        regex = ''
+        i = 0
+        while i < len(timestring):
+            curr = timestring[i]
+            if curr == '%' and i + 1 < len(timestring):
+                directive = timestring[i+1]
+                if directive == '%':
+                    regex += '%'
+                elif directive in TIMESTRING_REGEX:
+                    regex += TIMESTRING_REGEX[directive]
+                    self.fields.append(directive)
+                else:
+                    return None
+                i += 2
+            else:
+                regex += re.escape(curr)
+                i += 1
+        try:
+            return re.compile(regex + r'\Z', re.IGNORECASE)
+        except re.error:
+            # A repeated directive, which can't be a repeated named capture.
+            return None
+
+    def _strptime(self, timestamp):
+        # Compensate for week of year by appending '%w' to the timestring
+        # and '1' (Monday) to timestamp
+        timestring = self.timestring
+        if '%W' in timestring or '%U' in timestring:
+            timestring += '%w'
+            timestamp += '1'
+        elif '%m' in timestring:
+            if not '%d' in timestring:
+                timestring += '%d'
+                timestamp += '1'
+        return datetime.strptime(timestamp, timestring)
+
+    def _build(self, timestamp):
+        m = self.regex.match(timestamp) if self.regex else None
+        if not m:
+            return self._strptime(timestamp)
+        values = dict(zip(self.fields, map(int, m.groups())))
+        if 'Y' in values:
+            year = values['Y']
+        elif 'y' in values:
+            year = values['y'] + (2000 if values['y'] <= 68 else 1900)
+        else:
+            year = 1900
+        if 'W' in values or 'U' in values:
+            # Monday of the week, exactly as strptime calculates it.
+            first_weekday = date(year, 1, 1).weekday()
+            day_of_week = 0
+            if 'W' in values:
+                week_of_year = values['W']
+            else:
+                week_of_year = values['U']
+                first_weekday = (first_weekday + 1) % 7
+                day_of_week = 1
+            if week_of_year == 0:
+                julian = 1 + day_of_week - first_weekday
+            else:
+                week_0_length = (7 - first_weekday) % 7
+                julian = 1 + week_0_length + 7 * (week_of_year - 1) + day_of_week
+            return datetime(year, 1, 1) + timedelta(
+                days=julian - 1, hours=values.get('H', 0),
+                minutes=values.get('M', 0), seconds=values.get('S', 0),
+            )
+        if values.get('S', 0) > 59:
+            # Leap seconds are accepted, but not representable.
+            return self._strptime(timestamp)
+        return datetime(
+            year, values.get('m', 1), values.get('d', 1),
+            values.get('H', 0), values.get('M', 0), values.get('S', 0),
+        )
+
+    def parse(self, timestamp):
+        """
+        Return the datetime represented by `timestamp`.  Raises `ValueError`
+        if `timestamp` does not match the timestring.
+
+        :arg timestamp: The timestamp extracted from an index name
+        :rtype: Datetime object
+        """
+        try:
+            result = self.cache.pop(timestamp)
+        except KeyError:
+            result = self._build(timestamp)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[timestamp] = result
+        return result
+
+_TIMESTRING_PARSERS = {}
+
+def get_timestring_parser(timestring):
+    """
+    Return a :py:class:`curator.api.TimestringParser` for `timestring`.  The
+    parser is compiled only once per timestring.
+
+    :arg timestring: An strftime pattern
+    :rtype: :py:class:`curator.api.TimestringParser`
+    """
+    try:
+        return _TIMESTRING_PARSERS[timestring]
+    except KeyError:
+        parser = TimestringParser(timestring)
+        _TIMESTRING_PARSERS[timestring] = parser
+        return parser
+
 def get_datetime(index_timestamp, timestring):
     """
     Return the datetime extracted from the index name, which is the index
@@ -96,20 +303,7 @@ def get_datetime(index_timestamp, timestring):
     :arg timestring: An strftime pattern
     :rtype: Datetime object
     """
-    # Compensate for week of year by appending '%w' to the timestring
-    # and '1' (Monday) to index_timestamp
-    if '%W' in timestring:
-        timestring += '%w'
-        index_timestamp += '1'
-    elif '%U' in timestring:
-        timestring += '%w'
-        index_timestamp += '1'
-    elif '%m' in timestring:
-        if not '%d' in timestring:
-            timestring += '%d'
-            index_timestamp += '1'
-    #logger.debug("index_timestamp: {0}, timestring: {1}, return value: {2}".format(index_timestamp, timestring, datetime.strptime(index_timestamp, timestring)))
-    return datetime.strptime(index_timestamp, timestring)
+    return get_timestring_parser(timestring).parse(index_timestamp)
 
 def get_target_month(month_count, utc_now=None):
     """
@@ -175,7 +369,8 @@ def get_cutoff(unit_count=None, time_unit='days', utc_now=None):
     return cutoff
 
 def timestamp_check(timestamp, timestring=None, time_unit=None,
-                    method='older_than', value=None, utc_now=None):
+                    method='older_than', value=None, utc_now=None,
+                    cutoff=None):
     """
     Check `timestamp` to see if it is `value` * `time_unit`
     `method` (``older_than`` or ``newer_than``) the calculated cutoff.
@@ -186,9 +381,12 @@ def timestamp_check(timestamp, timestring=None, time_unit=None,
     :arg method: ``older_than`` or ``newer_than``.
     :arg value: `time_unit` multiplier used to calculate time window.
     :arg utc_now: Used for testing.  Overrides current time with specified time.
+    :arg cutoff: A precalculated cutoff.  If provided, `value`, `time_unit`
+        and `utc_now` are not used to calculate one.
     :rtype: bool
     """
-    cutoff = get_cutoff(unit_count=value, time_unit=time_unit, utc_now=utc_now)
+    if cutoff is None:
+        cutoff = get_cutoff(unit_count=value, time_unit=time_unit, utc_now=utc_now)
 
     try:
         object_time = get_datetime(timestamp, timestring)
@@ -207,7 +405,9 @@ def timestamp_check(timestamp, timestring=None, time_unit=None,
                         timestamp, method.replace('_', ' '), value, time_unit))
     return False
 
-def filter_by_space(client, indices, disk_space=None, reverse=True):
+def filter_by_space(client, indices, disk_space=None, reverse=True,
+                    metadata=None, include_replicas=False,
+                    max_length=DEFAULT_MAX_INITIAL_LINE_LENGTH - REQUEST_LINE_OVERHEAD):
     """
     Remove indices from the provided list of indices based on space consumed,
     sorted reverse-alphabetically by default.  If you set `reverse` to
@@ -225,6 +425,12 @@ def filter_by_space(client, indices, disk_space=None, reverse=True):
     :arg indices: A list of indices to act on
     :arg disk_space: Filter indices over *n* gigabytes
     :arg reverse: The filtering direction. (default: `True`)
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult for index state.  If omitted, one is fetched for `indices`.
+    :arg include_replicas: Count the size of replica shards, as well as the
+        primaries. (default: `False`)
+    :arg max_length: The largest encoded length of the index list in one
+        request, in bytes.
     :rtype: list
     """
 
@@ -232,28 +438,27 @@ def filter_by_space(client, indices, disk_space=None, reverse=True):
         logger.error("Mising value for disk_space.")
         return False
 
+    start = time.time()
     disk_usage = 0.0
     disk_limit = disk_space * 2**30
     delete_list = []
 
-    not_closed = [i for i in indices if not index_closed(client, i)]
+    not_closed = prune_closed(client, indices, metadata=metadata)
     # Because we're building a csv list of indices to pass, we need to ensure
     # that we actually have at least one index before calling
-    # client.indices.status, otherwise the call will match _all indices, which
+    # client.cat.indices, otherwise the call will match _all indices, which
     # is very bad.
     # See https://github.com/elasticsearch/curator/issues/254
     logger.debug('List of indices found: {0}'.format(not_closed))
     if not_closed:
 
-        stats = client.indices.status(index=to_csv(not_closed))
-
-        sorted_indices = sorted(
-            (
-                (index_name, index_stats['index']['primary_size_in_bytes'])
-                for (index_name, index_stats) in stats['indices'].items()
-            ),
-            reverse=reverse
+        sizes = get_index_sizes(
+            client, not_closed, include_replicas=include_replicas,
+            max_length=max_length,
         )
+        get_run_metrics().record_index_sizes(sizes)
+
+        sorted_indices = sorted(sizes.items(), reverse=reverse)
 
         for index_name, index_size in sorted_indices:
             disk_usage += index_size
@@ -262,4 +467,6 @@ def filter_by_space(client, indices, disk_space=None, reverse=True):
                 delete_list.append(index_name)
             else:
                 logger.info('skipping {0}, summed disk usage is {1:.3f} GB and disk limit is {2:.3f} GB.'.format(index_name, disk_usage/2**30, disk_limit/2**30))
+    get_run_metrics().observe(
+        'curator_filter_by_space_duration_seconds', time.time() - start)
     return delete_list
@@ -0,0 +1,256 @@
+from .utils import *
+import json
+import sys
+import threading
+import time
+from elasticsearch.connection import Urllib3HttpConnection
+import logging
+logger = logging.getLogger(__name__)
+
+# The upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf')]
+# List this many of the functions making the most calls to one API.
+TOP_CALLERS = 10
+# The phases of an action, in the order they are reported.
+PHASES = ['connect', 'select', 'act']
+
+# The action and phase that requests are attributed to, by thread, so that
+# actions run at once each count their own requests.  Worker threads take
+# those of the thread which started them, see bind_request_phase.
+_request_phase = threading.local()
+
+def set_request_phase(phase, action=None):
+    """
+    Attribute the Elasticsearch requests made from now on by this thread to
+    `phase` (e.g. ``select`` or ``act``) of `action` (e.g. ``delete``).
+
+    :arg phase: The phase name
+    :arg action: The action name.  If omitted, the action is unchanged.
+    """
+    if action is not None:
+        _request_phase.action = action
+    _request_phase.phase = phase
+
+def get_request_phase():
+    """
+    Return the current action and phase of this thread, as a tuple.
+
+    :rtype: tuple
+    """
+    return (
+        getattr(_request_phase, 'action', None),
+        getattr(_request_phase, 'phase', None),
+    )
+
+def bind_request_phase(func):
+    """
+    Return a function which calls `func` with the action and phase current
+    now, in this thread.  Give it to a worker thread as its target, so that
+    the worker's requests count towards the action which started it.
+
+    :arg func: The function for the worker thread to run
+    :rtype: function
+    """
+    action, phase = get_request_phase()
+    def bound(*args, **kwargs):
+        set_request_phase(phase, action=action)
+        return func(*args, **kwargs)
+    return bound
+
+def identify_request(frame):
+    """
+    Return the name of the client method making a request, e.g.
+    ``indices.put_settings``, and of the function which called it, e.g.
+    ``index_closed``, from the stack `frame` of the request.  Either is
+    `None` if not found.
+
+    :arg frame: A stack frame inside the client
+    :rtype: tuple
+    """
+    endpoint = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('elasticsearch.client'):
+            name = frame.f_code.co_name
+            if endpoint is None and name != '_wrapped':
+                cls = type(frame.f_locals.get('self')).__name__
+                if cls.endswith('Client'):
+                    endpoint = '{0}.{1}'.format(cls[:-len('Client')].lower(), name)
+                else:
+                    endpoint = name
+        elif not module.startswith(('elasticsearch', 'urllib3', __name__)):
+            return endpoint, frame.f_code.co_name
+        frame = frame.f_back
+    return endpoint, None
+
+class RequestStats(object):
+    """
+    Counts of the Elasticsearch requests made by a client, with their
+    latency, bytes sent and received and errors, by action, phase (see
+    :py:func:`curator.api.set_request_phase`) and client method.  The number
+    of requests each function makes through each client method is kept too,
+    so that loops making one request per index stand out.
+
+    To record the requests of a client, create it with
+    :py:class:`curator.api.InstrumentedConnection`, e.g.::
+
+        stats = RequestStats()
+        client = elasticsearch.Elasticsearch(
+            connection_class=InstrumentedConnection, stats=stats)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.callers = {}
+
+    def record(self, endpoint, caller, duration, bytes_out=0, bytes_in=0,
+               error=False):
+        """
+        Record one request, against the current action and phase.
+
+        :arg endpoint: The client method name, e.g. ``cluster.state``
+        :arg caller: The name of the function which called it
+        :arg duration: The time taken, in seconds
+        :arg bytes_out: The size of the request body
+        :arg bytes_in: The size of the response body
+        :arg error: `True` if the request failed
+        """
+        action, phase = get_request_phase()
+        with self.lock:
+            entry = self.endpoints.get((action, phase, endpoint))
+            if entry is None:
+                entry = self.endpoints[(action, phase, endpoint)] = {
+                    'count': 0, 'errors': 0, 'time': 0.0, 'max_time': 0.0,
+                    'bytes_out': 0, 'bytes_in': 0,
+                    'histogram': [0] * len(LATENCY_BUCKETS),
+                }
+            entry['count'] += 1
+            entry['errors'] += 1 if error else 0
+            entry['time'] += duration
+            entry['max_time'] = max(entry['max_time'], duration)
+            entry['bytes_out'] += bytes_out
+            entry['bytes_in'] += bytes_in
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    entry['histogram'][i] += 1
+                    break
+            key = (caller, endpoint)
+            self.callers[key] = self.callers.get(key, 0) + 1
+
+    def totals(self):
+        """
+        Return the total number of requests, errors, time, bytes sent and
+        bytes received.
+
+        :rtype: dict
+        """
+        with self.lock:
+            entries = list(self.endpoints.values())
+        retval = {'count': 0, 'errors': 0, 'time': 0.0, 'bytes_out': 0, 'bytes_in': 0}
+        for entry in entries:
+            for key in retval:
+                retval[key] += entry[key]
+        return retval
+
+    def to_dict(self):
+        """
+        Return the recorded requests, for exporting as JSON.
+
+        :rtype: dict
+        """
+        with self.lock:
+            endpoints = [
+                dict(entry, action=action, phase=phase, endpoint=endpoint)
+                for (action, phase, endpoint), entry in self.endpoints.items()
+            ]
+            callers = [
+                {'caller': caller, 'endpoint': endpoint, 'count': count}
+                for (caller, endpoint), count in self.callers.items()
+            ]
+        endpoints.sort(key=lambda e: (
+            str(e['action']),
+            PHASES.index(e['phase']) if e['phase'] in PHASES else len(PHASES),
+            str(e['phase']), e['endpoint'],
+        ))
+        callers.sort(key=lambda c: -c['count'])
+        return {
+            'totals': self.totals(), 'latency_buckets': [
+                b if b != float('inf') else '+Inf' for b in LATENCY_BUCKETS
+            ],
+            'endpoints': endpoints, 'callers': callers,
+        }
+
+    def report(self):
+        """
+        Return a summary table of the recorded requests.
+
+        :rtype: str
+        """
+        data = self.to_dict()
+        totals = data['totals']
+        lines = [
+            'Elasticsearch requests: {0} in {1:.3f} seconds, {2} errors, {3} bytes sent, {4} bytes received.'.format(
+                totals['count'], totals['time'], totals['errors'],
+                totals['bytes_out'], totals['bytes_in']),
+            '{0:<12} {1:<8} {2:<28} {3:>7} {4:>6} {5:>10} {6:>9} {7:>9} {8:>11}'.format(
+                'ACTION', 'PHASE', 'API', 'CALLS', 'ERRORS', 'TOTAL(s)',
+                'MEAN(ms)', 'MAX(ms)', 'BYTES IN'),
+        ]
+        for e in data['endpoints']:
+            lines.append('{0:<12} {1:<8} {2:<28} {3:>7} {4:>6} {5:>10.3f} {6:>9.1f} {7:>9.1f} {8:>11}'.format(
+                e['action'] or '-', e['phase'] or '-', e['endpoint'] or '-',
+                e['count'], e['errors'], e['time'],
+                1000 * e['time'] / e['count'], 1000 * e['max_time'],
+                e['bytes_in']))
+        repeated = [c for c in data['callers'] if c['count'] > 1][:TOP_CALLERS]
+        if repeated:
+            lines.append('Functions making the most calls:')
+            for c in repeated:
+                lines.append('  {0} -> {1}: {2} calls'.format(
+                    c['caller'] or '-', c['endpoint'] or '-', c['count']))
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        """
+        Write the recorded requests to `filename` as JSON.
+
+        :arg filename: The file to write
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+class InstrumentedConnection(Urllib3HttpConnection):
+    """
+    An elasticsearch-py connection which records each request it sends in a
+    :py:class:`curator.api.RequestStats`.
+
+    :arg stats: The :py:class:`curator.api.RequestStats` to record requests in
+    """
+    def __init__(self, stats=None, **kwargs):
+        super(InstrumentedConnection, self).__init__(**kwargs)
+        self.stats = stats
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        if self.stats is None:
+            return super(InstrumentedConnection, self).perform_request(
+                method, url, params=params, body=body, timeout=timeout,
+                ignore=ignore)
+        endpoint, caller = identify_request(sys._getframe(1))
+        if endpoint is None:
+            endpoint = '{0} {1}'.format(method, url.split('?', 1)[0])
+        start = time.time()
+        try:
+            status, headers, data = super(InstrumentedConnection, self).perform_request(
+                method, url, params=params, body=body, timeout=timeout,
+                ignore=ignore)
+        except Exception:
+            self.stats.record(
+                endpoint, caller, time.time() - start,
+                bytes_out=len(body) if body else 0, error=True)
+            raise
+        self.stats.record(
+            endpoint, caller, time.time() - start,
+            bytes_out=len(body) if body else 0,
+            bytes_in=len(data) if data else 0, error=status >= 400)
+        return status, headers, data
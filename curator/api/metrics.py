@@ -0,0 +1,260 @@
+from .utils import *
+from .instrument import LATENCY_BUCKETS
+import os
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+import logging
+logger = logging.getLogger(__name__)
+
+# The content type of the Prometheus text exposition format.
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The type and help text of each metric.  Counters hold totals since curator
+# started, so a daemon's counters only ever increase.
+METRICS = [
+    ('curator_indices_matched_total', 'counter',
+        'Indices selected by the filters of an action.'),
+    ('curator_indices_acted_total', 'counter',
+        'Indices an action succeeded on.'),
+    ('curator_deleted_bytes_total', 'counter',
+        'Bytes deleted with indices whose size was measured, i.e. selected by --disk-space.'),
+    ('curator_action_duration_seconds', 'summary',
+        'Time taken by each call of an action, e.g. one per chunk of a very large index list.'),
+    ('curator_filter_by_space_duration_seconds', 'summary',
+        'Time taken to measure indices and select them by disk space.'),
+    ('curator_snapshot_duration_seconds', 'summary',
+        'Time taken by each snapshot waited for, from submission to completion.'),
+]
+# The metrics of the Elasticsearch requests in a RequestStats.
+REQUEST_METRICS = [
+    ('curator_http_requests_total', 'counter',
+        'Elasticsearch requests, by action, phase and API.'),
+    ('curator_http_request_errors_total', 'counter',
+        'Elasticsearch requests which failed, by action, phase and API.'),
+    ('curator_http_request_duration_seconds', 'histogram',
+        'Elasticsearch request latency, by action, phase and API.'),
+]
+
+def format_labels(labels):
+    """
+    Return `labels` in the text exposition format, e.g.
+    ``{action="delete"}``, or an empty string if there are none.
+
+    :arg labels: A list of ``(name, value)`` tuples
+    :rtype: str
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    ) + '}'
+
+def format_value(value):
+    """
+    Return a sample value in the text exposition format.
+
+    :arg value: A number
+    :rtype: str
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class RunMetrics(object):
+    """
+    Counters and durations of the work curator does, e.g. the indices matched
+    and acted on by each action, for export to Prometheus by
+    :py:meth:`render`.  The run metrics of this process are returned by
+    :py:func:`curator.api.get_run_metrics`.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.index_sizes = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add `value` to the counter `name`.
+
+        :arg name: The metric name, from ``METRICS``
+        :arg value: The amount to add
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Record a duration of `seconds` in the summary `name`.
+
+        :arg name: The metric name, from ``METRICS``
+        :arg seconds: The duration
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            total, count = self.values.get(key, (0.0, 0))
+            self.values[key] = (total + seconds, count + 1)
+
+    def record_index_sizes(self, sizes):
+        """
+        Remember the sizes of indices, so that the bytes freed by deleting
+        them can be counted.
+
+        :arg sizes: A dictionary of index names and sizes in bytes
+        """
+        with self.lock:
+            self.index_sizes.update(sizes)
+
+    def record_action(self, action, indices, success, duration):
+        """
+        Record a call of `action` on `indices`.
+
+        :arg action: The action name, e.g. ``delete``
+        :arg indices: The list of indices acted on
+        :arg success: `True` if the action succeeded
+        :arg duration: The time taken, in seconds
+        """
+        self.observe(
+            'curator_action_duration_seconds', duration, action=action,
+            result='success' if success else 'failure',
+        )
+        if not success:
+            return
+        self.inc('curator_indices_acted_total', len(indices), action=action)
+        if action == 'delete':
+            with self.lock:
+                sizes = [self.index_sizes.pop(i) for i in indices if i in self.index_sizes]
+            if sizes:
+                self.inc('curator_deleted_bytes_total', sum(sizes))
+
+    def render(self, request_stats=None):
+        """
+        Return the metrics, and those of the requests in `request_stats`, in
+        the Prometheus text exposition format, as read by node-exporter's
+        textfile collector.
+
+        :arg request_stats: A :py:class:`curator.api.RequestStats`, if any
+        :rtype: str
+        """
+        with self.lock:
+            values = dict(self.values)
+        lines = []
+        for name, kind, text in METRICS:
+            samples = sorted((labels, v) for (n, labels), v in values.items() if n == name)
+            if not samples:
+                continue
+            lines += ['# HELP {0} {1}'.format(name, text), '# TYPE {0} {1}'.format(name, kind)]
+            for labels, value in samples:
+                if kind == 'summary':
+                    lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), format_value(value[0])))
+                    lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), value[1]))
+                else:
+                    lines.append('{0}{1} {2}'.format(name, format_labels(labels), format_value(value)))
+        if request_stats is not None:
+            lines += self.render_requests(request_stats)
+        return '\n'.join(lines) + '\n'
+
+    def render_requests(self, request_stats):
+        """
+        Return the lines of the metrics of the requests in `request_stats`.
+
+        :arg request_stats: A :py:class:`curator.api.RequestStats`
+        :rtype: list
+        """
+        endpoints = request_stats.to_dict()['endpoints']
+        if not endpoints:
+            return []
+        requests, errors, duration = REQUEST_METRICS
+        lines = []
+        for (name, kind, text), key in [(requests, 'count'), (errors, 'errors')]:
+            lines += ['# HELP {0} {1}'.format(name, text), '# TYPE {0} {1}'.format(name, kind)]
+            for e in endpoints:
+                labels = [('action', e['action'] or ''), ('endpoint', e['endpoint'] or ''), ('phase', e['phase'] or '')]
+                lines.append('{0}{1} {2}'.format(name, format_labels(labels), e[key]))
+        name, kind, text = duration
+        lines += ['# HELP {0} {1}'.format(name, text), '# TYPE {0} {1}'.format(name, kind)]
+        for e in endpoints:
+            labels = [('action', e['action'] or ''), ('endpoint', e['endpoint'] or ''), ('phase', e['phase'] or '')]
+            count = 0
+            for bound, n in zip(LATENCY_BUCKETS, e['histogram']):
+                count += n
+                lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels + [('le', format_value(bound))]), count))
+            lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), format_value(e['time'])))
+            lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), e['count']))
+        return lines
+
+    def write(self, filename, request_stats=None):
+        """
+        Write the metrics to `filename`, replacing it in one step so that a
+        collector never reads a partial file.
+
+        :arg filename: The file to write, e.g. ``curator.prom`` in the
+            directory of node-exporter's ``--collector.textfile.directory``
+        :arg request_stats: A :py:class:`curator.api.RequestStats`, if any
+        """
+        temp = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(temp, 'w') as f:
+            f.write(self.render(request_stats=request_stats))
+        os.rename(temp, filename)
+
+_run_metrics = RunMetrics()
+
+def get_run_metrics():
+    """
+    Return the :py:class:`curator.api.RunMetrics` of this process, which
+    :py:func:`curator.cli.do_command`, :py:func:`curator.api.filter_by_space`
+    and :py:func:`curator.api.create_snapshot` record in.
+
+    :rtype: :py:class:`curator.api.RunMetrics`
+    """
+    return _run_metrics
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serve the run metrics, and those of the server's `request_stats`, at
+    ``/metrics``.
+    """
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = get_run_metrics().render(
+            request_stats=self.server.request_stats).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request from {0}: {1}'.format(self.client_address[0], format % args))
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def serve_metrics(port, address='', request_stats=None):
+    """
+    Serve the run metrics at ``http://<address>:<port>/metrics`` from a
+    background thread, and return the server.  Call its ``shutdown`` method
+    to stop it.
+
+    :arg port: The port to listen on.  If `0`, a free port is chosen.
+    :arg address: The address to listen on.  All addresses if omitted.
+    :arg request_stats: A :py:class:`curator.api.RequestStats`, if any
+    :rtype: :py:class:`curator.api.MetricsServer`
+    """
+    server = MetricsServer((address, port), MetricsHandler)
+    server.request_stats = request_stats
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info('Serving metrics at http://{0}:{1}/metrics'.format(address or '0.0.0.0', server.server_address[1]))
+    return server
@@ -1,17 +1,23 @@
 from .utils import *
+from .instrument import bind_request_phase
 import elasticsearch
+import threading
 import time
 import logging
 logger = logging.getLogger(__name__)
 
 def optimize_index(client, index_name, max_num_segments=None,
-                request_timeout=21600):
+                request_timeout=21600, metadata=None, segmentcount=None):
     """
     Optimize (Lucene forceMerge) index to `max_num_segments` per shard
 
     :arg client: The Elasticsearch client connection
     :arg index_name: The index name
     :arg max_num_segments: Merge to this number of segments per shard.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
+    :arg segmentcount: A `(shardcount, segmentcount)` tuple, as returned by
+        :py:func:`curator.api.get_segmentcount`, if already known.
     :rtype: bool
     """
     if not max_num_segments:
@@ -20,11 +26,13 @@ def optimize_index(client, index_name, max_num_segments=None,
     if check_csv(index_name):
         logger.error("Must specify only a single index as an argument.")
         return False
-    if index_closed(client, index_name): # Don't try to optimize a closed index
+    if index_closed(client, index_name, metadata=metadata): # Don't try to optimize a closed index
         logger.info('Skipping index {0}: Already closed.'.format(index_name))
         return True
     else:
-        shards, segmentcount = get_segmentcount(client, index_name)
+        if segmentcount is None:
+            segmentcount = get_segmentcount(client, index_name)
+        shards, segmentcount = segmentcount
         logger.debug('Index {0} has {1} shards and {2} segments total.'.format(index_name, shards, segmentcount))
         if segmentcount > (shards * max_num_segments):
             logger.info('Optimizing index {0} to {1} segments per shard.  Please wait...'.format(index_name, max_num_segments))
@@ -38,20 +46,250 @@ def optimize_index(client, index_name, max_num_segments=None,
             logger.info('Skipping index {0}: Already optimized.'.format(index_name))
             return True
 
-def optimize(client, indices, max_num_segments=None, delay=0, request_timeout=21600):
+def get_shard_copies(client, indices,
+                     max_length=DEFAULT_MAX_INITIAL_LINE_LENGTH - REQUEST_LINE_OVERHEAD):
+    """
+    Return the number of shard copies (primary or replica) of each index on
+    each node, keyed by index name and then node name, from ``_cat/shards``,
+    in as few requests as fit `max_length`.  Unassigned shards are not
+    included.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of indices to act on
+    :arg max_length: The largest encoded length of the index list in one
+        request, in bytes.
+    :rtype: dict of dicts
+    """
+    retval = {}
+    for chunk in chunk_index_list(ensure_list(indices), max_length):
+        shards = client.cat.shards(index=to_csv(chunk), h='index,node')
+        for line in shards.splitlines():
+            fields = line.split(None, 1)
+            if len(fields) < 2: # Unassigned shard
+                continue
+            nodes = retval.setdefault(fields[0], {})
+            node = fields[1].strip()
+            nodes[node] = nodes.get(node, 0) + 1
+    return retval
+
+def get_shard_nodes(client, indices):
+    """
+    Return a dictionary of the nodes holding a copy (primary or replica) of
+    any shard of each index, keyed by index name, from ``_cat/shards``.
+    Unassigned shards are not included.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of indices to act on
+    :rtype: dict of sets
+    """
+    return dict(
+        (index, set(nodes))
+        for index, nodes in get_shard_copies(client, indices).items()
+    )
+
+class OptimizeScheduler(object):
+    """
+    Optimize a list of indices, running up to `concurrency` merges at a time
+    across the cluster, and no more than `node_concurrency` merges at a time
+    on any one node.  As a merge runs on every copy of a shard, an index
+    occupies a slot on each node holding a primary or replica of it, as
+    reported by ``_cat/shards``.
+
+    After :py:meth:`run`, `results` holds the success, duration and segment
+    counts before and after the merge for each index.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of open indices to optimize
+    :arg max_num_segments: Merge to this number of segments per shard.
+    :arg delay: Pause *n* seconds after optimizing an index, before its slots
+        are given to another index.
+    :arg request_timeout: Allow this many seconds for each merge.
+    :arg concurrency: The maximum number of merges running in the cluster.
+    :arg node_concurrency: The maximum number of merges running on one node.
+    :arg segmentcounts: A dictionary of `(shardcount, segmentcount)` tuples,
+        as returned by :py:func:`curator.api.get_segmentcounts`.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
+    :arg throttle: A :py:class:`curator.api.Throttle` to wait on before
+        starting each merge.  The shard copies already being merged by this
+        scheduler are not counted as merges running on their nodes.
+    """
+    def __init__(self, client, indices, max_num_segments=None, delay=0,
+                 request_timeout=21600, concurrency=1, node_concurrency=1,
+                 segmentcounts=None, metadata=None, throttle=None):
+        self.client = client
+        self.indices = ensure_list(indices)
+        self.max_num_segments = max_num_segments
+        self.delay = delay
+        self.request_timeout = request_timeout
+        self.concurrency = max(1, concurrency)
+        self.node_concurrency = max(1, node_concurrency)
+        self.segmentcounts = segmentcounts if segmentcounts else {}
+        self.metadata = metadata
+        self.throttle = throttle
+        self.results = {}
+        self.running = 0
+        self.busy_nodes = {}
+        self.merging_shards = {}
+        self.condition = threading.Condition()
+
+    def _available(self, nodes):
+        if self.running >= self.concurrency:
+            return False
+        for node in nodes:
+            if self.busy_nodes.get(node, 0) >= self.node_concurrency:
+                return False
+        return True
+
+    def _acquire(self, nodes):
+        self.running += 1
+        for node, copies in nodes.items():
+            self.busy_nodes[node] = self.busy_nodes.get(node, 0) + 1
+            self.merging_shards[node] = self.merging_shards.get(node, 0) + copies
+
+    def _release(self, nodes):
+        self.running -= 1
+        for node, copies in nodes.items():
+            self.busy_nodes[node] -= 1
+            self.merging_shards[node] -= copies
+
+    def _optimize(self, index_name, nodes):
+        try:
+            before = self.segmentcounts.get(index_name)
+            start = time.time()
+            success = optimize_index(
+                self.client, index_name,
+                max_num_segments=self.max_num_segments,
+                request_timeout=self.request_timeout,
+                metadata=self.metadata, segmentcount=before,
+            )
+            duration = time.time() - start
+            after = None
+            if success:
+                try:
+                    after = get_segmentcount(self.client, index_name)
+                except Exception:
+                    logger.warn('Unable to get segment count of index {0} after optimizing.'.format(index_name))
+            self.results[index_name] = {
+                'success': success,
+                'duration': duration,
+                'segments_before': before[1] if before else None,
+                'segments_after': after[1] if after else None,
+            }
+            if success and before and after:
+                logger.info('Optimized index {0} in {1:.1f} seconds: {2} segments reduced to {3}.'.format(index_name, duration, before[1], after[1]))
+            time.sleep(self.delay)
+        except Exception as e:
+            logger.error('Error optimizing index {0}.  Exception: {1}'.format(index_name, e))
+            self.results[index_name] = {
+                'success': False, 'duration': None,
+                'segments_before': None, 'segments_after': None,
+            }
+        finally:
+            with self.condition:
+                self._release(nodes)
+                self.condition.notify_all()
+
+    def run(self):
+        """
+        Optimize all indices, and return `True` only if every merge succeeded.
+
+        :rtype: bool
+        """
+        if self.concurrency > 1 and self.indices:
+            placement = get_shard_copies(self.client, self.indices)
+        else:
+            placement = {}
+        pending = list(self.indices)
+        threads = []
+        while pending:
+            with self.condition:
+                while True:
+                    for index_name in pending:
+                        nodes = placement.get(index_name, {})
+                        if self._available(nodes):
+                            break
+                    else:
+                        self.condition.wait()
+                        continue
+                    break
+                own_merges = dict(self.merging_shards)
+            # Only this thread takes slots, so the one found stays free while
+            # the throttle waits.  Shards curator is already merging don't
+            # count as load.
+            if self.throttle:
+                self.throttle.wait(own_merges=own_merges)
+            with self.condition:
+                pending.remove(index_name)
+                self._acquire(nodes)
+            logger.debug('Scheduling optimize of index {0} on nodes {1}'.format(index_name, sorted(nodes)))
+            thread = threading.Thread(
+                target=bind_request_phase(self._optimize),
+                args=(index_name, nodes))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.log_summary()
+        return all(r['success'] for r in self.results.values())
+
+    def log_summary(self):
+        """
+        Log the total duration and segment reduction of all merges.
+        """
+        merged = [
+            r for r in self.results.values()
+            if r['success'] and r['segments_after'] is not None
+        ]
+        if merged:
+            logger.info('Optimized {0} indices in {1:.1f} seconds of merge time: {2} segments reduced to {3}.'.format(
+                len(merged), sum(r['duration'] for r in merged),
+                sum(r['segments_before'] for r in merged),
+                sum(r['segments_after'] for r in merged)))
+
+def optimize(client, indices, max_num_segments=None, delay=0,
+            request_timeout=21600, metadata=None, concurrency=1,
+            node_concurrency=1, throttle=None):
     """
     Helper method called by the CLI.
 
     :arg client: The Elasticsearch client connection
     :arg indices: A list of indices to act on
     :arg max_num_segments: Merge to this number of segments per shard.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult.  If omitted, one is fetched for `indices`.
+    :arg concurrency: The maximum number of merges running in the cluster.
+        (default: 1)
+    :arg node_concurrency: The maximum number of merges running on one node.
+        (default: 1)
+    :arg throttle: A :py:class:`curator.api.Throttle` to wait on before
+        starting each merge.
     :rtype: bool
     """
-    retval = True
-    for i in ensure_list(indices):
-        # If we fail once, we fail completely
-        success = optimize_index(client, i, max_num_segments=max_num_segments, request_timeout=request_timeout)
-        if not success:
-            retval = False
-        time.sleep(delay)
-    return retval
+    if not max_num_segments:
+        logger.error("Mising value for max_num_segments.")
+        return False
+    indices = ensure_list(indices)
+    if not metadata:
+        metadata = ClusterMetadataSnapshot(client, indices=indices)
+    # Fetch the segment counts of all open indices in as few requests as fit
+    open_indices = prune_closed(client, indices, metadata=metadata)
+    segmentcounts = get_segmentcounts(client, open_indices) if open_indices else {}
+    to_optimize = []
+    for i in open_indices:
+        if not i in segmentcounts:
+            logger.warn('Skipping index {0}: No segment counts returned.  It may have been deleted.'.format(i))
+            continue
+        shards, segmentcount = segmentcounts[i]
+        if segmentcount > (shards * max_num_segments):
+            to_optimize.append(i)
+        else:
+            logger.info('Skipping index {0}: Already optimized.'.format(i))
+    scheduler = OptimizeScheduler(
+        client, to_optimize, max_num_segments=max_num_segments, delay=delay,
+        request_timeout=request_timeout, concurrency=concurrency,
+        node_concurrency=node_concurrency, segmentcounts=segmentcounts,
+        metadata=metadata, throttle=throttle,
+    )
+    return scheduler.run()
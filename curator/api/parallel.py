@@ -0,0 +1,212 @@
+from .utils import *
+from .instrument import bind_request_phase
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import logging
+logger = logging.getLogger(__name__)
+
+# The number of connections per node kept by the elasticsearch-py transport,
+# unless told otherwise.
+DEFAULT_CONNECTION_POOL_SIZE = 10
+
+def parallel_map(func, items, concurrency=1):
+    """
+    Call `func` on each of `items`, up to `concurrency` at a time, and return
+    the results in the order of `items`.  `items` may be an iterator, which is
+    only read as workers become free.  An exception raised by `func` is
+    logged, and its result is `False`.  Requests made by `func` count towards
+    the action and phase of the caller.
+
+    :arg func: A function of one argument
+    :arg items: A list (or iterator) of arguments to `func`
+    :arg concurrency: The number of calls to make at once.
+    :rtype: list
+    """
+    pending = enumerate(items)
+    results = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                try:
+                    i, item = next(pending)
+                except StopIteration:
+                    return
+            try:
+                retval = func(item)
+            except Exception as e:
+                logger.error('Error in {0}({1}).  Exception: {2}'.format(getattr(func, '__name__', func), item, e))
+                retval = False
+            with lock:
+                results[i] = retval
+
+    workers = [
+        threading.Thread(target=bind_request_phase(worker)) for i in range(0, max(1, concurrency))
+    ]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    for t in workers:
+        t.join()
+    return [results[i] for i in sorted(results)]
+
+def get_pooled_client(concurrency=DEFAULT_CONNECTION_POOL_SIZE, **kwargs):
+    """
+    Return an Elasticsearch client keeping enough connections to each node for
+    `concurrency` requests at once.  Other keyword arguments are passed to
+    ``elasticsearch.Elasticsearch``.
+
+    :arg concurrency: The number of requests to send at once.
+    :rtype: ``elasticsearch.Elasticsearch``
+    """
+    kwargs.setdefault('maxsize', max(concurrency, DEFAULT_CONNECTION_POOL_SIZE))
+    return elasticsearch.Elasticsearch(**kwargs)
+
+class PendingAction(object):
+    """
+    An action submitted to an :py:class:`curator.api.ActionPool`.
+
+    :arg func: The action function
+    :arg args: Its positional arguments
+    :arg kwargs: Its keyword arguments
+    """
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.retval = None
+        self.exception = None
+        self.event = threading.Event()
+
+    def run(self):
+        try:
+            self.retval = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            logger.error('Error in {0}.  Exception: {1}'.format(getattr(self.func, '__name__', self.func), e))
+            self.exception = e
+        finally:
+            self.event.set()
+
+    def done(self):
+        """
+        Return `True` once the action has finished.
+
+        :rtype: bool
+        """
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the action to finish, and return its return value.  If it
+        raised an exception, the exception is raised here.  If it hasn't
+        finished within `timeout` seconds, return `None`.
+
+        :arg timeout: Seconds to wait, or `None` to wait until it finishes.
+        """
+        self.event.wait(timeout)
+        if not self.event.is_set():
+            return None
+        if self.exception is not None:
+            raise self.exception
+        return self.retval
+
+class ActionPool(object):
+    """
+    Run API functions in the background on one client, up to `concurrency` at
+    a time, so that a single process can keep many short requests (per-index
+    checks, snapshot status polls) in flight at once.  Each function is
+    called with the client as its first argument, the same as calling it
+    directly, and its requests count towards the action and phase of the
+    caller, e.g.::
+
+        pool = ActionPool(client, concurrency=50)
+        pending = pool.map(index_closed, indices)
+        closed = [p.result() for p in pending]
+        pool.close()
+
+    The client's connection pool is thread-safe.  Create it with
+    :py:func:`curator.api.get_pooled_client` so that it keeps a connection to
+    each node for every worker.
+
+    :arg client: The Elasticsearch client connection
+    :arg concurrency: The number of functions to run at once.
+    """
+    def __init__(self, client, concurrency=DEFAULT_CONNECTION_POOL_SIZE):
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self.queue = queue.Queue()
+        self.pending = []
+        self.workers = []
+
+    def _worker(self):
+        while True:
+            action = self.queue.get()
+            if action is None:
+                return
+            action.run()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run ``func(client, *args, **kwargs)`` in the background.
+
+        :arg func: An API function taking the client as its first argument
+        :rtype: :py:class:`curator.api.PendingAction`
+        """
+        action = PendingAction(func, (self.client,) + args, kwargs)
+        if len(self.workers) < self.concurrency:
+            t = threading.Thread(target=bind_request_phase(self._worker))
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+        self.pending.append(action)
+        self.queue.put(action)
+        return action
+
+    def map(self, func, items, *args, **kwargs):
+        """
+        Run ``func(client, item, *args, **kwargs)`` in the background for each
+        of `items`.
+
+        :arg func: An API function taking the client as its first argument
+        :arg items: A list of first arguments after the client, e.g. index
+            names
+        :rtype: list of :py:class:`curator.api.PendingAction`
+        """
+        return [self.submit(func, item, *args, **kwargs) for item in items]
+
+    def wait(self):
+        """
+        Wait for every submitted function to finish, and return `True` only if
+        none raised an exception or returned `False`.
+
+        :rtype: bool
+        """
+        pending, self.pending = self.pending, []
+        for action in pending:
+            action.event.wait()
+        return all(
+            a.exception is None and a.retval is not False for a in pending)
+
+    def close(self):
+        """
+        Wait for every submitted function to finish, and stop the workers.
+
+        :rtype: bool
+        """
+        retval = self.wait()
+        for t in self.workers:
+            self.queue.put(None)
+        for t in self.workers:
+            t.join()
+        self.workers = []
+        return retval
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,151 @@
+from .utils import *
+import sys
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+# Seconds between the stack samples of a SamplingProfiler.
+DEFAULT_SAMPLE_INTERVAL = 0.01
+# Samples taken inside these modules are waiting on Elasticsearch.
+ELASTICSEARCH_WAIT_MODULES = ('elasticsearch.connection', 'urllib3')
+# Samples whose innermost frame is one of these (module, function) pairs are
+# of idle threads, e.g. pool workers waiting for a task, a thread joining its
+# workers, or the metrics server waiting for a connection, and are left out.
+IDLE_FRAMES = [
+    ('threading', 'wait'),
+    ('threading', 'join'),
+    ('threading', '_wait_for_tstate_lock'),
+    ('selectors', 'select'),
+    ('socketserver', 'serve_forever'),
+    ('SocketServer', 'serve_forever'),
+]
+# The functions which call ``time.sleep``, as (module, function) pairs.
+# ``time.sleep`` has no Python frame of its own, so the innermost frame of a
+# sleeping thread is the function which called it.  These do their other
+# work, e.g. requests, in deeper frames.
+SLEEP_FRAMES = [
+    ('curator.api.bloom', 'loop_bloom'),
+    ('curator.api.optimize', '_optimize'),
+    ('curator.api.restore', 'wait_for_recovery'),
+    ('curator.api.snapshot', 'create_snapshot'),
+    ('curator.api.snapshot', 'delete'),
+    ('curator.api.snapshot', 'monitor_snapshot'),
+    ('curator.api.throttle', 'wait'),
+    ('curator.cli.daemon', 'run_daemon'),
+    ('curator.cli.utils', 'act'),
+]
+
+def frame_name(frame):
+    """
+    Return the name of the function of a stack frame, with its module, e.g.
+    ``curator.api.filter.regex_iterate``.
+
+    :arg frame: A stack frame
+    :rtype: str
+    """
+    return '{0}.{1}'.format(
+        frame.f_globals.get('__name__', '?'), frame.f_code.co_name)
+
+def sleeping(frame):
+    """
+    Return `True` if `frame`, the innermost Python frame of a thread, is that
+    of one of the functions in ``SLEEP_FRAMES``, so that the thread is in
+    ``time.sleep``.
+
+    :arg frame: A stack frame
+    :rtype: bool
+    """
+    return (frame.f_globals.get('__name__'), frame.f_code.co_name) in SLEEP_FRAMES
+
+class SamplingProfiler(object):
+    """
+    A profiler which samples the stack of every thread each `interval`
+    seconds, and writes the samples in the collapsed-stack format read by
+    ``flamegraph.pl`` and speedscope.  Each stack starts with ``elasticsearch``
+    if the thread was waiting on an Elasticsearch request, ``sleep`` if it was
+    sleeping, e.g. polling a snapshot or waiting for the throttle, and
+    ``local`` otherwise, so that cluster latency, waits and local work form
+    separate towers.
+
+    Its methods are named as those of ``cProfile.Profile``, so that either
+    can profile a run.
+
+    :arg interval: Seconds between samples
+    """
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.running = False
+        self.thread = None
+
+    def enable(self):
+        """Start sampling, from a background thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def disable(self):
+        """Stop sampling."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        me = threading.current_thread().ident
+        while self.running:
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self.sample(frame)
+            time.sleep(self.interval)
+
+    def sample(self, frame):
+        """
+        Record one sample of the stack ending at `frame`.
+
+        :arg frame: The innermost stack frame of a thread
+        """
+        leaf = (frame.f_globals.get('__name__'), frame.f_code.co_name)
+        asleep = sleeping(frame)
+        names = []
+        category = 'local'
+        while frame is not None:
+            if frame.f_globals.get('__name__', '').startswith(ELASTICSEARCH_WAIT_MODULES):
+                category = 'elasticsearch'
+            names.append(frame_name(frame).replace(';', ':'))
+            frame = frame.f_back
+        if category == 'local':
+            if leaf in IDLE_FRAMES:
+                return
+            if asleep:
+                category = 'sleep'
+        names.append(category)
+        stack = ';'.join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def summary(self):
+        """
+        Return the number of samples of local work, of waiting on
+        Elasticsearch, and of sleeping.
+
+        :rtype: dict
+        """
+        retval = {'local': 0, 'elasticsearch': 0, 'sleep': 0}
+        for stack, count in list(self.stacks.items()):
+            category = stack.split(';', 1)[0]
+            retval[category] += count
+        return retval
+
+    def dump_stats(self, filename):
+        """
+        Write the samples to `filename`, one line per distinct stack: the
+        function names from the outermost, separated by ``;``, and the number
+        of samples.
+
+        :arg filename: The file to write
+        """
+        with open(filename, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('{0} {1}\n'.format(stack, count))
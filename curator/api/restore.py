@@ -0,0 +1,251 @@
+from .utils import *
+from .snapshot import MAX_POLL_INTERVAL
+import fnmatch
+import re
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+# The Elasticsearch 1.x defaults of the recovery settings a restore can
+# change, used to put them back if they weren't set before the restore.
+RECOVERY_DEFAULTS = {
+    'indices.recovery.max_bytes_per_sec': '20mb',
+    'cluster.routing.allocation.node_concurrent_recoveries': 2,
+    'cluster.routing.allocation.node_initial_primaries_recoveries': 4,
+}
+
+def set_recovery_settings(client, max_bytes_per_sec=None,
+                          concurrent_recoveries=None):
+    """
+    Apply transient recovery settings to pace a restore, and return the
+    settings to apply afterwards to put them back.
+
+    :arg client: The Elasticsearch client connection
+    :arg max_bytes_per_sec: Limit recovery on each node to this rate, e.g.
+        ``100mb``.
+    :arg concurrent_recoveries: The number of shards each node may recover at
+        once.
+    :rtype: dict
+    """
+    wanted = {}
+    if max_bytes_per_sec:
+        wanted['indices.recovery.max_bytes_per_sec'] = max_bytes_per_sec
+    if concurrent_recoveries:
+        for key in ['cluster.routing.allocation.node_concurrent_recoveries',
+                    'cluster.routing.allocation.node_initial_primaries_recoveries']:
+            wanted[key] = concurrent_recoveries
+    if not wanted:
+        return {}
+    current = client.cluster.get_settings(flat_settings=True)
+    previous = {}
+    for key in wanted:
+        previous[key] = current.get('transient', {}).get(
+            key, current.get('persistent', {}).get(key, RECOVERY_DEFAULTS[key]))
+    logger.info('Setting recovery settings for the restore: {0}'.format(wanted))
+    client.cluster.put_settings(body={'transient': wanted})
+    return previous
+
+def get_latest_snapshot(client, repository, snapshots):
+    """
+    Return the most recently started of the named `snapshots` in
+    `repository`.
+
+    :arg client: The Elasticsearch client connection
+    :arg repository: The Elasticsearch snapshot repository to use
+    :arg snapshots: A list of snapshot names
+    :rtype: str
+    """
+    starts = dict(
+        (s['snapshot'], s['start_time_in_millis'] or 0) for s in
+        get_snapshot_catalogue(
+            client, repository, fields=['snapshot', 'start_time_in_millis'])
+    )
+    return max(snapshots, key=lambda s: (starts.get(s, 0), s))
+
+def restored_index_names(names, indices=None, rename_pattern=None,
+                         rename_replacement=None):
+    """
+    Return the names the indices of a snapshot will have once restored.
+
+    :arg names: The list of indices in the snapshot
+    :arg indices: Restore only these indices (wildcards allowed).
+    :arg rename_pattern: A regular expression matching the index names to
+        rename.
+    :arg rename_replacement: The replacement for `rename_pattern`.  Groups
+        are referred to as ``$1``, as Elasticsearch does.
+    :rtype: list
+    """
+    if indices:
+        names = [
+            n for n in names
+            if any(fnmatch.fnmatch(n, i) for i in ensure_list(indices))
+        ]
+    if rename_pattern and rename_replacement is not None:
+        pattern = re.compile(rename_pattern)
+        replacement = re.sub(r'\$(\d+)', r'\\g<\1>', rename_replacement)
+        names = [pattern.sub(replacement, n) for n in names]
+    return sorted(names)
+
+def get_recovery_progress(client, indices):
+    """
+    Return the recovery progress of all shards of `indices`, from the
+    ``_recovery`` API, as a dictionary with the number of ``shards``, the
+    number ``done``, and the ``total_bytes`` and ``recovered_bytes``.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of indices to act on
+    :rtype: dict
+    """
+    progress = {'shards': 0, 'done': 0, 'total_bytes': 0, 'recovered_bytes': 0}
+    for chunk in chunk_index_list(ensure_list(indices)):
+        recovery = client.indices.recovery(index=to_csv(chunk))
+        for index in recovery.values():
+            for shard in index.get('shards', []):
+                progress['shards'] += 1
+                if shard.get('stage') == 'DONE':
+                    progress['done'] += 1
+                # Elasticsearch 1.5 renamed 'bytes' to 'size'
+                size = shard.get('index', {}).get('size')
+                if size is None:
+                    size = shard.get('index', {}).get('bytes', {})
+                progress['total_bytes'] += size.get('total_in_bytes', size.get('total', 0))
+                progress['recovered_bytes'] += size.get('recovered_in_bytes', size.get('recovered', 0))
+    return progress
+
+def wait_for_recovery(client, indices, poll_interval=1, timeout=21600):
+    """
+    Wait for every shard of `indices` to finish recovering, logging progress
+    and throughput.  The interval between checks doubles from
+    `poll_interval` seconds, up to ``MAX_POLL_INTERVAL``.  Return `False` if
+    recovery hasn't finished within `timeout` seconds.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of indices to act on
+    :arg poll_interval: Seconds to wait before the first check.
+    :arg timeout: Stop waiting after this many seconds.
+    :rtype: bool
+    """
+    start = time.time()
+    interval = poll_interval
+    while True:
+        time.sleep(min(interval, max(0, start + timeout - time.time())))
+        progress = get_recovery_progress(client, indices)
+        elapsed = time.time() - start
+        logger.info('Restore: {0} of {1} shards recovered.  {2} of {3} bytes ({4:.1f}%) at {5:.0f} bytes/sec.'.format(
+            progress['done'], progress['shards'],
+            progress['recovered_bytes'], progress['total_bytes'],
+            100.0 * progress['recovered_bytes'] / progress['total_bytes'] if progress['total_bytes'] else 100.0,
+            progress['recovered_bytes'] / elapsed if elapsed else 0,
+        ))
+        if progress['shards'] and progress['done'] == progress['shards']:
+            return True
+        if elapsed >= timeout:
+            logger.error('Restore did not finish within {0} seconds.'.format(timeout))
+            return False
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+def restore_snapshot(client, snapshot=None, repository=None, indices=None,
+                     rename_pattern=None, rename_replacement=None,
+                     ignore_unavailable=False, include_global_state=False,
+                     partial=False, no_replicas=True, max_bytes_per_sec=None,
+                     concurrent_recoveries=None, poll_interval=1,
+                     request_timeout=21600):
+    """
+    Restore indices from a snapshot, and wait for them to recover.
+
+    While restoring, the replica count of the restored indices is set to 0 (if
+    `no_replicas`), so only primaries are copied from the repository, and the
+    recovery settings are changed as given.  Afterwards the replica counts
+    and recovery settings are put back.
+
+    :arg client: The Elasticsearch client connection
+    :arg snapshot: The snapshot name
+    :arg repository: The Elasticsearch snapshot repository to use
+    :arg indices: Restore only these indices (wildcards allowed).  All indices
+        in the snapshot are restored if omitted.
+    :arg rename_pattern: A regular expression matching the index names to
+        rename.
+    :arg rename_replacement: The replacement for `rename_pattern`, e.g.
+        ``restored_$1``.
+    :arg ignore_unavailable: Ignore indices missing from the snapshot.
+        (default: `False`)
+    :arg include_global_state: Restore the cluster global state too.
+        (default: `False`)
+    :arg partial: Restore indices even if some of their shards weren't
+        snapshotted. (default: `False`)
+    :arg no_replicas: Restore without replicas, and add them afterwards.
+        (default: `True`)
+    :arg max_bytes_per_sec: Limit recovery on each node to this rate during
+        the restore, e.g. ``100mb``.
+    :arg concurrent_recoveries: The number of shards each node may recover at
+        once during the restore.
+    :arg poll_interval: Seconds to wait before the first progress check.
+    :arg request_timeout: Stop waiting for the restore after this many
+        seconds.
+    :rtype: bool
+    """
+    if not repository:
+        logger.error('Missing required repository parameter')
+        return False
+    if not snapshot:
+        logger.error('Missing required snapshot parameter')
+        return False
+    info = get_snapshot(client, repository=repository, snapshot=snapshot)
+    if not info or not info.get('snapshots'):
+        return False
+    restored = restored_index_names(
+        info['snapshots'][0].get('indices', []), indices=indices,
+        rename_pattern=rename_pattern, rename_replacement=rename_replacement,
+    )
+    if not restored:
+        logger.error('No indices in snapshot {0} to restore.'.format(snapshot))
+        return False
+    body = {
+        'ignore_unavailable': ignore_unavailable,
+        'include_global_state': include_global_state,
+        'partial': partial,
+    }
+    if indices:
+        body['indices'] = to_csv(indices)
+    if rename_pattern and rename_replacement is not None:
+        body['rename_pattern'] = rename_pattern
+        body['rename_replacement'] = rename_replacement
+    logger.info('Restoring {0} indices from snapshot {1}: {2}'.format(len(restored), snapshot, restored))
+    previous = set_recovery_settings(
+        client, max_bytes_per_sec=max_bytes_per_sec,
+        concurrent_recoveries=concurrent_recoveries,
+    )
+    replica_counts = {}
+    try:
+        try:
+            client.snapshot.restore(
+                repository=repository, snapshot=snapshot, body=body,
+                wait_for_completion=False,
+            )
+        except elasticsearch.TransportError as e:
+            logger.error('Unable to restore snapshot {0}.  Exception: {1}'.format(snapshot, e))
+            return False
+        if no_replicas:
+            metadata = ClusterMetadataSnapshot(client, indices=restored)
+            for index in restored:
+                count = metadata.get_setting(index, 'index.number_of_replicas')
+                if count is not None and int(count) > 0:
+                    replica_counts.setdefault(int(count), []).append(index)
+            for chunk in chunk_index_list(sorted(sum(replica_counts.values(), []))):
+                client.indices.put_settings(
+                    index=to_csv(chunk), body='number_of_replicas=0')
+        success = wait_for_recovery(
+            client, restored, poll_interval=poll_interval,
+            timeout=request_timeout,
+        )
+    finally:
+        for count, names in sorted(replica_counts.items()):
+            logger.info('Setting replica count back to {0} for {1} indices.'.format(count, len(names)))
+            for chunk in chunk_index_list(names):
+                client.indices.put_settings(
+                    index=to_csv(chunk),
+                    body='number_of_replicas={0}'.format(count))
+        if previous:
+            logger.info('Putting recovery settings back: {0}'.format(previous))
+            client.cluster.put_settings(body={'transient': previous})
+    return success
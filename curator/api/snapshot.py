@@ -1,11 +1,28 @@
 from .utils import *
+from .cache import SnapshotManifest
+from .parallel import ActionPool
+from .metrics import get_run_metrics
+import time
 import logging
 logger = logging.getLogger(__name__)
 
+# Elasticsearch runs one snapshot, restore or snapshot deletion at a time per
+# cluster, and rejects any other with this exception.
+CONCURRENT_SNAPSHOT_EXCEPTION = 'ConcurrentSnapshotExecutionException'
+# The longest wait between retries of a rejected snapshot deletion, in seconds.
+MAX_RETRY_DELAY = 60
+# The longest wait between progress checks of a running snapshot, in seconds.
+MAX_POLL_INTERVAL = 60
+# Snapshot states, as reported by ``_snapshot/<repository>/<snapshot>/_status``,
+# of snapshots which are still running.
+RUNNING_SNAPSHOT_STATES = ['INIT', 'STARTED', 'IN_PROGRESS']
+
 def create_snapshot(client, indices='_all', name=None,
                     prefix='curator-', repository='',
                     ignore_unavailable=False, include_global_state=True,
-                    partial=False, wait_for_completion=True, request_timeout=21600):
+                    partial=False, wait_for_completion=True, request_timeout=21600,
+                    metadata=None, monitor=False, manifest=None,
+                    skip_unchanged=0, queue=False):
     """
     Create a snapshot of provided indices (or ``_all``) that are open.
 
@@ -28,6 +45,22 @@ def create_snapshot(client, indices='_all', name=None,
     :arg partial: Do not fail if primary shard is unavailable. (default:
         `False`)
     :type partial: bool
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
+    :arg monitor: Don't hold a connection open while the snapshot runs.
+        Submit it, then follow it with :py:func:`curator.api.monitor_snapshot`
+        for up to `request_timeout` seconds.  Overrides
+        `wait_for_completion`. (default: `False`)
+    :type monitor: bool
+    :arg manifest: A :py:class:`curator.api.SnapshotManifest` for
+        `repository`, to record the fingerprint of each index snapshotted.
+    :arg skip_unchanged: Leave out indices whose fingerprint is recorded in
+        `manifest` for one of the last `skip_unchanged` successful snapshots
+        in the repository.  See :py:func:`curator.api.plan_snapshot`.
+        (default: `0`)
+    :arg queue: If another snapshot is running, wait for it to finish (for up
+        to `request_timeout` seconds) instead of failing. (default: `False`)
+    :type queue: bool
     :rtype bool:
     """
     # Return True if it is skipped
@@ -35,10 +68,21 @@ def create_snapshot(client, indices='_all', name=None,
         logger.error('Missing required repository parameter')
         return False
     if not indices == '_all':
-        indices = prune_closed(client, indices)
+        indices = prune_closed(client, indices, metadata=metadata)
     if not indices:
         logger.error("No indices provided.")
         return False
+    fingerprints = {}
+    if manifest is not None and not indices == '_all':
+        fingerprints = get_index_fingerprints(client, indices, metadata=metadata)
+        if skip_unchanged:
+            indices = plan_snapshot(
+                client, indices, repository, manifest, last=skip_unchanged,
+                fingerprints=fingerprints,
+            )
+            if not indices:
+                logger.info('No indices have changed since the last {0} snapshots.  Nothing to snapshot.'.format(skip_unchanged))
+                return True
     repo_access = (1, 4, 0)
     version_number = get_version(client)
     if version_number >= repo_access:
@@ -53,18 +97,232 @@ def create_snapshot(client, indices='_all', name=None,
                                 partial=partial)
     name = name if name else prefix + datetime.utcnow().strftime('%Y%m%d%H%M%S')
     logger.info("Snapshot name: {0}".format(name))
-    all_snaps = get_snapshots(client, repository=repository)
-    if name in all_snaps:
-        logger.error("A snapshot with name '{0}' already exists.".format(name))
-        return False
     try:
-        client.snapshot.create(repository=repository, snapshot=name, body=body,
-                                wait_for_completion=wait_for_completion,
-                                request_timeout=request_timeout)
-        return True
+        if snapshot_exists(client, repository, name):
+            logger.error("A snapshot with name '{0}' already exists.".format(name))
+            return False
     except elasticsearch.TransportError:
-        logger.error("Client raised a TransportError.")
+        logger.error("Unable to check for snapshot {0} in repository {1}.".format(name, repository))
+        return False
+    start = time.time()
+    attempt = 0
+    while True:
+        try:
+            client.snapshot.create(repository=repository, snapshot=name, body=body,
+                                    wait_for_completion=wait_for_completion and not monitor,
+                                    request_timeout=request_timeout)
+            break
+        except elasticsearch.TransportError as e:
+            if not queue or not CONCURRENT_SNAPSHOT_EXCEPTION in str(e):
+                logger.error("Client raised a TransportError.")
+                return False
+        delay = min(2 ** attempt, MAX_RETRY_DELAY)
+        if time.time() + delay - start > request_timeout:
+            logger.error('Another snapshot was still running after {0} seconds.  Snapshot {1} to repository {2} was not taken.'.format(request_timeout, name, repository))
+            return False
+        attempt += 1
+        logger.info('Another snapshot is running.  Snapshot {0} to repository {1} is queued.  Retrying in {2} seconds.'.format(name, repository, delay))
+        time.sleep(delay)
+    if manifest is not None and fingerprints:
+        # A snapshot which doesn't succeed is never consulted by
+        # plan_snapshot, so it is safe to record it before it finishes.
+        manifest.record(name, dict(
+            (i, fingerprints[i]) for i in indices if i in fingerprints
+        ))
+    if monitor:
+        retval = monitor_snapshot(
+            client, repository=repository, snapshot=name,
+            timeout=request_timeout, partial=partial,
+        )
+    else:
+        retval = True
+    if monitor or wait_for_completion:
+        get_run_metrics().observe(
+            'curator_snapshot_duration_seconds', time.time() - start,
+            repository=repository, result='success' if retval else 'failure',
+        )
+    return retval
+
+def create_snapshots(client, repositories=None, name=None, prefix='curator-',
+                     concurrency=1, manifest_path=None, manifest_cluster=None,
+                     **kwargs):
+    """
+    Create a snapshot with the same name in each of `repositories`, up to
+    `concurrency` at a time.  Elasticsearch 1.x runs one snapshot at a time
+    per cluster, so a snapshot rejected because another is running is queued
+    until it can start (see the `queue` argument of
+    :py:func:`curator.api.create_snapshot`).  Preparing each snapshot, e.g.
+    checking repository access and planning with `skip_unchanged`, overlaps.
+
+    Other keyword arguments are passed to
+    :py:func:`curator.api.create_snapshot`.
+
+    :arg client: The Elasticsearch client connection
+    :arg repositories: A list of Elasticsearch snapshot repositories
+    :arg name: What to name the snapshots. `prefix` + datestamp if omitted.
+    :arg prefix: Override the default with this value. Defaults to
+        ``curator-``
+    :arg concurrency: The number of repositories to work on at once.
+    :arg manifest_path: The directory holding a
+        :py:class:`curator.api.SnapshotManifest` for each repository, if any.
+    :arg manifest_cluster: The cluster key the manifests are named after (see
+        :py:meth:`curator.api.MetadataCache.cluster_key`)
+    :rtype: bool
+    """
+    if not repositories:
+        logger.error('Missing required repository parameter')
         return False
+    if not isinstance(repositories, (list, tuple)):
+        repositories = [repositories]
+    name = name if name else prefix + datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    if len(repositories) == 1:
+        concurrency = 1
+
+    with ActionPool(client, concurrency=concurrency) as pool:
+        for repository in repositories:
+            if manifest_path:
+                manifest = SnapshotManifest(
+                    manifest_path, repository, cluster=manifest_cluster)
+            else:
+                manifest = None
+            pool.submit(
+                create_snapshot, name=name, prefix=prefix,
+                repository=repository, manifest=manifest,
+                queue=len(repositories) > 1, **kwargs
+            )
+        return pool.wait()
+
+def plan_snapshot(client, indices, repository, manifest, last=1,
+                  fingerprints=None, metadata=None):
+    """
+    Return the provided list of indices, less those which haven't changed
+    since one of the last `last` successful snapshots in `repository`.  An
+    index is unchanged if its current fingerprint (see
+    :py:func:`curator.api.get_index_fingerprints`) is the one `manifest`
+    recorded for it in one of those snapshots.
+
+    Only snapshots which are still in the repository are consulted, so keep
+    at least `last` snapshots when deleting old ones.  An index left out of
+    `last` snapshots in a row is included again.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of indices to act on
+    :arg repository: The Elasticsearch snapshot repository to use
+    :arg manifest: A :py:class:`curator.api.SnapshotManifest` for
+        `repository`
+    :arg last: The number of recent snapshots to consult.
+    :arg fingerprints: The current fingerprints of `indices`, if already
+        known.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to read
+        index UUIDs from.
+    :rtype: list
+    """
+    indices = ensure_list(indices)
+    if fingerprints is None:
+        fingerprints = get_index_fingerprints(client, indices, metadata=metadata)
+    catalogue = list(get_snapshot_catalogue(client, repository))
+    manifest.prune([s['snapshot'] for s in catalogue])
+    recent = sorted(
+        (s for s in catalogue if s['state'] == 'SUCCESS'),
+        key=lambda s: s['start_time_in_millis'] or 0, reverse=True,
+    )[:last]
+    snapshotted = set()
+    for snap in recent:
+        snapshotted.update(manifest.fingerprints(snap['snapshot']).items())
+    retval = [
+        i for i in indices
+        if not i in fingerprints or not (i, fingerprints[i]) in snapshotted
+    ]
+    unchanged = len(indices) - len(retval)
+    if unchanged:
+        logger.info('Leaving out {0} indices unchanged since the last {1} snapshots.'.format(unchanged, len(recent)))
+        logger.debug('Unchanged indices: {0}'.format(sorted(set(indices) - set(retval))))
+    return retval
+
+def log_snapshot_progress(status, rate=None):
+    """
+    Log the shard and byte progress of a running snapshot, from its entry in a
+    ``_status`` response.
+
+    :arg status: One snapshot from a ``snapshot.status`` response
+    :arg rate: The recent rate of progress, in bytes per second.
+    """
+    shards = status.get('shards_stats', {})
+    stats = status.get('stats', {})
+    total = stats.get('total_size_in_bytes', 0)
+    processed = stats.get('processed_size_in_bytes', 0)
+    logger.info('Snapshot {0}: {1}.  Shards: {2} of {3} done, {4} started, {5} failed.  {6} of {7} bytes ({8:.1f}%){9}.'.format(
+        status.get('snapshot'), status.get('state'),
+        shards.get('done', 0), shards.get('total', 0),
+        shards.get('started', 0), shards.get('failed', 0),
+        processed, total, 100.0 * processed / total if total else 100.0,
+        ' at {0:.0f} bytes/sec'.format(rate) if rate is not None else '',
+    ))
+
+def monitor_snapshot(client, repository=None, snapshot=None, poll_interval=1,
+                     timeout=21600, partial=False):
+    """
+    Follow a running snapshot until it finishes, logging its progress.  The
+    snapshot's ``_status`` is checked after `poll_interval` seconds, and the
+    interval doubles after each check, up to ``MAX_POLL_INTERVAL``.
+
+    Return `True` if the snapshot succeeded, or finished ``PARTIAL`` and
+    `partial` is `True`.  Return `False` if it failed, was aborted, or did not
+    finish within `timeout` seconds.
+
+    :arg client: The Elasticsearch client connection
+    :arg repository: The Elasticsearch snapshot repository to use
+    :arg snapshot: The snapshot name
+    :arg poll_interval: Seconds to wait before the first progress check.
+    :arg timeout: Stop following the snapshot after this many seconds.
+    :arg partial: Accept a ``PARTIAL`` snapshot as a success. (default:
+        `False`)
+    :rtype: bool
+    """
+    if not repository:
+        logger.error('Missing required repository parameter')
+        return False
+    if not snapshot:
+        logger.error('Missing required snapshot parameter')
+        return False
+    start = time.time()
+    interval = poll_interval
+    last = None
+    while True:
+        time.sleep(min(interval, max(0, start + timeout - time.time())))
+        try:
+            status = client.snapshot.status(
+                repository=repository, snapshot=snapshot)['snapshots'][0]
+        except (elasticsearch.TransportError, IndexError, KeyError) as e:
+            logger.error('Unable to get the status of snapshot {0}.  Exception: {1}'.format(snapshot, e))
+            return False
+        processed = status.get('stats', {}).get('processed_size_in_bytes', 0)
+        now = time.time()
+        rate = (processed - last[1]) / (now - last[0]) if last and now > last[0] else None
+        last = (now, processed)
+        log_snapshot_progress(status, rate=rate)
+        if not status.get('state') in RUNNING_SNAPSHOT_STATES:
+            break
+        if now - start >= timeout:
+            logger.error('Snapshot {0} did not finish within {1} seconds.  It is still running.'.format(snapshot, timeout))
+            return False
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+    # _status reports a PARTIAL snapshot as SUCCESS, so the final state is
+    # read from the snapshot itself.
+    info = get_snapshot(client, repository=repository, snapshot=snapshot)
+    if info and info.get('snapshots'):
+        state = info['snapshots'][0].get('state')
+    else:
+        state = status.get('state')
+    elapsed = time.time() - start
+    logger.info('Snapshot {0} finished in state {1} after {2:.0f} seconds ({3:.0f} bytes/sec).'.format(snapshot, state, elapsed, last[1] / elapsed if elapsed else 0))
+    if state == 'SUCCESS':
+        return True
+    if state == 'PARTIAL' and partial:
+        logger.warn('Snapshot {0} is PARTIAL.  Some shards were not snapshotted.'.format(snapshot))
+        return True
+    logger.error('Snapshot {0} finished in state {1}.'.format(snapshot, state))
+    return False
 
 def delete_snapshot(client, snapshot=None, repository=None):
     """
@@ -89,3 +347,54 @@ def delete_snapshot(client, snapshot=None, repository=None):
     except elasticsearch.RequestError:
         logger.error("Unable to delete snapshot {0} from repository {1}.  Check logs for more information.".format(snapshot, repository))
         return False
+
+def delete_snapshots(client, snapshots=None, repository=None,
+                     retries=10, retry_delay=1, request_timeout=21600):
+    """
+    Delete the provided list of snapshots from a given repository, one at a
+    time, as Elasticsearch runs a single snapshot deletion per cluster.  A
+    deletion rejected because another snapshot operation is running is
+    retried up to `retries` times, with the delay doubling from `retry_delay`
+    seconds each time (up to ``MAX_RETRY_DELAY``).  The number of snapshots
+    deleted per minute is logged when done.
+
+    :arg client: The Elasticsearch client connection
+    :arg snapshots: A list of snapshot names
+    :arg repository: The Elasticsearch snapshot repository to use
+    :arg retries: The number of times to retry a rejected deletion.
+    :arg retry_delay: Seconds to wait before the first retry.
+    :arg request_timeout: Seconds to wait for each deletion to finish.
+    :rtype: bool
+    """
+    if not repository:
+        logger.error('Missing required repository parameter')
+        return False
+    if not snapshots:
+        logger.error('Missing required snapshots parameter')
+        return False
+    start = time.time()
+
+    def delete(snapshot):
+        attempt = 0
+        while True:
+            try:
+                client.snapshot.delete(
+                    repository=repository, snapshot=snapshot,
+                    request_timeout=request_timeout,
+                )
+                logger.info('Deleted snapshot {0}.'.format(snapshot))
+                return True
+            except elasticsearch.TransportError as e:
+                if not CONCURRENT_SNAPSHOT_EXCEPTION in str(e) or attempt >= retries:
+                    logger.error("Unable to delete snapshot {0} from repository {1}.  Exception: {2}".format(snapshot, repository, e))
+                    return False
+            delay = min(retry_delay * 2 ** attempt, MAX_RETRY_DELAY)
+            attempt += 1
+            logger.debug('Another snapshot operation is running.  Retry {0} of {1} for snapshot {2} in {3} seconds.'.format(attempt, retries, snapshot, delay))
+            time.sleep(delay)
+
+    results = [delete(snapshot) for snapshot in ensure_list(snapshots)]
+    elapsed = time.time() - start
+    deleted = results.count(True)
+    logger.info('Deleted {0} of {1} snapshots in {2:.1f} seconds ({3:.1f} snapshots/min).'.format(deleted, len(results), elapsed, deleted * 60.0 / elapsed if elapsed else 0))
+    return all(results)
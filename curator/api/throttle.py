@@ -0,0 +1,184 @@
+from .utils import *
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+THREAD_POOLS = ['search', 'index', 'bulk']
+# The setting of the disk usage above which Elasticsearch allocates no new
+# shards to a node, and its default.
+DISK_WATERMARK_SETTING = 'cluster.routing.allocation.disk.watermark.low'
+DEFAULT_DISK_WATERMARK = 85
+
+def get_node_load(client):
+    """
+    Return a summary of the load on the busiest nodes, from ``_nodes/stats``:
+
+    * ``merges``: The most merges currently running on one node
+    * ``node_merges``: The merges currently running on each node, by node
+      name
+    * ``heap_percent``: The highest JVM heap usage of any node
+    * ``disk_percent``: The highest disk usage of any node
+    * ``rejected``: The total of rejected search, index and bulk requests
+      since each node started
+
+    :arg client: The Elasticsearch client connection
+    :rtype: dict
+    """
+    load = {
+        'merges': 0, 'node_merges': {}, 'heap_percent': 0, 'disk_percent': 0,
+        'rejected': 0,
+    }
+    stats = client.nodes.stats(metric='indices,jvm,thread_pool,fs')['nodes']
+    for node_id, node in stats.items():
+        try:
+            merges = node['indices']['merges']['current']
+            load['merges'] = max(load['merges'], merges)
+            load['node_merges'][node.get('name', node_id)] = merges
+        except KeyError:
+            pass
+        try:
+            heap = node['jvm']['mem']['heap_used_percent']
+            load['heap_percent'] = max(load['heap_percent'], heap)
+        except KeyError:
+            pass
+        try:
+            total = node['fs']['total']['total_in_bytes']
+            available = node['fs']['total']['available_in_bytes']
+            if total:
+                used = 100.0 * (total - available) / total
+                load['disk_percent'] = max(load['disk_percent'], used)
+        except KeyError:
+            pass
+        for pool in THREAD_POOLS:
+            load['rejected'] += node.get('thread_pool', {}).get(pool, {}).get('rejected', 0)
+    return load
+
+def get_disk_watermark(client):
+    """
+    Return the low disk watermark of the cluster, as a percentage of disk
+    used, from the transient or persistent cluster settings.  If it is not
+    set, or is set as an amount of free space rather than a percentage or
+    ratio, return Elasticsearch's default of 85%.
+
+    :arg client: The Elasticsearch client connection
+    :rtype: float
+    """
+    settings = client.cluster.get_settings(flat_settings=True)
+    value = settings.get('transient', {}).get(
+        DISK_WATERMARK_SETTING,
+        settings.get('persistent', {}).get(DISK_WATERMARK_SETTING))
+    if value is None:
+        return DEFAULT_DISK_WATERMARK
+    value = str(value).strip()
+    try:
+        if value.endswith('%'):
+            return float(value[:-1])
+        return 100 * float(value)
+    except ValueError:
+        logger.debug('Disk watermark {0} is not a percentage.  Using {1}%.'.format(value, DEFAULT_DISK_WATERMARK))
+        return DEFAULT_DISK_WATERMARK
+
+class Throttle(object):
+    """
+    Adapt the pace of heavy operations (optimize, allocation, replica changes,
+    snapshots) to the load on the cluster.  Before each operation,
+    :py:meth:`wait` samples ``_nodes/stats``.  While any node is over a
+    threshold, or search, index or bulk requests have been rejected since the
+    last sample, the delay doubles (up to `max_delay`) and the operation is
+    held back, for at most `max_wait` seconds in total.  Once the cluster is
+    healthy again, the delay is halved with each operation, back down to
+    `min_delay`.
+
+    :arg client: The Elasticsearch client connection
+    :arg max_merges: Pause while any node is running this many merges,
+        besides those curator started itself (see :py:meth:`wait`).
+    :arg max_heap_percent: Pause while any node's heap is this full.
+    :arg max_disk_percent: Pause while any node's disk is this full.  If
+        omitted, the cluster's low disk watermark is read (see
+        :py:func:`curator.api.get_disk_watermark`).
+    :arg min_delay: The shortest pause between operations, in seconds.
+    :arg max_delay: The longest single pause, in seconds.
+    :arg max_wait: Proceed anyway after pausing this many seconds in total.
+    """
+    def __init__(self, client, max_merges=4, max_heap_percent=85,
+                 max_disk_percent=None, min_delay=0, max_delay=300,
+                 max_wait=3600):
+        self.client = client
+        self.max_merges = max_merges
+        self.max_heap_percent = max_heap_percent
+        self.max_disk_percent = max_disk_percent
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.delay = min_delay
+        self.rejected = None
+
+    def overloaded(self, load, own_merges=None):
+        """
+        Return a list of the reasons the cluster is considered overloaded.
+        The list is empty if it is not.
+
+        :arg load: A dictionary, as returned by
+            :py:func:`curator.api.get_node_load`
+        :arg own_merges: The number of merges curator is running itself on
+            each node, by node name, which are not counted.
+        :rtype: list of strings
+        """
+        reasons = []
+        merges = load['merges']
+        if own_merges:
+            merges = max([0] + [
+                n - own_merges.get(node, 0)
+                for node, n in load.get('node_merges', {}).items()
+            ])
+        if merges >= self.max_merges:
+            reasons.append('{0} merges running'.format(merges))
+        if load['heap_percent'] >= self.max_heap_percent:
+            reasons.append('heap {0}% used'.format(load['heap_percent']))
+        if load['disk_percent'] >= self.max_disk_percent:
+            reasons.append('disk {0:.0f}% used'.format(load['disk_percent']))
+        if self.rejected is not None and load['rejected'] > self.rejected:
+            reasons.append('{0} requests rejected'.format(load['rejected'] - self.rejected))
+        return reasons
+
+    def wait(self, own_merges=None):
+        """
+        Block until the cluster can take another heavy operation.
+
+        :arg own_merges: The number of merges curator is running itself on
+            each node, by node name, e.g. the shards of indices it is
+            optimizing.  These don't count towards `max_merges`.
+        """
+        if self.max_disk_percent is None:
+            try:
+                self.max_disk_percent = get_disk_watermark(self.client)
+            except Exception:
+                logger.warn('Unable to read the disk watermark.  Using {0}%.'.format(DEFAULT_DISK_WATERMARK))
+                self.max_disk_percent = DEFAULT_DISK_WATERMARK
+        waited = 0
+        while True:
+            try:
+                load = get_node_load(self.client)
+            except Exception:
+                logger.warn('Unable to get node stats.  Not throttling.')
+                return
+            reasons = self.overloaded(load, own_merges=own_merges)
+            self.rejected = load['rejected']
+            if not reasons:
+                # Below a second, drop straight back to min_delay, so that a
+                # quiet cluster gets no added wait again.
+                if self.delay / 2.0 >= 1:
+                    self.delay = max(self.min_delay, self.delay / 2.0)
+                else:
+                    self.delay = self.min_delay
+                if self.delay:
+                    time.sleep(self.delay)
+                return
+            if waited >= self.max_wait:
+                logger.warn('Cluster still busy after pausing {0:.0f} seconds ({1}).  Proceeding.'.format(waited, ', '.join(reasons)))
+                return
+            self.delay = min(self.max_delay, max(self.delay * 2, 1))
+            pause = min(self.delay, self.max_wait - waited)
+            logger.info('Cluster busy ({0}).  Pausing {1:.0f} seconds.'.format(', '.join(reasons), pause))
+            time.sleep(pause)
+            waited += pause
@@ -1,26 +1,213 @@
 from datetime import timedelta, datetime, date
 import elasticsearch
+from elasticsearch.compat import quote_plus
 import time
 import re
 import sys
 import logging
 logger = logging.getLogger(__name__)
 
-def get_alias(client, alias):
+# Elasticsearch's default http.max_initial_line_length, in bytes.
+DEFAULT_MAX_INITIAL_LINE_LENGTH = 4096
+# Room left in the request line for the method, URL prefix, endpoint, query
+# string and protocol, after the list of indices.
+REQUEST_LINE_OVERHEAD = 1024
+# Index names made only of these characters are not changed by URL encoding.
+URL_SAFE = re.compile(r'^[A-Za-z0-9_.,*-]*$')
+# Snapshot fields kept by get_snapshot_catalogue, by default.
+SNAPSHOT_CATALOGUE_FIELDS = ['snapshot', 'start_time_in_millis', 'state']
+
+class ClusterMetadataSnapshot(object):
+    """
+    A point-in-time copy of the cluster metadata, fetched with a single
+    ``cluster.state`` call.  Index state, settings, aliases and creation dates
+    are all read from this copy, rather than making one request per index.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: Limit the snapshot to this list of indices.  If omitted, the
+        metadata for all indices (open and closed) is fetched.
+    :arg state: A ``cluster.state`` response which includes ``metadata``, to
+        use instead of fetching one.
+    """
+    def __init__(self, client, indices=None, state=None):
+        self.client = client
+        if state is None:
+            self.refresh(indices=indices)
+        else:
+            self.load(state)
+
+    def refresh(self, indices=None):
+        """
+        Re-read the cluster metadata from Elasticsearch.  A long list of
+        `indices` is read in chunks, to keep each request line short enough.
+
+        :arg indices: Limit the snapshot to this list of indices.
+        """
+        if not indices:
+            self.load(self.client.cluster.state(metric='metadata'))
+        else:
+            metadata = {}
+            for chunk in chunk_index_list(ensure_list(indices)):
+                self.load(self.client.cluster.state(
+                    metric='metadata', index=to_csv(chunk)))
+                metadata.update(self.metadata)
+            self.metadata = metadata
+        logger.debug('Cluster metadata fetched for {0} indices.'.format(len(self.metadata)))
+
+    def load(self, state):
+        """
+        Use the metadata in a ``cluster.state`` response.  The cluster state
+        version is kept too, if the response includes it.
+
+        :arg state: A ``cluster.state`` response which includes ``metadata``
+        """
+        self.metadata = state['metadata']['indices']
+        self.version = state.get('version')
+
+    def __contains__(self, index_name):
+        return index_name in self.metadata
+
+    def indices(self):
+        """
+        Return a sorted list of all index names in the snapshot.
+
+        :rtype: list of strings
+        """
+        return sorted(self.metadata)
+
+    def state(self, index_name):
+        """
+        Return the state (``open`` or ``close``) of `index_name`, or `None` if
+        the index is not in the snapshot.
+
+        :arg index_name: The index name
+        :rtype: str
+        """
+        return self.metadata.get(index_name, {}).get('state')
+
+    def is_closed(self, index_name):
+        """
+        Return `True` if `index_name` is closed.
+
+        :arg index_name: The index name
+        :rtype: bool
+        """
+        return self.state(index_name) == 'close'
+
+    def settings(self, index_name):
+        """
+        Return the settings dictionary of `index_name`.
+
+        :arg index_name: The index name
+        :rtype: dict
+        """
+        return self.metadata.get(index_name, {}).get('settings', {})
+
+    def get_setting(self, index_name, key):
+        """
+        Return the value of the setting `key` for `index_name`, e.g.
+        ``index.routing.allocation.require.tag``, or `None` if it is not set.
+        Both nested and flat settings are understood.
+
+        :arg index_name: The index name
+        :arg key: The dotted setting name
+        :rtype: str
+        """
+        settings = self.settings(index_name)
+        if key in settings:
+            return settings[key]
+        value = settings
+        for part in key.split('.'):
+            try:
+                value = value[part]
+            except (KeyError, TypeError):
+                return None
+        return value
+
+    def aliases(self, index_name):
+        """
+        Return the list of aliases pointing to `index_name`.
+
+        :arg index_name: The index name
+        :rtype: list of strings
+        """
+        return list(self.metadata.get(index_name, {}).get('aliases', []))
+
+    def alias_indices(self, alias):
+        """
+        Return a sorted list of the indices in `alias`.
+
+        :arg alias: Alias name
+        :rtype: list of strings
+        """
+        return sorted(
+            i for i in self.metadata if alias in self.aliases(i)
+        )
+
+    def creation_date(self, index_name):
+        """
+        Return the creation date of `index_name`, or `None` if Elasticsearch
+        did not record one (versions prior to 1.4.0).
+
+        :arg index_name: The index name
+        :rtype: Datetime object
+        """
+        value = self.get_setting(index_name, 'index.creation_date')
+        if value is None:
+            return None
+        return datetime.utcfromtimestamp(int(value) / 1000.0)
+
+def get_metadata(client, indices=None, cache=None):
+    """
+    Return a :py:class:`curator.api.ClusterMetadataSnapshot`, or `False` if
+    the cluster metadata could not be read.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: Limit the snapshot to this list of indices.
+    :arg cache: A :py:class:`curator.api.MetadataCache` to read the metadata
+        for all indices from, if it is still current.
+    :rtype: :py:class:`curator.api.ClusterMetadataSnapshot`
+    """
+    try:
+        if cache is not None and not indices:
+            return cache.get_metadata(client)
+        return ClusterMetadataSnapshot(client, indices=indices)
+    except Exception:
+        logger.error("Failed to get cluster metadata.")
+        return False
+
+def get_alias(client, alias, metadata=None):
     """
     Return information about the specified alias.
 
     :arg client: The Elasticsearch client connection
     :arg alias: Alias name to operate on.
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
     :rtype: list of strings
     """
-    if client.indices.exists_alias(alias):
+    if metadata:
+        indices = metadata.alias_indices(alias)
+        if indices:
+            return indices
+    elif client.indices.exists_alias(alias):
         return client.indices.get_alias(name=alias).keys()
-    else:
-        logger.error('Unable to find alias {0}.'.format(alias))
-        return False
+    logger.error('Unable to find alias {0}.'.format(alias))
+    return False
+
+def get_indices(client, metadata=None):
+    """
+    Return a list of all indices, open and closed.
 
-def get_indices(client):
+    :arg client: The Elasticsearch client connection
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
+    :rtype: list of strings
+    """
+    if metadata:
+        indices = metadata.indices()
+        logger.debug("All indices: {0}".format(indices))
+        return indices
     try:
         indices = list(client.indices.get_settings(
             index='*', params={'expand_wildcards': 'open,closed'}))
@@ -80,14 +267,65 @@ def check_csv(value):
         logger.error("Passed value: {0} is not a list or a string but is of type {1}".format(value, type(value)))
         sys.exit(1)
 
-def index_closed(client, index_name):
+def encoded_length(index):
+    """
+    Return the length of `index` once URL-encoded into a request path, the
+    way the Elasticsearch client encodes it.
+
+    :arg index: An index name
+    :rtype: int
+    """
+    if URL_SAFE.match(index):
+        return len(index)
+    return len(quote_plus(index.encode('utf-8'), b',*'))
+
+def index_list_length(indices):
+    """
+    Return the length of the URL-encoded, comma-separated list of `indices`.
+
+    :arg indices: A list of indices to act on.
+    :rtype: int
+    """
+    indices = ensure_list(indices)
+    if not indices:
+        return 0
+    return sum(encoded_length(i) for i in indices) + len(indices) - 1
+
+def chunk_index_list(indices, max_length=DEFAULT_MAX_INITIAL_LINE_LENGTH - REQUEST_LINE_OVERHEAD):
+    """
+    Yield lists of indices whose URL-encoded, comma-separated length is no
+    more than `max_length` bytes.  An index name longer than `max_length` on
+    its own is yielded by itself.  The list is walked once, so this is linear
+    in the number of indices.
+
+    :arg indices: A list of indices to act on.
+    :arg max_length: The largest encoded length of a chunk, in bytes.
+    """
+    chunk = []
+    length = 0
+    for index in indices:
+        size = encoded_length(index)
+        if chunk and length + 1 + size > max_length:
+            yield chunk
+            chunk = []
+            length = 0
+        length += size + (1 if chunk else 0)
+        chunk.append(index)
+    if chunk:
+        yield chunk
+
+def index_closed(client, index_name, metadata=None):
     """
     Return `True` if the indicated index is closed.
 
     :arg client: The Elasticsearch client connection
     :arg index_name: The index name
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult instead of querying the cluster.
     :rtype: bool
     """
+    if metadata:
+        return metadata.is_closed(index_name)
     index_metadata = client.cluster.state(
         index=index_name,
         metric='metadata',
@@ -103,23 +341,121 @@ def get_segmentcount(client, index_name):
     :arg index_name: The index name
     :rtype: tuple
     """
-    shards = client.indices.segments(index=index_name)['indices'][index_name]['shards']
-    segmentcount = 0
-    totalshards = 0 # We will increment this manually to capture all replicas...
-    for shardnum in shards:
-        for shard in range(0,len(shards[shardnum])):
-            segmentcount += shards[shardnum][shard]['num_search_segments']
-            totalshards += 1
-    return totalshards, segmentcount
+    return get_segmentcounts(client, index_name)[index_name]
+
+def get_segmentcounts(client, indices,
+                      max_length=DEFAULT_MAX_INITIAL_LINE_LENGTH - REQUEST_LINE_OVERHEAD):
+    """
+    Return a dictionary of `(shardcount, segmentcount)` tuples, keyed by index
+    name, for all of the provided `indices`, in as few requests as fit
+    `max_length`.  Indices the cluster doesn't report are left out.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of indices to act on
+    :arg max_length: The largest encoded length of the index list in one
+        request, in bytes.
+    :rtype: dict
+    """
+    retval = {}
+    for chunk in chunk_index_list(ensure_list(indices), max_length):
+        segments = client.indices.segments(index=to_csv(chunk))['indices']
+        for index_name in segments:
+            shards = segments[index_name]['shards']
+            segmentcount = 0
+            totalshards = 0 # We will increment this manually to capture all replicas...
+            for shardnum in shards:
+                for shard in range(0,len(shards[shardnum])):
+                    segmentcount += shards[shardnum][shard]['num_search_segments']
+                    totalshards += 1
+            retval[index_name] = (totalshards, segmentcount)
+    return retval
+
+def parse_index_sizes(lines):
+    """
+    Yield `(index, bytes)` tuples from the lines of a ``_cat/indices`` response
+    requested with ``h=index,<size column>`` and ``bytes=b``.  An index whose
+    size isn't reported (e.g. one with unassigned primaries) counts as 0 bytes.
+
+    :arg lines: An iterable of response lines
+    """
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) < 2 or not fields[1].isdigit():
+            logger.warn('No store size reported for {0}.  Counting it as 0 bytes.'.format(fields[0]))
+            yield fields[0], 0
+        else:
+            yield fields[0], int(fields[1])
+
+def get_index_sizes(client, indices, include_replicas=False,
+                    max_length=DEFAULT_MAX_INITIAL_LINE_LENGTH - REQUEST_LINE_OVERHEAD):
+    """
+    Return a dictionary of store sizes in bytes, keyed by index name, for all of
+    the provided `indices`.  Sizes are read from ``_cat/indices``, which returns
+    one short line per index, in as few requests as fit `max_length`.
+
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of indices to act on
+    :arg include_replicas: Count the size of replica shards, as well as the
+        primaries. (default: `False`)
+    :arg max_length: The largest encoded length of the index list in one
+        request, in bytes.
+    :rtype: dict
+    """
+    column = 'store.size' if include_replicas else 'pri.store.size'
+    retval = {}
+    for chunk in chunk_index_list(ensure_list(indices), max_length):
+        response = client.cat.indices(
+            index=to_csv(chunk), bytes='b', h='index,{0}'.format(column))
+        retval.update(parse_index_sizes(response.splitlines()))
+    return retval
+
+def get_index_fingerprints(client, indices, metadata=None,
+                           max_length=DEFAULT_MAX_INITIAL_LINE_LENGTH - REQUEST_LINE_OVERHEAD):
+    """
+    Return a dictionary of fingerprints, keyed by index name, for all of the
+    provided open `indices`.  A fingerprint is the index UUID, primary
+    document count and primary store size, e.g. ``UUID:1000:2048``, so it
+    changes when an index is written to, or deleted and created again.
+    Indices which don't report all three are left out.
 
-def get_version(client):
+    :arg client: The Elasticsearch client connection
+    :arg indices: A list of indices to act on
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to read
+        index UUIDs from.  If omitted, one is fetched for `indices`.
+    :arg max_length: The largest encoded length of the index list in one
+        request, in bytes.
+    :rtype: dict
+    """
+    indices = ensure_list(indices)
+    if metadata is None:
+        metadata = ClusterMetadataSnapshot(client, indices=indices)
+    retval = {}
+    for chunk in chunk_index_list(indices, max_length):
+        response = client.cat.indices(
+            index=to_csv(chunk), bytes='b', h='index,docs.count,pri.store.size')
+        for line in response.splitlines():
+            fields = line.split()
+            if len(fields) < 3 or not (fields[1].isdigit() and fields[2].isdigit()):
+                continue
+            uuid = metadata.get_setting(fields[0], 'index.uuid')
+            if uuid:
+                retval[fields[0]] = '{0}:{1}:{2}'.format(uuid, fields[1], fields[2])
+    return retval
+
+def get_version(client, cache=None):
     """
     Return the ES version number as a tuple.
     Omits trailing tags like -dev, or Beta
 
     :arg client: The Elasticsearch client connection
+    :arg cache: A :py:class:`curator.api.MetadataCache` to read the version
+        number from, if it is still current.
     :rtype: tuple
     """
+    if cache is not None:
+        return cache.get_version(client)
     version = client.info()['version']['number']
     version = version.split('-')[0]
     if len(version.split('.')) > 3:
@@ -174,24 +510,71 @@ def get_snapshot(client, repository='', snapshot=''):
         logger.error("Snapshot: {0} or repository: {1} not found.".format(snapshot, repository))
         return False
 
-def get_snapshots(client, repository=None):
+def snapshot_exists(client, repository, snapshot):
     """
-    Get ``_all`` snapshots from repository and return a list.
+    Return `True` if a snapshot named exactly `snapshot` is in `repository`.
+    Only that snapshot is requested, and only its name is returned.
 
     :arg client: The Elasticsearch client connection
     :arg repository: The Elasticsearch snapshot repository to use
+    :arg snapshot: The snapshot name
+    :rtype: bool
+    """
+    try:
+        response = client.snapshot.get(
+            repository=repository, snapshot=snapshot,
+            filter_path='snapshots.snapshot',
+        )
+    except elasticsearch.NotFoundError:
+        return False
+    return snapshot in [s.get('snapshot') for s in response.get('snapshots', [])]
+
+def get_snapshots(client, repository=None, cache=None):
+    """
+    Get ``_all`` snapshots from repository and return a list.  Only the names
+    are requested, rather than every snapshot's full list of indices.
+
+    :arg client: The Elasticsearch client connection
+    :arg repository: The Elasticsearch snapshot repository to use
+    :arg cache: A :py:class:`curator.api.MetadataCache` to read the snapshot
+        list from, if it is still current.
     :rtype: list of strings
     """
     if not repository:
         logger.error('Missing required repository parameter')
         return False
+    if cache is not None:
+        return cache.get_snapshots(client, repository)
     try:
-        allsnaps = client.snapshot.get(repository=repository, snapshot="_all")['snapshots']
-        return [snap['snapshot'] for snap in allsnaps if 'snapshot' in snap.keys()]
+        return [
+            snap['snapshot'] for snap in
+            get_snapshot_catalogue(client, repository, fields=['snapshot'])
+        ]
     except (elasticsearch.TransportError, elasticsearch.NotFoundError):
         logger.error("Unable to find all snapshots in repository: {0}".format(repository))
         return False
 
+def get_snapshot_catalogue(client, repository, fields=SNAPSHOT_CATALOGUE_FIELDS):
+    """
+    Yield a dictionary of `fields` for each snapshot in `repository`, e.g.
+    ``{'snapshot': 'curator-20150101000000', 'state': 'SUCCESS',
+    'start_time_in_millis': 1420070400000}``.  Other fields, like the list of
+    indices, are left out of the response by Elasticsearch (1.6 and later)
+    and dropped here otherwise.  Snapshots without a name are skipped.
+
+    :arg client: The Elasticsearch client connection
+    :arg repository: The Elasticsearch snapshot repository to use
+    :arg fields: The snapshot fields to keep.
+    """
+    response = client.snapshot.get(
+        repository=repository, snapshot='_all',
+        filter_path=','.join('snapshots.' + f for f in fields),
+    )
+    # An empty list is left out of a filtered response entirely.
+    for snap in response.get('snapshots', []):
+        if 'snapshot' in snap:
+            yield dict((f, snap.get(f)) for f in fields)
+
 def create_snapshot_body(indices, ignore_unavailable=False,
                          include_global_state=True, partial=False):
     """
@@ -236,24 +619,30 @@ def prune_kibana(indices):
         indices.remove('.kibana')
     return indices
 
-def prune_closed(client, indices):
+def prune_closed(client, indices, metadata=None):
     """
     Return list of indices that are not closed.
 
     :arg client: The Elasticsearch client connection
     :arg indices: A list of indices to act on
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult.  If omitted, one is fetched for `indices`.
     :rtype: list
     """
     indices = ensure_list(indices)
+    if not indices:
+        return []
+    if not metadata:
+        metadata = ClusterMetadataSnapshot(client, indices=indices)
     retval = []
     for idx in list(indices):
-        if not index_closed(client, idx):
+        if not metadata.is_closed(idx):
             retval.append(idx)
         else:
             logger.info('Skipping index {0}: Already closed.'.format(idx))
     return sorted(retval)
 
-def prune_allocated(client, indices, key, value):
+def prune_allocated(client, indices, key, value, metadata=None):
     """
     Return list of indices that do not have the routing allocation rule of
     `key=value`
@@ -262,18 +651,28 @@ def prune_allocated(client, indices, key, value):
     :arg indices: A list of indices to act on
     :arg key: The allocation attribute to check for
     :arg value: The value to check for
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` to
+        consult.  If omitted, the settings of `indices` are fetched in as few
+        calls as fit the request line.
     :rtype: list
     """
     indices = ensure_list(indices)
+    if not indices:
+        return []
+    setting = 'index.routing.allocation.require.{0}'.format(key)
+    if not metadata:
+        settings = {}
+        for chunk in chunk_index_list(indices):
+            settings.update(client.indices.get_settings(index=to_csv(chunk)))
     retval = []
     for idx in indices:
-        settings = client.indices.get_settings(
-            index=idx,
-        )
-        try:
-            has_routing = settings[idx]['settings']['index']['routing']['allocation']['require'][key] == value
-        except KeyError:
-            has_routing = False
+        if metadata:
+            has_routing = metadata.get_setting(idx, setting) == value
+        else:
+            try:
+                has_routing = settings[idx]['settings']['index']['routing']['allocation']['require'][key] == value
+            except KeyError:
+                has_routing = False
         if has_routing:
             logger.debug('Skipping index {0}: Already has allocation rule {1} applied.'.format(idx, key + "=" + value))
         else:
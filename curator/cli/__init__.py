@@ -8,6 +8,9 @@ from .delete import *
 from .opener import *
 from .optimize import *
 from .replicas import *
+from .restore import *
+from .daemon import *
+from .plan import *
 from .show import *
 from .snapshot import *
 from .index_selection import *
@@ -27,6 +27,18 @@ DEFAULT_ARGS = {
     'debug': False,
     'log_level': 'INFO',
     'logformat': 'default',
+    'throttle': False,
+    'throttle_max_wait': 3600,
+    'chunk_concurrency': 1,
+    'chunk_retries': 0,
+    'max_initial_line_length': None,
+    'cache_dir': None,
+    'cache_ttl': 300,
+    'request_stats': False,
+    'request_stats_file': None,
+    'metrics_file': None,
+    'profile': None,
+    'profile_format': 'pstats',
 }
 
 @click.group()
@@ -42,12 +54,28 @@ DEFAULT_ARGS = {
 @click.option('--loglevel', help='Log level', default=DEFAULT_ARGS['log_level'])
 @click.option('--logfile', help='log file')
 @click.option('--logformat', help='Log output format [default|logstash].', default=DEFAULT_ARGS['logformat'])
+@click.option('--throttle', is_flag=True, help='Pause heavy operations (optimize, allocation, replicas, snapshot) while the cluster is under load.', default=DEFAULT_ARGS['throttle'])
+@click.option('--throttle_max_wait', help='Proceed anyway after pausing this many seconds.', default=DEFAULT_ARGS['throttle_max_wait'], type=int)
+@click.option('--chunk_concurrency', help='Act on this many chunks of a very large index list at once (close, delete, open, replicas).', default=DEFAULT_ARGS['chunk_concurrency'], type=int)
+@click.option('--chunk_retries', help='Retry a failed chunk of a very large index list this many times (close, delete, open, replicas).', default=DEFAULT_ARGS['chunk_retries'], type=int)
+@click.option('--max_initial_line_length', help='Break up index lists to fit requests of this many bytes.  [default: http.max_initial_line_length of the cluster]', default=DEFAULT_ARGS['max_initial_line_length'], type=int)
+@click.option('--cache_dir', help='Keep cluster metadata, version and snapshot lists in this directory between runs, and only re-read them when the cluster changes.', default=DEFAULT_ARGS['cache_dir'])
+@click.option('--cache_ttl', help='Re-read cached cluster information after this many seconds.', default=DEFAULT_ARGS['cache_ttl'], type=int)
+@click.option('--request_stats', is_flag=True, help='Print a summary of the Elasticsearch requests made, by action, phase and API, at exit.', default=DEFAULT_ARGS['request_stats'])
+@click.option('--request_stats_file', help='Write the Elasticsearch request counts, latency and sizes to this JSON file at exit.', default=DEFAULT_ARGS['request_stats_file'])
+@click.option('--metrics_file', help='Write Prometheus metrics of the run (indices matched and acted on, durations, Elasticsearch requests) to this file at exit, e.g. for the node-exporter textfile collector.', default=DEFAULT_ARGS['metrics_file'])
+@click.option('--profile', help='Profile the command, and write the profile to this file at exit. The pstats format profiles only the main thread.', default=DEFAULT_ARGS['profile'])
+@click.option('--profile_format', help='Profile with cProfile and write pstats, or sample stacks and write them collapsed, for flame graphs.', type=click.Choice(['pstats', 'collapsed']), default=DEFAULT_ARGS['profile_format'], show_default=True)
 @click.version_option(version=__version__)
 @click.pass_context
-def cli(ctx, host, url_prefix, port, use_ssl, http_auth, timeout, master_only, dry_run, debug, loglevel, logfile, logformat):
+def cli(ctx, host, url_prefix, port, use_ssl, http_auth, timeout, master_only, dry_run, debug, loglevel, logfile, logformat, throttle, throttle_max_wait, chunk_concurrency, chunk_retries, max_initial_line_length, cache_dir, cache_ttl, request_stats, request_stats_file, metrics_file, profile, profile_format):
     """Curator for Elasticsearch indices. See http://github.com/elasticsearch/curator/wiki
     """
 
+    # Jobs run by `curator daemon` share the daemon's logging setup.
+    if ctx.obj and ctx.obj.get('daemon'):
+        return
+
     # Setup logging
     if debug:
         numeric_log_level = logging.DEBUG
@@ -81,3 +109,18 @@ def cli(ctx, host, url_prefix, port, use_ssl, http_auth, timeout, master_only, d
     # Setting up NullHandler to handle nested elasticsearch.trace Logger
     # instance in elasticsearch python client
     logging.getLogger('elasticsearch.trace').addHandler(NullHandler())
+
+    # Record every request made by the client, and report them at exit
+    if request_stats or request_stats_file or metrics_file or profile:
+        stats = RequestStats()
+        ctx.obj['request_stats'] = stats
+        if request_stats or request_stats_file:
+            ctx.call_on_close(lambda: report_request_stats(
+                stats, echo=request_stats, filename=request_stats_file))
+        if metrics_file:
+            ctx.call_on_close(lambda: report_metrics(metrics_file, stats))
+        # Profile the command, telling Elasticsearch requests from local work
+        if profile:
+            profiler, started = start_profile(profile_format)
+            ctx.call_on_close(lambda: report_profile(
+                profiler, started, profile, stats=stats))
@@ -0,0 +1,282 @@
+import click
+import shlex
+import time
+from datetime import datetime, timedelta
+from .cli import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+# The fields of a cron expression, with their ranges.  The seconds field is
+# optional, and 0 if omitted.
+CRON_FIELDS = [
+    ('second', 0, 59),
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),
+]
+# Look no further ahead than this for the next run of a schedule.
+MAX_CRON_YEARS = 5
+
+def parse_cron_field(field, minimum, maximum):
+    """
+    Return the set of values matched by one field of a cron expression, which
+    may be ``*``, a number, a range ``a-b``, any of these with a step
+    ``/n``, or a comma-separated list of them.
+
+    :arg field: The field
+    :arg minimum: The lowest value of the field
+    :arg maximum: The highest value of the field
+    :rtype: set
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError('Invalid step in cron field: {0}'.format(field))
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start, end = [int(x) for x in part.split('-', 1)]
+        else:
+            start = int(part)
+            end = maximum if step > 1 else start
+        if start < minimum or end > maximum or start > end:
+            raise ValueError('Cron field {0} out of range {1}-{2}'.format(field, minimum, maximum))
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule(object):
+    """
+    A cron schedule, with fields ``minute hour day month weekday``, as in
+    crontab, or ``second minute hour day month weekday`` for schedules of
+    less than a minute.  Weekdays are 0-6 (or 7) from Sunday.  As in cron, if
+    both day and weekday are restricted, a time matching either one matches.
+
+    :arg expression: The cron expression
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) == 5:
+            fields = ['0'] + fields
+        if len(fields) != 6:
+            raise ValueError('Invalid cron expression: {0}'.format(expression))
+        (self.seconds, self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = [
+            parse_cron_field(f, lo, hi) for f, (name, lo, hi) in zip(fields, CRON_FIELDS)
+        ]
+        # Both 0 and 7 are Sunday
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - set([7])) | set([0])
+        self.any_day = fields[3] == '*'
+        self.any_weekday = fields[5] == '*'
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_run(self, after):
+        """
+        Return the first time matching the schedule which is later than
+        `after`.
+
+        :arg after: A `datetime`
+        :rtype: `datetime`
+        """
+        dt = after.replace(microsecond=0) + timedelta(seconds=1)
+        limit = after + timedelta(days=366 * MAX_CRON_YEARS)
+        while dt <= limit:
+            if dt.month not in self.months:
+                if dt.month == 12:
+                    dt = dt.replace(year=dt.year + 1, month=1, day=1, hour=0, minute=0, second=0)
+                else:
+                    dt = dt.replace(month=dt.month + 1, day=1, hour=0, minute=0, second=0)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0, second=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt = dt.replace(second=0) + timedelta(minutes=1)
+            else:
+                later = [s for s in self.seconds if s >= dt.second]
+                if later:
+                    return dt.replace(second=min(later))
+                dt = dt.replace(second=0) + timedelta(minutes=1)
+        raise ValueError('Cron expression {0} never matches'.format(self.expression))
+
+class Job(object):
+    """
+    A curator command run on a schedule by ``curator daemon``.
+
+    :arg name: The job name, for logging
+    :arg schedule: A cron expression (see :py:class:`CronSchedule`)
+    :arg command: The curator command, without global options, as a list of
+        arguments or a string
+    """
+    def __init__(self, name, schedule, command):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.args = shlex.split(command) if not isinstance(command, (list, tuple)) else list(command)
+        self.next_run = None
+
+def load_jobs(filename):
+    """
+    Return the list of :py:class:`Job` in a schedule file, e.g. in JSON::
+
+        {"jobs": [
+            {"name": "expire", "schedule": "0 3 * * *",
+             "command": "delete indices --older-than 30 --time-unit days --timestring %Y.%m.%d"},
+            {"name": "snapshot", "schedule": "0 */4 * * *",
+             "command": ["snapshot", "--repository", "backups", "indices", "--all-indices"]}
+        ]}
+
+    :arg filename: The schedule file (JSON, or YAML if PyYAML is installed)
+    :rtype: list
+    """
+    config = load_config_file(filename)
+    jobs = []
+    for i, job in enumerate((config or {}).get('jobs', [])):
+        try:
+            jobs.append(Job(
+                job.get('name', 'job{0}'.format(i + 1)), job['schedule'],
+                job['command'],
+            ))
+        except (KeyError, ValueError) as e:
+            click.echo(click.style('ERROR: Invalid job {0} in {1}: {2}'.format(i + 1, filename, e), fg='red', bold=True))
+            sys.exit(1)
+    return jobs
+
+def params_to_args(command, params):
+    """
+    Return the command-line arguments which would give `command` the option
+    values `params`, leaving out those at their defaults.
+
+    :arg command: A click command
+    :arg params: A dictionary of parameter values
+    :rtype: list
+    """
+    args = []
+    for param in command.params:
+        if not isinstance(param, click.Option) or not param.name in params:
+            continue
+        value = params[param.name]
+        if param.is_flag:
+            if value:
+                args.append(param.opts[0])
+        elif value is not None and value != param.default:
+            args += [param.opts[0], str(value)]
+    return args
+
+def run_job(job, args, client, cache=None):
+    """
+    Run `job` with the global arguments `args` on the open `client`, and
+    return its exit code.
+
+    :arg job: A :py:class:`Job`
+    :arg args: The global command-line arguments
+    :arg client: The Elasticsearch client connection
+    :arg cache: A :py:class:`curator.api.MetadataCache`, if any
+    :rtype: int
+    """
+    logger.info('Running job {0}: {1}'.format(job.name, ' '.join(job.args)))
+    if cache is not None:
+        cache.refresh()
+    start = time.time()
+    try:
+        cli.main(
+            args=args + job.args, standalone_mode=False,
+            obj={'filters': [], 'client': client, 'cache': cache, 'daemon': True},
+        )
+        exit_code = 0
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        else:
+            exit_code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        logger.error('Job {0} failed.  Exception: {1}'.format(job.name, e))
+        exit_code = 1
+    log = logger.info if exit_code == 0 else logger.error
+    log('Job {0} finished with exit code {1} in {2:.3f} seconds.'.format(job.name, exit_code, time.time() - start))
+    return exit_code
+
+def run_daemon(jobs, args, client, cache=None, master_only=False,
+               max_runs=None, metrics_file=None, stats=None):
+    """
+    Run each of `jobs` at the times of its schedule, until interrupted.  A
+    job whose time has passed while another ran is run once, late.  With
+    `master_only`, jobs are skipped unless the client is connected to the
+    elected master node, checked before each job.
+
+    :arg jobs: A list of :py:class:`Job`
+    :arg args: The global command-line arguments
+    :arg client: The Elasticsearch client connection
+    :arg cache: A :py:class:`curator.api.MetadataCache`, if any
+    :arg master_only: Only run jobs on the elected master node.
+    :arg max_runs: Stop after this many jobs have run or been skipped.
+    :arg metrics_file: Write the run metrics to this file after each job.
+    :arg stats: The :py:class:`curator.api.RequestStats` of the client, if
+        any, to include in the metrics.
+    """
+    now = datetime.now()
+    for job in jobs:
+        job.next_run = job.schedule.next_run(now)
+        logger.info('Job {0} scheduled "{1}".  Next run at {2}.'.format(job.name, job.schedule.expression, job.next_run))
+    runs = 0
+    while max_runs is None or runs < max_runs:
+        job = min(jobs, key=lambda j: j.next_run)
+        wait = (job.next_run - datetime.now()).total_seconds()
+        if wait > 0:
+            time.sleep(wait)
+            continue
+        try:
+            is_master = not master_only or is_master_node(client)
+        except Exception as e:
+            logger.error('Unable to check for the elected master.  Exception: {0}'.format(e))
+            is_master = False
+        if is_master:
+            run_job(job, args, client, cache=cache)
+            if metrics_file:
+                report_metrics(metrics_file, stats)
+        else:
+            logger.info('Not connected to the elected master node.  Skipping job {0}.'.format(job.name))
+        job.next_run = job.schedule.next_run(max(datetime.now(), job.next_run))
+        runs += 1
+
+@cli.command('daemon')
+@click.option('--schedule', required=True, type=click.Path(exists=True, dir_okay=False),
+            help='File listing the jobs to run and their cron schedules (JSON, or YAML with PyYAML).')
+@click.option('--metrics_port', type=int,
+            help='Serve Prometheus metrics of the jobs run at http://<host>:<port>/metrics.')
+@click.option('--metrics_address', default='',
+            help='Address to serve metrics on.  [default: all addresses]')
+@click.pass_context
+def daemon(ctx, schedule, metrics_port, metrics_address):
+    """Run commands on cron schedules"""
+    jobs = load_jobs(schedule)
+    if not jobs:
+        click.echo(click.style('No jobs found in {0}.'.format(schedule), fg='red', bold=True))
+        sys.exit(1)
+    params = dict(ctx.parent.params)
+    master_only = params.pop('master_only')
+    cache = get_cache(params)
+    stats = ctx.obj.get('request_stats')
+    if metrics_port is not None and stats is None:
+        stats = RequestStats()
+    client = get_client(cache=cache, stats=stats, **params)
+    args = params_to_args(ctx.parent.command, params)
+    if metrics_port is not None:
+        serve_metrics(metrics_port, address=metrics_address, request_stats=stats)
+    run_daemon(
+        jobs, args, client, cache=cache, master_only=master_only,
+        metrics_file=params['metrics_file'], stats=stats,
+    )
@@ -11,8 +11,13 @@ logger = logging.getLogger(__name__)
 @click.option('--reverse', type=bool, default=True, expose_value=True,
             show_default=True, is_eager=True,
             help='Only valid with --disk-space. Affects sort order of the indices.  True means reverse-alphabetical (if dates are involved, older is deleted first).')
+@click.option('--include-replicas', is_flag=True, expose_value=True,
+            help='Only valid with --disk-space. Count the size of replica shards, as well as the primaries.')
+@click.option('--snapshot-retries', type=int, default=10, expose_value=True,
+            show_default=True,
+            help='Only valid with snapshots. Retry a deletion rejected because another snapshot operation is running this many times.')
 @click.pass_context
-def delete(ctx, disk_space, reverse):
+def delete(ctx, disk_space, reverse, include_replicas, snapshot_retries):
     """Delete indices or snapshots"""
 delete.add_command(indices)
 delete.add_command(snapshots)
@@ -53,9 +53,18 @@ def indices(ctx, newer_than, older_than, prefix, suffix, time_unit,
     logger.info("Job starting...")
     logger.debug("Params: {0}".format(ctx.parent.parent.params))
     # Base and client args are in the grandparent tier of the context
-    client = get_client(**ctx.parent.parent.params)
+    set_request_phase('connect', action=ctx.parent.info_name)
+    client, cache = get_context_client(ctx, ctx.parent.parent.params)
+    if ctx.parent.parent.params['throttle']:
+        throttle = Throttle(
+            client, max_wait=ctx.parent.parent.params['throttle_max_wait'])
+    else:
+        throttle = None
+    # Fetch the cluster metadata once, and share it with every step below
+    set_request_phase('select')
+    metadata = get_metadata(client, cache=cache)
     # Get a master-list of indices
-    indices = get_indices(client)
+    indices = get_indices(client, metadata=metadata)
     logger.debug("Full list of indices: {0}".format(indices))
     if index and not ctx.obj['filters']:
         working_list = []
@@ -72,11 +81,12 @@ def indices(ctx, newer_than, older_than, prefix, suffix, time_unit,
 
     logger.debug('All filters: {0}'.format(ctx.obj['filters']))
 
-    for f in ctx.obj['filters']:
-        if all_indices and not 'exclude' in f:
-            continue
+    filters = [
+        f for f in ctx.obj['filters'] if not all_indices or 'exclude' in f
+    ]
+    for f in filters:
         logger.debug('Filter: {0}'.format(f))
-        working_list = regex_iterate(working_list, **f)
+    working_list = FilterPipeline(filters).apply(working_list)
 
     if ctx.parent.info_name == "delete": # Protect against accidental delete
         logger.info("Pruning Kibana-related indices to prevent accidental deletion.")
@@ -85,18 +95,29 @@ def indices(ctx, newer_than, older_than, prefix, suffix, time_unit,
     # If there are manually added indices, we will add them here
     working_list.extend(in_list(index, indices))
 
+    max_length = None
     if working_list and ctx.parent.info_name == 'delete':
         # If filter by disk space, filter the working_list by space:
         if ctx.parent.params['disk_space']:
+            max_length = get_max_length(
+                client, ctx.parent.parent.params, indices=working_list)
             working_list = filter_by_space(
                                 client, working_list,
                                 disk_space=ctx.parent.params['disk_space'],
-                                reverse=ctx.parent.params['reverse']
+                                reverse=ctx.parent.params['reverse'],
+                                metadata=metadata,
+                                include_replicas=ctx.parent.params['include_replicas'],
+                                max_length=max_length,
                            )
 
+    # Make a sorted, unique list of indices
+    working_list = sorted(list(set(working_list)))
+    get_run_metrics().inc(
+        'curator_indices_matched_total', len(working_list),
+        action=ctx.parent.info_name,
+    )
+
     if working_list:
-        # Make a sorted, unique list of indices
-        working_list = sorted(list(set(working_list)))
         logger.debug('ACTION: {0}. INDICES: {1}'.format(ctx.parent.info_name, working_list))
 
         # Do action here!!! Don't forget to account for DRY_RUN!!!
@@ -108,17 +129,31 @@ def indices(ctx, newer_than, older_than, prefix, suffix, time_unit,
                 logger.info("The following indices would have been altered:")
                 show(working_list)
             else:
-                if len(to_csv(working_list)) > 3072:
+                set_request_phase('act')
+                if cache is not None and ctx.parent.info_name not in CACHE_SAFE_COMMANDS:
+                    cache.invalidate()
+                chunkable = ctx.parent.info_name not in UNCHUNKED_COMMANDS
+                if chunkable and max_length is None:
+                    max_length = get_max_length(
+                        client, ctx.parent.parent.params, indices=working_list)
+                if chunkable and index_list_length(working_list) > max_length:
                     logger.warn('Very large list of indices.  Breaking it up into smaller chunks.')
-                    index_lists = chunk_index_list(working_list)
-                    success = True
-                    for l in index_lists:
-                        retval = do_command(client, ctx.parent.info_name, l, ctx.parent.params)
-                        if not retval:
-                            success = False
+                    index_lists = chunk_index_list(working_list, max_length)
+                    success = do_chunked_command(
+                        client, ctx.parent.info_name, index_lists,
+                        ctx.parent.params, metadata=metadata,
+                        throttle=throttle,
+                        concurrency=ctx.parent.parent.params['chunk_concurrency'],
+                        retries=ctx.parent.parent.params['chunk_retries'],
+                        cache=cache,
+                    )
                     sys.exit(0) if success else sys.exit(1)
                 else:
-                    retval = do_command(client, ctx.parent.info_name, working_list, ctx.parent.params)
+                    retval = do_command(
+                        client, ctx.parent.info_name, working_list,
+                        ctx.parent.params, metadata=metadata,
+                        throttle=throttle, cache=cache,
+                    )
                     sys.exit(0) if retval else sys.exit(1)
 
     else:
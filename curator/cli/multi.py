@@ -0,0 +1,183 @@
+import click
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from .cli import cli
+from .. import __version__
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 9200
+# Options naming a file written by each run of curator, which are given a
+# different file per cluster.
+OUTPUT_OPTIONS = ['--metrics_file', '--request_stats_file', '--profile']
+
+def parse_endpoint(endpoint):
+    """
+    Return the ``curator`` connection arguments for a cluster endpoint, given
+    as ``host``, ``host:port`` or ``http[s]://host[:port][/url_prefix]``.
+
+    :arg endpoint: The cluster endpoint
+    :rtype: list
+    """
+    m = re.match(r'^(?:(https?)://)?([^:/]+)(?::(\d+))?(/.*)?$', endpoint.strip())
+    if not m:
+        raise ValueError('Invalid cluster endpoint: {0}'.format(endpoint))
+    scheme, host, port, url_prefix = m.groups()
+    args = ['--host', host, '--port', port if port else str(DEFAULT_PORT)]
+    if url_prefix and url_prefix.strip('/'):
+        args += ['--url_prefix', url_prefix.strip('/')]
+    if scheme == 'https':
+        args.append('--use_ssl')
+    return args
+
+def read_inventory(filename):
+    """
+    Return the cluster endpoints listed in an inventory file, one per line.
+    Blank lines and lines starting with ``#`` are skipped.
+
+    :arg filename: The inventory file
+    :rtype: list
+    """
+    with open(filename) as f:
+        lines = [l.strip() for l in f]
+    return [l for l in lines if l and not l.startswith('#')]
+
+def cluster_filename(endpoint, filename):
+    """
+    Return `filename` with the cluster at `endpoint` added to its name, before
+    the extension, e.g. ``curator-es1_9200.prom`` for ``curator.prom``.
+
+    :arg endpoint: The cluster endpoint
+    :arg filename: The file name
+    :rtype: str
+    """
+    name = re.sub(r'^https?://', '', endpoint.strip()).strip('/')
+    root, ext = os.path.splitext(filename)
+    return '{0}-{1}{2}'.format(root, re.sub(r'[^\w.-]+', '_', name), ext)
+
+def cluster_args(endpoint, args):
+    """
+    Return `args` with the files named by the ``OUTPUT_OPTIONS`` changed by
+    :py:func:`cluster_filename`, so that the runs against each cluster don't
+    overwrite each other's files.
+
+    :arg endpoint: The cluster endpoint
+    :arg args: The ``curator`` arguments
+    :rtype: list
+    """
+    retval = []
+    rename = False
+    for arg in args:
+        if rename:
+            arg = cluster_filename(endpoint, arg)
+            rename = False
+        elif arg in OUTPUT_OPTIONS:
+            rename = True
+        elif arg.split('=', 1)[0] in OUTPUT_OPTIONS and '=' in arg:
+            option, filename = arg.split('=', 1)
+            arg = '{0}={1}'.format(option, cluster_filename(endpoint, filename))
+        retval.append(arg)
+    return retval
+
+def run_cluster(endpoint, args):
+    """
+    Run ``curator`` with `args` against the cluster at `endpoint`, and return
+    the endpoint, exit code and duration in seconds.
+
+    :arg endpoint: The cluster endpoint
+    :arg args: The ``curator`` arguments, without connection arguments
+    :rtype: tuple
+    """
+    start = time.time()
+    try:
+        cli.main(
+            args=parse_endpoint(endpoint) + list(args),
+            obj={'filters': []}, standalone_mode=False,
+        )
+        exit_code = 0
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        else:
+            exit_code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        logger.error('Error running curator against cluster {0}.  Exception: {1}'.format(endpoint, e))
+        exit_code = 1
+    return endpoint, exit_code, time.time() - start
+
+def _run_cluster(job):
+    return run_cluster(*job)
+
+def run_clusters(endpoints, args, workers=1):
+    """
+    Run ``curator`` with `args` against each cluster in `endpoints`, in up to
+    `workers` processes at once, and return the results of
+    :py:func:`run_cluster` in the order of `endpoints`.
+
+    Each cluster gets a fresh process, so that logging, client state and
+    metrics from one run don't leak into the next.  Files named by the
+    ``OUTPUT_OPTIONS`` are written once per cluster, see
+    :py:func:`cluster_args`.
+
+    :arg endpoints: A list of cluster endpoints
+    :arg args: The ``curator`` arguments, without connection arguments
+    :arg workers: The number of clusters to work on at once.
+    :rtype: list
+    """
+    jobs = [(endpoint, tuple(cluster_args(endpoint, args))) for endpoint in endpoints]
+    pool = multiprocessing.Pool(
+        processes=max(1, min(workers, len(jobs))), maxtasksperchild=1)
+    try:
+        return pool.map(_run_cluster, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+@click.command(context_settings={'ignore_unknown_options': True, 'allow_interspersed_args': False})
+@click.option('--cluster', multiple=True, help='Cluster endpoint, as host, host:port or http[s]://host[:port][/url_prefix]. Can be invoked multiple times.')
+@click.option('--inventory', type=click.Path(exists=True, dir_okay=False), help='File listing cluster endpoints, one per line.')
+@click.option('--workers', default=4, show_default=True, type=int, help='Number of clusters to work on at once.')
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+@click.version_option(version=__version__)
+def multicli(cluster, inventory, workers, args):
+    """
+    Run the same curator command against several clusters at once.
+
+    ARGS are the usual curator arguments, without --host, --port,
+    --url_prefix or --use_ssl, e.g.
+
+    \b
+    curator_multi --inventory clusters.txt -- \\
+        delete indices --older-than 30 --time-unit days --timestring '%Y.%m.%d'
+
+    Exits with 1 if the command failed on any cluster.
+    """
+    endpoints = list(cluster)
+    if inventory:
+        endpoints += read_inventory(inventory)
+    if not endpoints:
+        click.echo(click.style('No clusters given.  Use --cluster or --inventory.', fg='red', bold=True))
+        sys.exit(1)
+    if not args:
+        click.echo(click.style('No curator command given.', fg='red', bold=True))
+        sys.exit(1)
+    for endpoint in endpoints:
+        try:
+            parse_endpoint(endpoint)
+        except ValueError as e:
+            click.echo(click.style(str(e), fg='red', bold=True))
+            sys.exit(1)
+    start = time.time()
+    results = run_clusters(endpoints, args, workers=workers)
+    width = max(len(r[0]) for r in results)
+    for endpoint, exit_code, duration in results:
+        status = click.style('OK', fg='green') if exit_code == 0 else click.style('FAILED (exit code {0})'.format(exit_code), fg='red', bold=True)
+        click.echo('{0}  {1:>8.1f}s  {2}'.format(endpoint.ljust(width), duration, status))
+    failed = len([r for r in results if r[1] != 0])
+    click.echo('{0} of {1} clusters failed in {2:.1f} seconds.'.format(failed, len(results), time.time() - start))
+    sys.exit(1 if failed else 0)
@@ -13,7 +13,14 @@ logger = logging.getLogger(__name__)
 @click.option('--request_timeout', type=int, default=21600, show_default=True,
             expose_value=True,
             help='Allow this many seconds before the transaction times out.')
+@click.option('--concurrency', type=int, default=1, show_default=True,
+            expose_value=True,
+            help='Optimize up to this many indices at once.')
+@click.option('--node_concurrency', type=int, default=1, show_default=True,
+            expose_value=True,
+            help='Optimize up to this many indices at once on any one node.')
 @click.pass_context
-def optimize(ctx, delay, max_num_segments, request_timeout):
+def optimize(ctx, delay, max_num_segments, request_timeout, concurrency,
+             node_concurrency):
     """Optimize Indices"""
 optimize.add_command(indices)
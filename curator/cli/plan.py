@@ -0,0 +1,400 @@
+import click
+from .index_selection import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Index commands a plan can run, and the options each requires.
+PLAN_ACTIONS = {
+    'alias': ['name'],
+    'allocation': ['rule'],
+    'bloom': [],
+    'close': [],
+    'delete': [],
+    'open': [],
+    'optimize': [],
+    'replicas': ['count'],
+    'show': [],
+    'snapshot': ['repository'],
+}
+# Commands which only change index settings, so that consecutive steps can be
+# merged into as few ``put_settings`` calls as possible.
+SETTINGS_ACTIONS = ['allocation', 'replicas']
+# Commands which are pointless on indices a later step deletes.
+PRUNABLE_ACTIONS = ['alias', 'allocation', 'bloom', 'close', 'open', 'optimize', 'replicas']
+# Tasks which change the cluster metadata that later tasks act on, e.g. the
+# state of an index optimize skips if closed, so it's read again after them.
+METADATA_ACTIONS = ['alias', 'close', 'delete', 'open', 'settings']
+# Selection keys, the same as the options of the ``indices`` subcommand.
+SELECTION_KEYS = [
+    'newer_than', 'older_than', 'prefix', 'suffix', 'time_unit',
+    'timestring', 'regex', 'exclude', 'index', 'all_indices',
+]
+
+def selection_filters(selection):
+    """
+    Return the filters for a plan step's index selection, the same as
+    :py:func:`curator.cli.filter_callback` makes from the options of the
+    ``indices`` subcommand.
+
+    :arg selection: A dictionary of ``indices`` options, e.g.
+        ``{"prefix": "logstash-", "older_than": 30, "time_unit": "days",
+        "timestring": "%Y.%m.%d"}``
+    :rtype: list
+    """
+    unknown = set(selection) - set(SELECTION_KEYS)
+    if unknown:
+        raise ValueError('Unknown selection options: {0}'.format(', '.join(sorted(unknown))))
+    filters = []
+    timestring = selection.get('timestring')
+    for key in ['newer_than', 'older_than']:
+        if selection.get(key) is None:
+            continue
+        if not selection.get('time_unit') or not timestring:
+            raise ValueError('{0} requires time_unit and timestring'.format(key))
+        filters.append({
+            'groupname': 'date', 'time_unit': selection['time_unit'],
+            'timestring': timestring, 'value': selection[key], 'method': key,
+            'pattern': REGEX_MAP[key].format(get_date_regex(timestring)),
+        })
+    for key in ['prefix', 'suffix']:
+        if selection.get(key):
+            filters.append({'pattern': REGEX_MAP[key].format(selection[key])})
+    if selection.get('regex'):
+        filters.append({'pattern': r'{0}'.format(selection['regex'])})
+    if timestring and not filters:
+        filters.append({'pattern': REGEX_MAP['timestring'].format(get_date_regex(timestring))})
+    for pattern in ensure_list(selection.get('exclude', [])):
+        filters.append({'pattern': '{0}'.format(pattern), 'exclude': True})
+    if not filters and not selection.get('all_indices') and not selection.get('index'):
+        raise ValueError('At least one filter must be supplied')
+    return filters
+
+def command_params(action, options):
+    """
+    Return the parameters of the command `action`, as the CLI would pass them
+    to :py:func:`curator.cli.do_command`: the defaults of the command's
+    options, updated with `options`.
+
+    :arg action: The command name
+    :arg options: A dictionary of the command's options
+    :rtype: dict
+    """
+    command = cli.commands[action]
+    params = {}
+    multiple = []
+    for param in command.params:
+        params[param.name] = param.default
+        if getattr(param, 'multiple', False):
+            params[param.name] = tuple(param.default or ())
+            multiple.append(param.name)
+    unknown = set(options) - set(params)
+    if unknown:
+        raise ValueError('Unknown {0} options: {1}'.format(action, ', '.join(sorted(unknown))))
+    for key, value in options.items():
+        params[key] = tuple(ensure_list(value)) if key in multiple else value
+    for key in PLAN_ACTIONS[action]:
+        if params[key] is None or params[key] == ():
+            raise ValueError('{0} requires the {1} option'.format(action, key))
+    return params
+
+def load_plan(filename):
+    """
+    Return the steps of an action plan file, e.g. in JSON::
+
+        {"steps": [
+            {"action": "optimize", "options": {"max_num_segments": 1},
+             "indices": {"prefix": "logstash-", "older_than": 2,
+                         "time_unit": "days", "timestring": "%Y.%m.%d"}},
+            {"action": "delete",
+             "indices": {"prefix": "logstash-", "older_than": 30,
+                         "time_unit": "days", "timestring": "%Y.%m.%d"}}
+        ]}
+
+    Each step is a dictionary with its ``name``, ``action``, command
+    ``params`` and selection ``filters``.
+
+    :arg filename: The plan file (JSON, or YAML if PyYAML is installed)
+    :rtype: list
+    """
+    config = load_config_file(filename)
+    steps = []
+    for i, step in enumerate((config or {}).get('steps', [])):
+        name = step.get('name', 'step{0}'.format(i + 1))
+        try:
+            action = step['action']
+            if not action in PLAN_ACTIONS:
+                raise ValueError('Unknown action {0}'.format(action))
+            selection = step.get('indices', {})
+            steps.append({
+                'name': name, 'action': action,
+                'params': command_params(action, step.get('options', {})),
+                'filters': selection_filters(selection),
+                'index': ensure_list(selection.get('index', [])),
+                'all_indices': selection.get('all_indices', False),
+            })
+        except (KeyError, ValueError) as e:
+            click.echo(click.style('ERROR: Invalid step {0} in {1}: {2}'.format(name, filename, e), fg='red', bold=True))
+            sys.exit(1)
+    return steps
+
+def resolve_plan(client, steps, metadata, max_length=None):
+    """
+    Select the indices of every step from the one snapshot of cluster
+    metadata, and set them as each step's ``indices``.
+
+    :arg client: The Elasticsearch client connection
+    :arg steps: The steps, from :py:func:`load_plan`
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot`
+    :arg max_length: The longest index list to send in one request
+    """
+    indices = get_indices(client, metadata=metadata)
+    for step in steps:
+        if step['all_indices']:
+            filters = [f for f in step['filters'] if 'exclude' in f]
+            working_list = indices
+        elif step['index'] and not step['filters']:
+            filters = []
+            working_list = []
+        else:
+            filters = step['filters']
+            working_list = indices
+        working_list = FilterPipeline(filters).apply(working_list)
+        if step['action'] == 'delete':
+            working_list = prune_kibana(working_list)
+        working_list.extend(in_list(step['index'], indices))
+        if working_list and step['action'] == 'delete' and step['params']['disk_space']:
+            working_list = filter_by_space(
+                client, working_list, disk_space=step['params']['disk_space'],
+                reverse=step['params']['reverse'], metadata=metadata,
+                include_replicas=step['params']['include_replicas'],
+                max_length=max_length,
+            )
+        step['indices'] = sorted(set(working_list))
+        get_run_metrics().inc(
+            'curator_indices_matched_total', len(step['indices']),
+            action=step['action'],
+        )
+        logger.debug('Step {0} selected {1} indices.'.format(step['name'], len(step['indices'])))
+
+def index_settings(client, step, metadata=None):
+    """
+    Return the index settings a settings step would put, by index.
+
+    :arg client: The Elasticsearch client connection
+    :arg step: A step of a ``SETTINGS_ACTIONS`` command
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot`
+    :rtype: dict
+    """
+    params = step['params']
+    if step['action'] == 'replicas':
+        return dict((i, {'index.number_of_replicas': params['count']}) for i in step['indices'])
+    key, value = params['rule'].split('=', 1)
+    # Leave out indices which already have the rule, as allocation does.
+    indices = prune_allocated(client, step['indices'], key, value, metadata=metadata)
+    return dict((i, {'index.routing.allocation.require.{0}'.format(key): value}) for i in indices)
+
+def optimize_plan(client, steps, metadata=None):
+    """
+    Return the tasks to carry out `steps`, after resolving them:
+
+    - Indices a later step deletes are left out of earlier steps which would
+      only change them (``PRUNABLE_ACTIONS``), and indices an earlier step
+      deleted are left out of later steps.
+    - Consecutive settings steps (``SETTINGS_ACTIONS``) are merged into one
+      task, which puts each distinct set of settings once.
+    - Steps left with no indices are dropped.
+
+    Each task is a dictionary with the ``name``, ``action`` and ``indices``
+    of a step, and its ``params``, or, for merged settings, the ``settings``
+    to put on each group of indices.
+
+    :arg client: The Elasticsearch client connection
+    :arg steps: The steps, from :py:func:`resolve_plan`
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot`
+    :rtype: list
+    """
+    deleted_later = [set() for s in steps]
+    for i in range(len(steps) - 2, -1, -1):
+        deleted_later[i] = set(deleted_later[i + 1])
+        if steps[i + 1]['action'] == 'delete':
+            deleted_later[i].update(steps[i + 1]['indices'])
+    deleted = set()
+    tasks = []
+    for i, step in enumerate(steps):
+        indices = [x for x in step['indices'] if not x in deleted]
+        if step['action'] in PRUNABLE_ACTIONS:
+            skipped = [x for x in indices if x in deleted_later[i]]
+            if skipped:
+                logger.info('Step {0}: skipping {1} indices which a later step deletes.'.format(step['name'], len(skipped)))
+            indices = [x for x in indices if not x in deleted_later[i]]
+        if step['action'] == 'delete':
+            deleted.update(indices)
+        if not indices:
+            logger.info('Step {0}: no indices to act on.'.format(step['name']))
+            continue
+        step = dict(step, indices=indices)
+        if step['action'] in SETTINGS_ACTIONS:
+            if not tasks or tasks[-1]['action'] != 'settings':
+                tasks.append({'name': step['name'], 'action': 'settings', 'by_index': {}})
+            else:
+                tasks[-1]['name'] += '+' + step['name']
+            for index, settings in index_settings(client, step, metadata).items():
+                tasks[-1]['by_index'].setdefault(index, {}).update(settings)
+        else:
+            tasks.append({
+                'name': step['name'], 'action': step['action'],
+                'indices': indices, 'params': step['params'],
+            })
+    for task in tasks:
+        if task['action'] == 'settings':
+            by_index = task.pop('by_index')
+            groups = {}
+            for index, settings in by_index.items():
+                groups.setdefault(tuple(sorted(settings.items())), []).append(index)
+            task['settings'] = [
+                (dict(settings), sorted(indices)) for settings, indices in sorted(groups.items())
+            ]
+            task['indices'] = sorted(by_index)
+    return tasks
+
+def plan_waves(tasks):
+    """
+    Group consecutive tasks which act on different indices into waves, which
+    can run at the same time.  ``show`` tasks run alone, so that their output
+    isn't mixed up.
+
+    :arg tasks: The tasks, from :py:func:`optimize_plan`
+    :rtype: list of lists
+    """
+    waves = []
+    busy = set()
+    for task in tasks:
+        indices = set(task['indices'])
+        if (not waves or task['action'] == 'show' or
+                waves[-1][-1]['action'] == 'show' or busy & indices):
+            waves.append([])
+            busy = set()
+        waves[-1].append(task)
+        busy.update(indices)
+    return waves
+
+def put_index_settings(client, settings, indices, max_length=DEFAULT_MAX_INITIAL_LINE_LENGTH):
+    """
+    Put `settings` on `indices`, in as few requests as the index list needs.
+
+    :arg client: The Elasticsearch client connection
+    :arg settings: A dictionary of index settings
+    :arg indices: A list of indices to act on
+    :arg max_length: The longest index list to send in one request
+    :rtype: bool
+    """
+    logger.info('Updating index settings {0} on {1} indices.'.format(settings, len(indices)))
+    try:
+        for chunk in chunk_index_list(indices, max_length):
+            client.indices.put_settings(index=to_csv(chunk), body=settings)
+        return True
+    except Exception as e:
+        logger.error('Error updating index settings.  Exception: {0}'.format(e))
+        return False
+
+def run_task(client, task, params, metadata=None, throttle=None, cache=None,
+             max_length=DEFAULT_MAX_INITIAL_LINE_LENGTH):
+    """
+    Carry out one task of a plan.
+
+    :arg client: The Elasticsearch client connection
+    :arg task: A task, from :py:func:`optimize_plan`
+    :arg params: The global command-line parameters
+    :rtype: bool
+    """
+    start = time.time()
+    logger.info('Step {0}: {1} {2} indices.'.format(task['name'], task['action'], len(task['indices'])))
+    set_request_phase('act', action=task['action'])
+    if task['action'] == 'settings':
+        if throttle:
+            throttle.wait()
+        success = all([
+            put_index_settings(client, settings, indices, max_length=max_length)
+            for settings, indices in task['settings']
+        ])
+    elif task['action'] == 'show':
+        show(task['indices'])
+        success = True
+    elif task['action'] not in UNCHUNKED_COMMANDS and index_list_length(task['indices']) > max_length:
+        success = do_chunked_command(
+            client, task['action'], chunk_index_list(task['indices'], max_length),
+            task['params'], metadata=metadata, throttle=throttle,
+            concurrency=params['chunk_concurrency'],
+            retries=params['chunk_retries'], cache=cache,
+        )
+    else:
+        success = do_command(
+            client, task['action'], task['indices'], task['params'],
+            metadata=metadata, throttle=throttle, cache=cache,
+        )
+    log = logger.info if success else logger.error
+    log('Step {0} {1} in {2:.1f} seconds.'.format(task['name'], 'finished' if success else 'failed', time.time() - start))
+    return bool(success)
+
+@cli.command('plan')
+@click.option('--file', 'filename', required=True, type=click.Path(exists=True, dir_okay=False),
+            help='Action plan file (JSON, or YAML with PyYAML).')
+@click.option('--concurrency', default=1, show_default=True, type=int,
+            help='Number of independent steps to run at once.')
+@click.pass_context
+def plan(ctx, filename, concurrency):
+    """Run the steps of an action plan file"""
+    steps = load_plan(filename)
+    if not steps:
+        click.echo(click.style('No steps found in {0}.'.format(filename), fg='red', bold=True))
+        sys.exit(1)
+    params = ctx.parent.params
+    logger.info("Job starting...")
+    set_request_phase('connect', action='plan')
+    # Each of the steps run at once may act on several chunks at once
+    client, cache = get_context_client(
+        ctx, params, concurrency=concurrency * params['chunk_concurrency'])
+    throttle = Throttle(client, max_wait=params['throttle_max_wait']) if params['throttle'] else None
+    # Every step selects from the same cluster metadata, fetched once, and
+    # it's read again after each wave which changes it.
+    set_request_phase('select')
+    metadata = get_metadata(client, cache=cache)
+    max_length = get_max_length(client, params)
+    resolve_plan(client, steps, metadata, max_length=max_length)
+    tasks = optimize_plan(client, steps, metadata=metadata)
+    if not tasks:
+        logger.warn('No indices matched any step.')
+        sys.exit(99)
+    if params['dry_run']:
+        logger.info("DRY RUN MODE.  No changes will be made.")
+        for task in tasks:
+            if task['action'] == 'settings':
+                for settings, indices in task['settings']:
+                    logger.info('Step {0} would update index settings {1} of indices:'.format(task['name'], settings))
+                    show(indices)
+            else:
+                logger.info('Step {0} would {1} indices:'.format(task['name'], task['action']))
+                show(task['indices'])
+        sys.exit(0)
+    if cache is not None and any(t['action'] not in CACHE_SAFE_COMMANDS for t in tasks):
+        cache.invalidate()
+    results = []
+    waves = plan_waves(tasks)
+    for i, wave in enumerate(waves):
+        results.extend(parallel_map(
+            lambda task: run_task(
+                client, task, params, metadata=metadata, throttle=throttle,
+                cache=cache, max_length=max_length,
+            ),
+            wave, concurrency=concurrency,
+        ))
+        if i < len(waves) - 1 and any(t['action'] in METADATA_ACTIONS for t in wave):
+            if cache is not None:
+                cache.invalidate()
+            set_request_phase('select', action='plan')
+            metadata = get_metadata(client)
+            if not metadata:
+                logger.error('Unable to read the cluster metadata.  Skipping the remaining steps.')
+                sys.exit(1)
+    sys.exit(0) if all(results) else sys.exit(1)
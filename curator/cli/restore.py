@@ -0,0 +1,39 @@
+import click
+from .snapshot_selection import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+@cli.group('restore')
+@click.option('--index', multiple=True, expose_value=True,
+            help='Restore only this index (wildcards allowed). Can be invoked multiple times.')
+@click.option('--rename_pattern', expose_value=True,
+            help='Regular expression matching the names of indices to rename, e.g. "(.+)".')
+@click.option('--rename_replacement', expose_value=True,
+            help='New name for indices matching --rename_pattern, e.g. "restored_$1".')
+@click.option('--ignore_unavailable', is_flag=True, expose_value=True,
+            help='Ignore indices missing from the snapshot.')
+@click.option('--include_global_state', is_flag=True, expose_value=True,
+            help='Restore the cluster global state too.')
+@click.option('--partial', is_flag=True, expose_value=True,
+            help='Restore indices even if some of their shards were not snapshotted.')
+@click.option('--keep_replicas', is_flag=True, expose_value=True,
+            help='Restore replicas along with the primaries, instead of adding them afterwards.')
+@click.option('--max_bytes_per_sec', expose_value=True,
+            help='Limit recovery on each node to this rate during the restore, e.g. 100mb.')
+@click.option('--concurrent_recoveries', type=int, expose_value=True,
+            help='Number of shards each node may recover at once during the restore.')
+@click.option('--request_timeout', type=int, default=21600, show_default=True,
+            expose_value=True,
+            help='Stop waiting for the restore after this many seconds.')
+@click.pass_context
+def restore(
+        ctx, index, rename_pattern, rename_replacement, ignore_unavailable,
+        include_global_state, partial, keep_replicas, max_bytes_per_sec,
+        concurrent_recoveries, request_timeout
+    ):
+    """Restore indices from a snapshot"""
+    if bool(rename_pattern) != bool(rename_replacement):
+        click.echo(click.style('--rename_pattern and --rename_replacement must be used together.', fg='red', bold=True))
+        sys.exit(1)
+restore.add_command(snapshots)
@@ -13,7 +13,7 @@ DEFAULT_ARGS = {
 }
 
 @cli.group('snapshot')
-@click.option('--repository', help='Repository name.', expose_value=True)
+@click.option('--repository', help='Repository name.  Can be invoked multiple times to take the same snapshot in each repository.', expose_value=True, multiple=True)
 @click.option('--name', help='Override default name.', expose_value=True)
 @click.option('--prefix', help='Override default prefix.',
             expose_value=True, default=DEFAULT_ARGS['snapshot_prefix'])
@@ -29,14 +29,25 @@ DEFAULT_ARGS = {
 @click.option('--request_timeout', type=int, default=21600, show_default=True,
             expose_value=True,
             help='Allow this many seconds before the transaction times out.')
+@click.option('--monitor', is_flag=True, expose_value=True,
+            help='Submit the snapshot without waiting on the connection, then poll its progress until it completes (or request_timeout passes).  Overrides --wait_for_completion.')
+@click.option('--skip_unchanged', type=int, default=0, expose_value=True,
+            help='Leave out indices unchanged since one of the last N snapshots in the repository.  Requires --cache_dir.')
+@click.option('--concurrency', type=int, default=1, show_default=True,
+            expose_value=True,
+            help='Work on this many repositories at once.  Snapshots still run one at a time, but their preparation overlaps.')
 @click.pass_context
 def snapshot(
         ctx, repository, name, prefix, wait_for_completion, ignore_unavailable,
-        include_global_state, partial, request_timeout
+        include_global_state, partial, request_timeout, monitor, skip_unchanged,
+        concurrency
     ):
     """Take snapshots of indices (Backup)"""
     if not repository:
         click.echo('{0}'.format(ctx.get_help()))
         click.echo(click.style('Missing required parameter --repository', fg='red', bold=True))
         sys.exit(1)
+    if skip_unchanged and not ctx.parent.params['cache_dir']:
+        click.echo(click.style('--skip_unchanged requires --cache_dir', fg='red', bold=True))
+        sys.exit(1)
 snapshot.add_command(indices)
@@ -38,7 +38,7 @@ def snapshots(ctx, newer_than, older_than, prefix, suffix, time_unit,
             timestring, regex, exclude, snapshot, all_snapshots, repository):
     """
     Get a list of snapshots to act on from the provided arguments, then perform
-    the command [delete, show] on the resulting list.
+    the command [delete, restore, show] on the resulting list.
 
     """
 
@@ -53,9 +53,11 @@ def snapshots(ctx, newer_than, older_than, prefix, suffix, time_unit,
     if ctx.parent.parent.params['dry_run']:
         logging.info("DRY RUN MODE.  No changes will be made.")
 
-    client = get_client(**ctx.parent.parent.params)
+    set_request_phase('connect', action=ctx.parent.info_name)
+    client, cache = get_context_client(ctx, ctx.parent.parent.params)
+    set_request_phase('select')
     # Get a master-list of indices
-    snapshots = get_snapshots(client, repository=repository)
+    snapshots = get_snapshots(client, repository=repository, cache=cache)
     if snapshots:
         working_list = snapshots
     else:
@@ -67,11 +69,12 @@ def snapshots(ctx, newer_than, older_than, prefix, suffix, time_unit,
     else:
         logger.debug('All filters: {0}'.format(ctx.obj['filters']))
 
-    for f in ctx.obj['filters']:
-        if all_snapshots and not 'exclude' in f:
-            continue
+    filters = [
+        f for f in ctx.obj['filters'] if not all_snapshots or 'exclude' in f
+    ]
+    for f in filters:
         logger.debug('Filter: {0}'.format(f))
-        working_list = regex_iterate(working_list, **f)
+    working_list = FilterPipeline(filters).apply(working_list)
 
     # If there are manually added snapshots, we will add them here
     working_list.extend(in_list(snapshot, snapshots))
@@ -80,18 +83,42 @@ def snapshots(ctx, newer_than, older_than, prefix, suffix, time_unit,
         # Make a sorted, unique list of indices
         working_list = sorted(list(set(working_list)))
         logger.debug('ACTION: {0} will be executed against the following snapshots: {1}'.format(ctx.parent.info_name, working_list))
+        set_request_phase('act')
         if ctx.parent.info_name == 'show':
             show(working_list)
         elif ctx.parent.parent.params['dry_run']:
             logger.warn('DRY RUN: Will not perform {0} action'.format(ctx.parent.info_name))
             show(working_list)
         elif ctx.parent.info_name == 'delete':
-            success = True
-            for snap in working_list:
-                retval = delete_snapshot(client, snapshot=snap, repository=repository)
-                # If we fail once, we fail completely
-                if not retval:
-                    success = False
+            if cache is not None:
+                cache.invalidate()
+            success = delete_snapshots(
+                client, snapshots=working_list, repository=repository,
+                retries=ctx.parent.params['snapshot_retries'],
+            )
+            sys.exit(0) if success else sys.exit(1)
+        elif ctx.parent.info_name == 'restore':
+            if cache is not None:
+                cache.invalidate()
+            if len(working_list) > 1:
+                latest = get_latest_snapshot(client, repository, working_list)
+                logger.warn('{0} snapshots matched.  Restoring only the most recent, {1}.'.format(len(working_list), latest))
+            else:
+                latest = working_list[0]
+            params = ctx.parent.params
+            success = restore_snapshot(
+                client, snapshot=latest, repository=repository,
+                indices=list(params['index']),
+                rename_pattern=params['rename_pattern'],
+                rename_replacement=params['rename_replacement'],
+                ignore_unavailable=params['ignore_unavailable'],
+                include_global_state=params['include_global_state'],
+                partial=params['partial'],
+                no_replicas=not params['keep_replicas'],
+                max_bytes_per_sec=params['max_bytes_per_sec'],
+                concurrent_recoveries=params['concurrent_recoveries'],
+                request_timeout=params['request_timeout'],
+            )
             sys.exit(0) if success else sys.exit(1)
 
     else:
@@ -1,7 +1,9 @@
 import click
 import sys
+import os
 import re
 import time
+import cProfile
 import logging
 import json
 from .utils import *
@@ -9,12 +11,39 @@ from .utils import *
 import elasticsearch
 from ..api import *
 
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
 logger = logging.getLogger(__name__)
 
 # Elasticsearch versions supported
 version_max  = (2, 0, 0)
 version_min = (1, 0, 0)
 
+# Commands which wait on the load-aware throttle, if enabled, before acting.
+# Optimize waits before each merge rather than once per call.
+THROTTLED_COMMANDS = ['allocation', 'replicas', 'snapshot']
+
+# Commands which change neither the cluster metadata nor the snapshot lists,
+# so the metadata cache is kept after them.
+CACHE_SAFE_COMMANDS = ['optimize', 'show']
+
+BYTE_UNITS = {
+    'b': 1, 'k': 2**10, 'kb': 2**10, 'm': 2**20, 'mb': 2**20,
+    'g': 2**30, 'gb': 2**30,
+}
+
+# Commands whose index list chunks are independent of each other, and safe to
+# retry, so they can be run concurrently.
+PARALLEL_COMMANDS = ['close', 'delete', 'open', 'replicas']
+
+# Commands which send the index list in the request body rather than the URL,
+# so a long list is never broken up.  A snapshot must also be taken in one
+# piece, under one name.
+UNCHUNKED_COMMANDS = ['alias', 'snapshot']
+
 REGEX_MAP = {
     'timestring': r'^.*{0}.*$',
     'newer_than': r'(?P<date>{0})',
@@ -51,13 +80,15 @@ class Whitelist(logging.Filter):
     def filter(self, record):
         return any(f.filter(record) for f in self.whitelist)
 
-def check_version(client):
+def check_version(client, cache=None):
     """
     Verify version is within acceptable range.  Exit with error if it is not.
 
     :arg client: The Elasticsearch client connection
+    :arg cache: A :py:class:`curator.api.MetadataCache` to read the version
+        number from.
     """
-    version_number = get_version(client)
+    version_number = get_version(client, cache=cache)
     logger.debug('Detected Elasticsearch version {0}'.format(".".join(map(str,version_number))))
     if version_number >= version_max or version_number < version_min:
         click.echo(click.style('Expected Elasticsearch version range > {0} < {1}'.format(".".join(map(str,version_min)),".".join(map(str,version_max))), fg='red'))
@@ -79,10 +110,16 @@ def get_client(**kwargs):
     kwargs['master_only'] = False if not 'master_only' in kwargs else kwargs['master_only']
     logger.debug("kwargs = {0}".format(kwargs))
     master_only = kwargs.pop('master_only')
+    cache = kwargs.pop('cache', None)
+    stats = kwargs.pop('stats', None)
+    concurrency = max(kwargs.pop('concurrency', 1), kwargs.get('chunk_concurrency') or 1)
+    if stats is not None:
+        kwargs['connection_class'] = InstrumentedConnection
+        kwargs['stats'] = stats
     try:
-        client = elasticsearch.Elasticsearch(**kwargs)
+        client = get_pooled_client(concurrency=concurrency, **kwargs)
         # Verify the version is acceptable.
-        check_version(client)
+        check_version(client, cache=cache)
         # Verify "master_only" status, if applicable
         check_master(client, master_only=master_only)
         return client
@@ -90,6 +127,159 @@ def get_client(**kwargs):
         click.echo(click.style('ERROR: Connection failure.', fg='red', bold=True))
         sys.exit(1)
 
+def get_cache(params):
+    """
+    Return a :py:class:`curator.api.MetadataCache` if ``--cache_dir`` was
+    given, or `None`.
+
+    :arg params: The global command-line parameters
+    """
+    if not params.get('cache_dir'):
+        return None
+    return MetadataCache(
+        params['cache_dir'], ttl=params.get('cache_ttl', DEFAULT_CACHE_TTL))
+
+def get_concurrency(ctx):
+    """
+    Return the largest of the concurrency options (``--chunk_concurrency``,
+    ``--concurrency``...) given to the command of
+    `ctx` and its parents, i.e. the number of requests it may send at once.
+
+    :arg ctx: The click context of the command
+    :rtype: int
+    """
+    concurrency = 1
+    while ctx is not None:
+        for name, value in ctx.params.items():
+            if name.endswith('concurrency') and value:
+                concurrency = max(concurrency, value)
+        ctx = ctx.parent
+    return concurrency
+
+def get_context_client(ctx, params, concurrency=None):
+    """
+    Return the client and :py:class:`curator.api.MetadataCache` (or `None`)
+    to run a command with.  These are the ones kept open in ``ctx.obj`` by
+    ``curator daemon``, if any.  Otherwise they are made from the global
+    command-line parameters, with a connection pool large enough for
+    `concurrency` requests at once.
+
+    :arg ctx: The click context of the command
+    :arg params: The global command-line parameters
+    :arg concurrency: The number of requests the command may send at once.
+        If omitted, the largest of its concurrency options.
+    :rtype: tuple
+    """
+    if ctx.obj.get('client') is not None:
+        return ctx.obj['client'], ctx.obj.get('cache')
+    if concurrency is None:
+        concurrency = get_concurrency(ctx)
+    cache = get_cache(params)
+    client = get_client(
+        cache=cache, stats=ctx.obj.get('request_stats'),
+        concurrency=concurrency, **params)
+    return client, cache
+
+def report_request_stats(stats, echo=False, filename=None):
+    """
+    Print a summary of the requests recorded in `stats`, and/or write them to
+    `filename` as JSON.
+
+    :arg stats: A :py:class:`curator.api.RequestStats`
+    :arg echo: Print the summary to stderr.
+    :arg filename: The JSON file to write
+    """
+    if echo:
+        click.echo(stats.report(), err=True)
+    if filename:
+        try:
+            stats.write(filename)
+        except (IOError, OSError) as e:
+            logger.error('Unable to write request stats to {0}.  Exception: {1}'.format(filename, e))
+
+def report_metrics(filename, stats=None):
+    """
+    Write the run metrics (see :py:func:`curator.api.get_run_metrics`), and
+    those of the requests recorded in `stats`, to `filename` for Prometheus.
+
+    :arg filename: The file to write
+    :arg stats: A :py:class:`curator.api.RequestStats`, if any
+    """
+    try:
+        get_run_metrics().write(filename, request_stats=stats)
+    except (IOError, OSError) as e:
+        logger.error('Unable to write metrics to {0}.  Exception: {1}'.format(filename, e))
+
+def cpu_time():
+    """Return the user and system CPU time of this process, in seconds."""
+    return sum(os.times()[:2])
+
+def start_profile(profile_format='pstats'):
+    """
+    Start profiling, and return the profiler and the wall clock and CPU times
+    at the start, as a tuple.
+
+    :arg profile_format: ``pstats`` to profile with cProfile, or
+        ``collapsed`` to sample stacks with a
+        :py:class:`curator.api.SamplingProfiler`
+    :rtype: tuple
+    """
+    if profile_format == 'collapsed':
+        profiler = SamplingProfiler()
+    else:
+        profiler = cProfile.Profile()
+    started = (time.time(), cpu_time())
+    profiler.enable()
+    return profiler, started
+
+def report_profile(profiler, started, filename, stats=None):
+    """
+    Stop `profiler`, write its profile to `filename`, and print the time
+    taken, the CPU time used and the time spent in Elasticsearch requests to
+    stderr.
+
+    :arg profiler: The profiler, from :py:func:`start_profile`
+    :arg started: The wall clock and CPU times at the start
+    :arg filename: The file to write
+    :arg stats: The :py:class:`curator.api.RequestStats` of the run, if any
+    """
+    profiler.disable()
+    elapsed = time.time() - started[0]
+    cpu = cpu_time() - started[1]
+    try:
+        profiler.dump_stats(filename)
+    except (IOError, OSError) as e:
+        logger.error('Unable to write profile to {0}.  Exception: {1}'.format(filename, e))
+        return
+    msg = 'Profile written to {0}: {1:.3f} seconds, {2:.3f} seconds of CPU time'.format(filename, elapsed, cpu)
+    if stats is not None:
+        totals = stats.totals()
+        msg += ', {0:.3f} seconds in {1} Elasticsearch requests'.format(totals['time'], totals['count'])
+    msg += '.'
+    if isinstance(profiler, SamplingProfiler):
+        samples = profiler.summary()
+        msg += '  Samples: {0} local, {1} waiting on Elasticsearch, {2} sleeping.'.format(samples['local'], samples['elasticsearch'], samples['sleep'])
+    click.echo(msg, err=True)
+
+def load_config_file(filename):
+    """
+    Return the contents of a JSON file, or of a YAML file (``.yml`` or
+    ``.yaml``) if PyYAML is installed.  Exit with an error if it can't be read.
+
+    :arg filename: The file to read
+    """
+    try:
+        with open(filename) as f:
+            if filename.endswith(('.yml', '.yaml')):
+                if yaml is None:
+                    click.echo(click.style('ERROR: PyYAML is required to read {0}.  Use JSON, or install PyYAML.'.format(filename), fg='red', bold=True))
+                    sys.exit(1)
+                return yaml.safe_load(f)
+            return json.load(f)
+    except Exception as e:
+        click.echo(click.style('ERROR: Unable to read {0}: {1}'.format(filename, e), fg='red', bold=True))
+        sys.exit(1)
+
 def filter_callback(ctx, param, value):
     """
     Append a dict to ctx.obj['filters'] based on the arguments
@@ -150,40 +340,111 @@ def in_list(values, source_list):
             logger.warn('{0} not found!'.format(v))
     return retval
 
-def chunk_index_list(indices):
+def byte_size(value):
     """
-    This utility chunks very large index lists into 3KB chunks
-    It measures the size as a csv string, then converts back into a list
-    for the return value.
+    Return the number of bytes in an Elasticsearch byte size value, e.g.
+    ``4kb``, or `None` if it can't be parsed.
 
-    :arg indices: A list of indices to act on.
+    :arg value: A byte size string, or number of bytes
+    :rtype: int
     """
-    chunks = []
-    chunk = ""
-    for index in indices:
-        if len(chunk) < 3072:
-            if not chunk:
-                chunk = index
-            else:
-                chunk += "," + index
-        else:
-            chunks.append(chunk.split(','))
-            chunk = index
-    chunks.append(chunk.split(','))
-    return chunks
+    m = re.match(r'^\s*(\d+)\s*([a-z]*)\s*$', str(value).lower())
+    if not m or not m.group(2) in [''] + list(BYTE_UNITS):
+        return None
+    return int(m.group(1)) * BYTE_UNITS.get(m.group(2), 1)
+
+def get_max_initial_line_length(client):
+    """
+    Return the smallest ``http.max_initial_line_length`` of any node in the
+    cluster, or ``DEFAULT_MAX_INITIAL_LINE_LENGTH`` if it isn't set.
+
+    :arg client: The Elasticsearch client connection
+    :rtype: int
+    """
+    retval = None
+    try:
+        nodes = client.nodes.info(metric='settings')['nodes']
+    except Exception:
+        logger.warn('Unable to read node settings.  Assuming http.max_initial_line_length is {0} bytes.'.format(DEFAULT_MAX_INITIAL_LINE_LENGTH))
+        return DEFAULT_MAX_INITIAL_LINE_LENGTH
+    for node in nodes.values():
+        settings = node.get('settings', {})
+        value = settings.get('http.max_initial_line_length')
+        if value is None:
+            value = settings.get('http', {}).get('max_initial_line_length')
+        length = byte_size(value) if value is not None else None
+        if length is None:
+            length = DEFAULT_MAX_INITIAL_LINE_LENGTH
+        retval = length if retval is None else min(retval, length)
+    return retval if retval else DEFAULT_MAX_INITIAL_LINE_LENGTH
+
+def get_max_length(client, params, indices=None):
+    """
+    Return the largest encoded length of an index list that fits in one
+    request line: ``--max_initial_line_length`` if given, or the cluster's
+    ``http.max_initial_line_length``, less ``REQUEST_LINE_OVERHEAD``.
+
+    If `indices` fit within Elasticsearch's default limit, the cluster isn't
+    asked, and the default limit is returned.
+
+    :arg client: The Elasticsearch client connection
+    :arg params: The global command-line parameters
+    :arg indices: The list of indices to send, if known.
+    :rtype: int
+    """
+    max_line_length = params.get('max_initial_line_length')
+    if not max_line_length:
+        default = DEFAULT_MAX_INITIAL_LINE_LENGTH - REQUEST_LINE_OVERHEAD
+        if indices is not None and index_list_length(indices) <= default:
+            return default
+        max_line_length = get_max_initial_line_length(client)
+    return max_line_length - REQUEST_LINE_OVERHEAD
 
-def do_command(client, command, indices, params=None):
+def do_command(client, command, indices, params=None, metadata=None,
+               throttle=None, cache=None):
     """
     Do the command.
+
+    :arg metadata: A :py:class:`curator.api.ClusterMetadataSnapshot` shared by
+        all commands in this run.
+    :arg throttle: A :py:class:`curator.api.Throttle` to pace heavy commands
+        by cluster load.
+    :arg cache: The :py:class:`curator.api.MetadataCache` for this run.  Its
+        directory also holds the snapshot manifests.
+
+    The time taken and the number of indices acted on are recorded in the
+    run metrics (see :py:func:`curator.api.get_run_metrics`).
     """
+    set_request_phase('act', action=command)
+    if throttle and command in THROTTLED_COMMANDS:
+        throttle.wait()
+    start = time.time()
+    retval = False
+    try:
+        retval = _do_command(
+            client, command, indices, params=params, metadata=metadata,
+            throttle=throttle, cache=cache,
+        )
+    finally:
+        get_run_metrics().record_action(
+            command, indices, retval, time.time() - start)
+    return retval
+
+def _do_command(client, command, indices, params=None, metadata=None,
+                throttle=None, cache=None):
     if command == "alias":
         return alias(
-                client, indices, alias=params['name'], remove=params['remove']
+                client, indices, alias=params['name'], remove=params['remove'],
+                metadata=metadata,
                )
     if command == "allocation":
-        return allocation(client, indices, rule=params['rule'])
+        return allocation(
+                client, indices, rule=params['rule'], metadata=metadata
+               )
     if command == "bloom":
-        return bloom(client, indices, delay=params['delay'])
+        return bloom(
+                client, indices, delay=params['delay'], metadata=metadata
+               )
     if command == "close":
         return close(client, indices)
     if command == "delete":
@@ -193,17 +454,78 @@ def do_command(client, command, indices, params=None):
     if command == "optimize":
         return optimize(
                 client, indices, max_num_segments=params['max_num_segments'],
-                delay=params['delay'], request_timeout=params['request_timeout']
+                delay=params['delay'], request_timeout=params['request_timeout'],
+                concurrency=params['concurrency'],
+                node_concurrency=params['node_concurrency'],
+                metadata=metadata, throttle=throttle,
                )
     if command == "replicas":
         return replicas(client, indices, replicas=params['count'])
     if command == "snapshot":
-        return create_snapshot(
+        return create_snapshots(
                 client, indices=indices, name=params['name'],
-                prefix=params['prefix'], repository=params['repository'],
+                prefix=params['prefix'], repositories=params['repository'],
+                concurrency=params['concurrency'],
                 ignore_unavailable=params['ignore_unavailable'],
                 include_global_state=params['include_global_state'],
                 partial=params['partial'],
                 wait_for_completion=params['wait_for_completion'],
                 request_timeout=params['request_timeout'],
+                metadata=metadata, monitor=params['monitor'],
+                manifest_path=cache.path if cache is not None else None,
+                manifest_cluster=cache.cluster_key(client) if cache is not None else None,
+                skip_unchanged=params['skip_unchanged'],
                )
+
+def do_chunked_command(client, command, index_lists, params=None,
+                       metadata=None, throttle=None, concurrency=1,
+                       retries=0, retry_delay=1, cache=None):
+    """
+    Do the command for each list of indices in `index_lists`, as made by
+    :py:func:`curator.cli.chunk_index_list`.  For commands in
+    ``PARALLEL_COMMANDS``, up to `concurrency` lists are acted on at once,
+    and a failed list is retried up to `retries` times, with the delay
+    doubling from `retry_delay` seconds each time.  Before each retry, the
+    cluster metadata is read again, and indices which no longer exist (e.g.
+    deleted by an attempt which timed out) are left out.  Other commands are
+    done one list at a time, without retries.
+
+    :arg index_lists: A list (or iterator) of lists of indices
+    :arg concurrency: The number of lists to act on at once.
+    :arg retries: The number of times to retry a failed list.
+    :arg retry_delay: Seconds to wait before the first retry.
+    :rtype: bool
+    """
+    if not command in PARALLEL_COMMANDS:
+        concurrency = 1
+        retries = 0
+
+    def act(l):
+        attempt = 0
+        current = metadata
+        while True:
+            try:
+                retval = do_command(
+                    client, command, l, params, metadata=current,
+                    throttle=throttle, cache=cache,
+                )
+            except Exception as e:
+                logger.error('Error in {0} of {1} indices.  Exception: {2}'.format(command, len(l), e))
+                retval = False
+            if retval or attempt >= retries:
+                return bool(retval)
+            delay = retry_delay * 2 ** attempt
+            attempt += 1
+            logger.warn('{0} of {1} indices failed.  Retry {2} of {3} in {4} seconds.'.format(command, len(l), attempt, retries, delay))
+            time.sleep(delay)
+            fresh = get_metadata(client)
+            if fresh:
+                current = fresh
+                missing = [i for i in l if not i in fresh]
+                if missing:
+                    logger.info('{0} of {1} indices no longer exist.  Leaving them out of the retry.'.format(len(missing), len(l)))
+                    l = [i for i in l if i in fresh]
+                    if not l:
+                        return True
+
+    return all(parallel_map(act, index_lists, concurrency=concurrency))
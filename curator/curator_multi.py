@@ -0,0 +1,5 @@
+import click
+from .cli import multi
+
+def main():
+    multi.multicli()
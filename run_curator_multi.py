@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+
+"""Wrapper for running curator_multi from source."""
+
+from curator.curator_multi import main
+
+if __name__ == '__main__':
+    main()
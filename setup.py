@@ -42,6 +42,7 @@ setup(
     include_package_data=True,
     entry_points = {
         "console_scripts" : ["curator = curator.curator:main",
+                             "curator_multi = curator.curator_multi:main",
                              "es_repo_mgr = curator.es_repo_mgr:main"]
     },
     classifiers=[
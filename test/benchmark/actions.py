@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+Count the requests curator makes, and time each action, against a fake
+cluster (see :py:mod:`test.benchmark.fake_es`).
+
+Run from the root of the project, e.g.::
+
+    python -m test.benchmark.actions --indices 1000,20000 --latency 0.002 \\
+        --output after.json --baseline before.json
+
+Each action runs the ``curator`` command line in this process, against a new
+fake cluster of ``--indices`` daily indices and ``--snapshots`` hourly
+snapshots.  Any action which exits with a non-zero code (including 99, for
+no matching indices or snapshots) has failed: it is reported, the results are
+not written to ``--output``, so that they can't become a baseline, and the
+exit code is 1.  With ``--baseline``, any action which makes more requests
+than in the baseline, or whose best time is more than ``--tolerance`` slower,
+is reported too.
+"""
+from __future__ import print_function
+
+import sys
+import os
+import json
+import logging
+import platform
+import timeit
+from datetime import datetime, timedelta
+
+import click
+
+import curator
+from .catalogue import index_catalogue, snapshot_catalogue
+from .fake_es import FakeElasticsearch
+
+DEFAULT_INDICES = '1000,20000'
+REPOSITORY = 'backups'
+# The alias the alias action adds indices to, which must exist.
+ALIAS = 'old'
+OLDER_THAN = [
+    '--older-than', '30', '--time-unit', 'days', '--timestring', '%Y.%m.%d',
+]
+
+# The curator arguments of each action, without global options.
+ACTIONS = [
+    ('show_indices', ['show', 'indices', '--all-indices']),
+    ('show_snapshots', ['show', 'snapshots', '--repository', REPOSITORY, '--all-snapshots']),
+    ('alias', ['alias', '--name', ALIAS, 'indices'] + OLDER_THAN),
+    ('allocation', ['allocation', '--rule', 'tag=cold', 'indices'] + OLDER_THAN),
+    ('replicas', ['replicas', '--count', '0', 'indices'] + OLDER_THAN),
+    ('optimize', ['optimize', '--max_num_segments', '1', 'indices'] + OLDER_THAN),
+    ('close', ['close', 'indices'] + OLDER_THAN),
+    ('open', ['open', 'indices'] + OLDER_THAN),
+    ('snapshot', ['snapshot', '--repository', REPOSITORY, 'indices'] + OLDER_THAN),
+    ('delete_snapshots', [
+        'delete', 'snapshots', '--repository', REPOSITORY, '--older-than', '2',
+        '--time-unit', 'days', '--timestring', '%Y%m%d%H%M%S',
+    ]),
+    ('delete', ['delete', 'indices'] + OLDER_THAN),
+]
+
+def run_action(args, server):
+    """
+    Run ``curator`` with `args` against `server`, and return its exit code.
+    Its output is discarded.
+
+    :arg args: The curator arguments, without global options
+    :arg server: A started :py:class:`FakeElasticsearch`
+    :rtype: int
+    """
+    handlers = list(logging.root.handlers)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        curator.cli.main(
+            args=[
+                '--host', '127.0.0.1', '--port', str(server.port),
+                '--logfile', os.devnull, '--loglevel', 'WARN',
+            ] + args,
+            obj={'filters': []}, standalone_mode=False,
+        )
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        logging.root.handlers = handlers
+
+def run_actions(sizes, snapshots=100, latency=0, failures=0, repeat=1,
+                only=None):
+    """
+    Run every action (or those named in `only`) against a fake cluster of
+    each of `sizes`, and return a list of results.
+
+    :arg sizes: A list of index counts
+    :arg snapshots: The number of snapshots in the repository
+    :arg latency: Seconds the fake cluster waits before each response
+    :arg failures: The fraction of requests the fake cluster fails
+    :arg repeat: The number of times to time each action
+    :arg only: A list of action names
+    :rtype: list
+    """
+    results = []
+    for size in sizes:
+        indices = index_catalogue(size, time_unit='days')
+        # Leave the current hour free for the snapshot action.
+        names = snapshot_catalogue(
+            snapshots, utc_now=datetime.utcnow() - timedelta(hours=1))
+        for name, args in ACTIONS:
+            if only and not name in only:
+                continue
+            times = []
+            exit_code = 0
+            for i in range(0, repeat):
+                server = FakeElasticsearch(
+                    indices=indices, repositories=[REPOSITORY],
+                    snapshots=names, latency={'*': latency},
+                    failures={'*': failures},
+                )
+                server.indices[indices[0]]['aliases'].append(ALIAS)
+                with server:
+                    start = timeit.default_timer()
+                    # Keep the first failure of any repeat
+                    exit_code = exit_code or run_action(args, server)
+                    times.append(timeit.default_timer() - start)
+                    stats = server.stats()
+            times.sort()
+            requests = sum(s['count'] for s in stats.values())
+            errors = sum(s['errors'] for s in stats.values())
+            results.append({
+                'name': name, 'size': size, 'exit_code': exit_code,
+                'best': times[0], 'median': times[len(times) // 2],
+                'requests': requests, 'errors': errors,
+                'endpoints': dict((k, v['count']) for k, v in stats.items()),
+            })
+            print('{0:<18} {1:>8} {2:>12.6f}s {3:>8} requests {4:>6} errors  exit code {5}'.format(
+                name, size, times[0], requests, errors, exit_code))
+    return results
+
+def failed_actions(results):
+    """
+    Return the results of actions which exited with a non-zero code.
+
+    :arg results: A list of results, from :py:func:`run_actions`
+    :rtype: list
+    """
+    return [r for r in results if r['exit_code'] != 0]
+
+def compare(results, baseline, tolerance):
+    """
+    Return the results which make more requests than the same action in
+    `baseline`, or are more than `tolerance` slower, as
+    ``(result, baseline_result)`` pairs.  Failed results, and baseline
+    results of failed actions, are not compared.
+
+    :arg results: A list of results, from :py:func:`run_actions`
+    :arg baseline: A list of earlier results
+    :arg tolerance: The allowed slowdown, e.g. 0.25 for 25%
+    :rtype: list
+    """
+    previous = dict(((r['name'], r['size']), r) for r in baseline)
+    regressions = []
+    for r in results:
+        before = previous.get((r['name'], r['size']))
+        if before is None or r['exit_code'] != 0 or before.get('exit_code', 0) != 0:
+            continue
+        if (r['requests'] > before['requests'] or
+                r['best'] > before['best'] * (1 + tolerance)):
+            regressions.append((r, before))
+    return regressions
+
+@click.command()
+@click.option('--indices', default=DEFAULT_INDICES, show_default=True, help='Comma-separated numbers of indices.')
+@click.option('--snapshots', default=100, show_default=True, type=int, help='Number of snapshots in the repository.')
+@click.option('--latency', default=0.0, show_default=True, type=float, help='Seconds to wait before each response.')
+@click.option('--failures', default=0.0, show_default=True, type=float, help='Fraction of requests to fail.')
+@click.option('--repeat', default=1, show_default=True, type=int, help='Times to run each action.')
+@click.option('--only', multiple=True, help='Run only this action. Can be invoked multiple times.')
+@click.option('--output', help='Write the results to this JSON file.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Compare with the results in this JSON file.')
+@click.option('--tolerance', default=0.25, show_default=True, type=float, help='Allowed slowdown from the baseline.')
+def main(indices, snapshots, latency, failures, repeat, only, output,
+         baseline, tolerance):
+    """Count the requests and time of curator actions on a fake cluster"""
+    results = run_actions(
+        [int(s) for s in indices.split(',')], snapshots=snapshots,
+        latency=latency, failures=failures, repeat=max(1, repeat), only=only,
+    )
+    report = {
+        'curator': curator.__version__,
+        'python': platform.python_version(),
+        'date': datetime.utcnow().isoformat(),
+        'latency': latency,
+        'results': results,
+    }
+    failed = failed_actions(results)
+    for r in failed:
+        print('FAILED: {0} ({1}): exit code {2}'.format(
+            r['name'], r['size'], r['exit_code']))
+    if output:
+        if failed:
+            print('Not writing {0}, as {1} actions failed.'.format(output, len(failed)))
+        else:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+    regressions = []
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f)['results'], tolerance)
+        for r, before in regressions:
+            print('REGRESSION: {0} ({1}): {2} requests in {3:.6f}s, was {4} in {5:.6f}s'.format(
+                r['name'], r['size'], r['requests'], r['best'],
+                before['requests'], before['best']))
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
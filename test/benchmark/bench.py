@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Benchmarks of index and snapshot selection over synthetic catalogues.
+
+Run from the root of the project, e.g.::
+
+    python -m test.benchmark.bench --sizes 10,1000,100000 --output after.json \\
+        --baseline before.json
+
+Each benchmark is timed `--repeat` times for each size and time unit, and the
+best and median times are recorded.  With ``--baseline``, any benchmark whose
+best time is more than ``--tolerance`` slower than in the baseline is
+reported, and the exit code is 1.
+"""
+from __future__ import print_function
+
+import sys
+import os
+import re
+import json
+import logging
+import platform
+import timeit
+from datetime import datetime
+
+import click
+from click import testing as clicktest
+from mock import Mock, patch
+
+import curator
+from curator import api
+from .catalogue import (
+    TIMESTRINGS, index_catalogue, snapshot_catalogue, cluster_state
+)
+
+DEFAULT_SIZES = '10,1000,100000'
+DEFAULT_UNITS = 'hours,days,weeks,months'
+# Filters older than this many time units, so that about half of a
+# catalogue's names match.
+OLDER_THAN = {'hours': 24, 'days': 30, 'weeks': 8, 'months': 3}
+
+def timestamps(names, timestring):
+    """Return the timestamp part of each index name of a catalogue."""
+    regex = api.get_date_regex(timestring)
+    p = re.compile(r'(?P<date>{0})'.format(regex))
+    return [m.group('date') for m in (p.search(n) for n in names) if m]
+
+def clear_timestring_cache():
+    api.filter._TIMESTRING_PARSERS.clear()
+
+def bench_regex_iterate_prefix(names, time_unit):
+    def run():
+        api.regex_iterate(names, pattern=r'^logstash-1-.*$')
+    return run
+
+def bench_regex_iterate_date(names, time_unit):
+    timestring = TIMESTRINGS[time_unit]
+    pattern = r'(?P<date>{0})'.format(api.get_date_regex(timestring))
+    def run():
+        clear_timestring_cache()
+        api.regex_iterate(
+            names, pattern=pattern, groupname='date', timestring=timestring,
+            time_unit=time_unit, method='older_than',
+            value=OLDER_THAN[time_unit],
+        )
+    return run
+
+def bench_get_date_regex(names, time_unit):
+    timestring = TIMESTRINGS[time_unit]
+    def run():
+        for n in names:
+            api.get_date_regex(timestring)
+    return run
+
+def bench_get_datetime(names, time_unit):
+    timestring = TIMESTRINGS[time_unit]
+    stamps = timestamps(names, timestring)
+    def run():
+        clear_timestring_cache()
+        for s in stamps:
+            api.get_datetime(s, timestring)
+    return run
+
+def bench_timestamp_check(names, time_unit):
+    timestring = TIMESTRINGS[time_unit]
+    stamps = timestamps(names, timestring)
+    cutoff = api.get_cutoff(unit_count=OLDER_THAN[time_unit], time_unit=time_unit)
+    def run():
+        clear_timestring_cache()
+        for s in stamps:
+            api.timestamp_check(
+                s, timestring=timestring, time_unit=time_unit,
+                method='older_than', value=OLDER_THAN[time_unit],
+                cutoff=cutoff,
+            )
+    return run
+
+def bench_prune_kibana(names, time_unit):
+    def run():
+        api.prune_kibana(list(names))
+    return run
+
+def bench_chunk_index_list(names, time_unit):
+    def run():
+        for chunk in api.chunk_index_list(names):
+            pass
+    return run
+
+def bench_snapshot_regex_iterate(names, time_unit):
+    snapshots = snapshot_catalogue(len(names))
+    timestring = '%Y%m%d%H%M%S'
+    pattern = r'(?P<date>{0})'.format(api.get_date_regex(timestring))
+    def run():
+        clear_timestring_cache()
+        api.regex_iterate(
+            snapshots, pattern=pattern, groupname='date',
+            timestring=timestring, time_unit='days', method='older_than',
+            value=7,
+        )
+    return run
+
+def bench_index_selection(names, time_unit):
+    client = Mock()
+    client.cluster.state.return_value = cluster_state(names)
+    args = [
+        '--logfile', os.devnull, '--loglevel', 'WARN', 'show', 'indices',
+        '--prefix', 'logstash-', '--older-than', str(OLDER_THAN[time_unit]),
+        '--time-unit', time_unit, '--timestring', TIMESTRINGS[time_unit],
+    ]
+    runner = clicktest.CliRunner()
+    def run():
+        clear_timestring_cache()
+        handlers = list(logging.root.handlers)
+        with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client):
+            result = runner.invoke(curator.cli, args, obj={'filters': []})
+        logging.root.handlers = handlers
+        if result.exit_code not in (0, 99):
+            raise RuntimeError('index selection failed: {0}'.format(result.output))
+    return run
+
+# Each benchmark is given a catalogue of index names and its time unit, and
+# returns the function to time.
+BENCHMARKS = [
+    ('regex_iterate_prefix', bench_regex_iterate_prefix),
+    ('regex_iterate_date', bench_regex_iterate_date),
+    ('get_date_regex', bench_get_date_regex),
+    ('get_datetime', bench_get_datetime),
+    ('timestamp_check', bench_timestamp_check),
+    ('prune_kibana', bench_prune_kibana),
+    ('chunk_index_list', bench_chunk_index_list),
+    ('snapshot_regex_iterate', bench_snapshot_regex_iterate),
+    ('index_selection', bench_index_selection),
+]
+
+def run_benchmarks(sizes, time_units, repeat=3, only=None):
+    """
+    Run every benchmark (or those named in `only`) for each of `sizes` and
+    `time_units`, and return a list of results.
+
+    :arg sizes: A list of catalogue sizes
+    :arg time_units: A list of time units
+    :arg repeat: The number of times to time each benchmark
+    :arg only: A list of benchmark names
+    :rtype: list
+    """
+    results = []
+    for time_unit in time_units:
+        for size in sizes:
+            names = index_catalogue(size, time_unit=time_unit)
+            for name, bench in BENCHMARKS:
+                if only and not name in only:
+                    continue
+                run = bench(names, time_unit)
+                times = []
+                for i in range(0, repeat):
+                    start = timeit.default_timer()
+                    run()
+                    times.append(timeit.default_timer() - start)
+                times.sort()
+                results.append({
+                    'name': name, 'time_unit': time_unit, 'size': size,
+                    'best': times[0], 'median': times[len(times) // 2],
+                    'per_item_us': times[0] / size * 1e6,
+                })
+                print('{0:<24} {1:<7} {2:>8} {3:>12.6f}s {4:>10.3f}us/item'.format(
+                    name, time_unit, size, times[0], times[0] / size * 1e6))
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Return the results which are more than `tolerance` slower than the same
+    benchmark in `baseline`, as ``(result, baseline_best)`` pairs.
+
+    :arg results: A list of results, from :py:func:`run_benchmarks`
+    :arg baseline: A list of earlier results
+    :arg tolerance: The allowed slowdown, e.g. 0.25 for 25%
+    :rtype: list
+    """
+    previous = dict(
+        ((r['name'], r['time_unit'], r['size']), r['best']) for r in baseline)
+    regressions = []
+    for r in results:
+        best = previous.get((r['name'], r['time_unit'], r['size']))
+        if best is not None and r['best'] > best * (1 + tolerance):
+            regressions.append((r, best))
+    return regressions
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True, help='Comma-separated catalogue sizes, up to 1000000.')
+@click.option('--units', default=DEFAULT_UNITS, show_default=True, help='Comma-separated time units.')
+@click.option('--repeat', default=3, show_default=True, type=int, help='Times to run each benchmark.')
+@click.option('--only', multiple=True, help='Run only this benchmark. Can be invoked multiple times.')
+@click.option('--output', help='Write the results to this JSON file.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Compare with the results in this JSON file.')
+@click.option('--tolerance', default=0.25, show_default=True, type=float, help='Allowed slowdown from the baseline.')
+def main(sizes, units, repeat, only, output, baseline, tolerance):
+    """Benchmark index and snapshot selection"""
+    results = run_benchmarks(
+        [int(s) for s in sizes.split(',')], units.split(','),
+        repeat=max(1, repeat), only=only,
+    )
+    report = {
+        'curator': curator.__version__,
+        'python': platform.python_version(),
+        'date': datetime.utcnow().isoformat(),
+        'results': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f)['results'], tolerance)
+        for r, best in regressions:
+            print('REGRESSION: {0} ({1}, {2}): {3:.6f}s, was {4:.6f}s'.format(
+                r['name'], r['time_unit'], r['size'], r['best'], best))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
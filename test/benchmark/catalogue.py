@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+# The timestring of the index names generated for each time unit, as in the
+# integration tests.
+TIMESTRINGS = {
+    'hours': '%Y.%m.%d.%H',
+    'days': '%Y.%m.%d',
+    'weeks': '%Y.%W',
+    'months': '%Y.%m',
+}
+# The length of one period of each time unit, for generating names.
+PERIODS = {
+    'hours': timedelta(hours=1),
+    'days': timedelta(days=1),
+    'weeks': timedelta(weeks=1),
+    'months': timedelta(days=31),
+}
+# The most periods to go back in time for one prefix.  Larger catalogues get
+# more prefixes rather than implausibly old dates.
+MAX_PERIODS = {
+    'hours': 24 * 366,
+    'days': 3 * 366,
+    'weeks': 3 * 53,
+    'months': 5 * 12,
+}
+KIBANA_INDICES = ['.kibana', 'kibana-int', '.marvel-kibana']
+
+def index_catalogue(count, time_unit='days', utc_now=None):
+    """
+    Return `count` time-series index names, going back from `utc_now` by
+    `time_unit`, as ``logstash-<n>-<timestamp>`` with as many prefixes as it
+    takes, followed by the Kibana indices.
+
+    :arg count: The number of time-series index names
+    :arg time_unit: One of ``hours``, ``days``, ``weeks``, ``months``
+    :arg utc_now: The time of the newest index
+    :rtype: list
+    """
+    utc_now = utc_now if utc_now else datetime.utcnow()
+    timestring = TIMESTRINGS[time_unit]
+    periods = min(count, MAX_PERIODS[time_unit])
+    stamps = []
+    seen = set()
+    for i in range(0, periods):
+        stamp = (utc_now - PERIODS[time_unit] * i).strftime(timestring)
+        if not stamp in seen:
+            seen.add(stamp)
+            stamps.append(stamp)
+    names = []
+    prefix = 0
+    while len(names) < count:
+        for stamp in stamps[:count - len(names)]:
+            names.append('logstash-{0}-{1}'.format(prefix, stamp))
+        prefix += 1
+    return names + KIBANA_INDICES
+
+def snapshot_catalogue(count, utc_now=None):
+    """
+    Return `count` snapshot names, one an hour going back from `utc_now`, as
+    :py:func:`curator.api.create_snapshot` names them.
+
+    :arg count: The number of snapshot names
+    :arg utc_now: The time of the newest snapshot
+    :rtype: list
+    """
+    utc_now = utc_now if utc_now else datetime.utcnow()
+    return [
+        'curator-' + (utc_now - timedelta(hours=i)).strftime('%Y%m%d%H%M%S')
+        for i in range(0, count)
+    ]
+
+def cluster_state(indices):
+    """
+    Return a ``cluster.state`` response with every one of `indices` open.
+
+    :arg indices: A list of index names
+    :rtype: dict
+    """
+    return {'metadata': {'indices': dict(
+        (index, {'state': 'open', 'settings': {}, 'aliases': []})
+        for index in indices
+    )}}
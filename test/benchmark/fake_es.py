@@ -0,0 +1,802 @@
+"""
+An in-process fake Elasticsearch 1.x HTTP server, for measuring the requests
+curator makes and the time it takes without a cluster.
+
+It keeps just enough state to answer the APIs curator calls: cluster state
+and settings, node info and stats, ``_cat/indices`` and ``_cat/shards``,
+index settings, open, close, flush, optimize, delete, ``_segments``,
+``_stats``, ``_recovery``, aliases, and snapshot repositories, snapshots and
+restores.  Snapshots and restores finish at once.
+
+Each request is counted under the name of the client method which sends it,
+e.g. ``cluster.state`` or ``indices.put_settings``, and the same names are
+used to configure latency and failures, e.g.::
+
+    server = FakeElasticsearch(
+        indices=index_catalogue(50000), latency={'*': 0.002,
+        'indices.optimize': 0.5}, failures={'indices.delete': 0.1})
+    server.start()
+    client = elasticsearch.Elasticsearch(port=server.port)
+    ...
+    print(server.stats())
+    server.stop()
+"""
+import re
+import json
+import time
+import random
+import fnmatch
+import threading
+from datetime import datetime
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+    from urllib import unquote_plus
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl, unquote_plus
+
+VERSION = '1.7.3'
+# As in Elasticsearch, request lines longer than this are refused.
+DEFAULT_MAX_INITIAL_LINE_LENGTH = 4096
+DEFAULT_SHARDS = 5
+DEFAULT_REPLICAS = 1
+DOCS_PER_INDEX = 100000
+BYTES_PER_DOC = 500
+SEGMENTS_PER_SHARD = 20
+
+INDEX = r'(?:/(?P<index>[^/_][^/]*))?'
+# (method, path, client method) for each API.  The first match wins.
+ROUTES = [
+    ('GET', r'^/$', 'info'),
+    ('HEAD', r'^/$', 'ping'),
+    ('GET', r'^/_cluster/state(?:/(?P<metric>[^/]+))?(?:/(?P<index>[^/]+))?$', 'cluster.state'),
+    ('GET', r'^/_cluster/settings$', 'cluster.get_settings'),
+    ('PUT', r'^/_cluster/settings$', 'cluster.put_settings'),
+    ('GET', r'^/_nodes(?:/[^/]+)?/stats(?:/[^/]+)*$', 'nodes.stats'),
+    ('GET', r'^/_nodes(?:/[^/]+)*$', 'nodes.info'),
+    ('GET', r'^/_cat/indices(?:/(?P<index>[^/]+))?$', 'cat.indices'),
+    ('GET', r'^/_cat/shards(?:/(?P<index>[^/]+))?$', 'cat.shards'),
+    ('POST', r'^/_aliases$', 'indices.update_aliases'),
+    ('HEAD', INDEX + r'/_alias(?:/(?P<name>[^/]+))?$', 'indices.exists_alias'),
+    ('GET', INDEX + r'/_alias(?:/(?P<name>[^/]+))?$', 'indices.get_alias'),
+    ('GET', r'^/_snapshot(?:/(?P<repository>[^/]+))?$', 'snapshot.get_repository'),
+    ('PUT', r'^/_snapshot/(?P<repository>[^/]+)$', 'snapshot.create_repository'),
+    ('POST', r'^/_snapshot/(?P<repository>[^/]+)$', 'snapshot.create_repository'),
+    ('DELETE', r'^/_snapshot/(?P<repository>[^/]+)$', 'snapshot.delete_repository'),
+    ('POST', r'^/_snapshot/(?P<repository>[^/]+)/_verify$', 'snapshot.verify_repository'),
+    ('GET', r'^/_snapshot/(?P<repository>[^/]+)/(?P<snapshot>[^/]+)/_status$', 'snapshot.status'),
+    ('POST', r'^/_snapshot/(?P<repository>[^/]+)/(?P<snapshot>[^/]+)/_restore$', 'snapshot.restore'),
+    ('GET', r'^/_snapshot/(?P<repository>[^/]+)/(?P<snapshot>[^/]+)$', 'snapshot.get'),
+    ('PUT', r'^/_snapshot/(?P<repository>[^/]+)/(?P<snapshot>[^/]+)$', 'snapshot.create'),
+    ('DELETE', r'^/_snapshot/(?P<repository>[^/]+)/(?P<snapshot>[^/]+)$', 'snapshot.delete'),
+    ('GET', INDEX + r'/_settings$', 'indices.get_settings'),
+    ('PUT', INDEX + r'/_settings$', 'indices.put_settings'),
+    ('POST', INDEX + r'/_close$', 'indices.close'),
+    ('POST', INDEX + r'/_open$', 'indices.open'),
+    ('POST', INDEX + r'/_flush$', 'indices.flush'),
+    ('GET', INDEX + r'/_flush$', 'indices.flush'),
+    ('POST', INDEX + r'/_optimize$', 'indices.optimize'),
+    ('GET', INDEX + r'/_segments$', 'indices.segments'),
+    ('GET', INDEX + r'/_stats(?:/[^/]+)?$', 'indices.stats'),
+    ('GET', INDEX + r'/_recovery$', 'indices.recovery'),
+    ('HEAD', r'^/(?P<index>[^/_][^/]*)$', 'indices.exists'),
+    ('DELETE', r'^/(?P<index>[^/_][^/]*)$', 'indices.delete'),
+]
+ROUTES = [(m, re.compile(p), name) for m, p, name in ROUTES]
+
+class FakeError(Exception):
+    """An error response, with its HTTP status."""
+    def __init__(self, status, error):
+        super(FakeError, self).__init__(error)
+        self.status = status
+        self.error = error
+
+def nest(flat):
+    """Return flat dotted settings as nested dictionaries."""
+    retval = {}
+    for key, value in flat.items():
+        node = retval
+        parts = key.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return retval
+
+def flatten(settings, prefix=''):
+    """Return nested settings as flat dotted settings."""
+    retval = {}
+    for key, value in settings.items():
+        if isinstance(value, dict):
+            retval.update(flatten(value, prefix + key + '.'))
+        else:
+            retval[prefix + key] = str(value).lower() if isinstance(value, bool) else str(value)
+    return retval
+
+def filter_path(response, paths):
+    """
+    Return the parts of `response` named by the comma-separated dotted
+    `paths`, as the ``filter_path`` parameter does.  ``*`` matches any key.
+    """
+    tree = {}
+    for path in paths.split(','):
+        node = tree
+        for part in path.split('.'):
+            node = node.setdefault(part, {})
+    def apply(value, node):
+        if not node:
+            return value
+        if isinstance(value, list):
+            return [v for v in (apply(v, node) for v in value) if v not in ({}, None)]
+        if not isinstance(value, dict):
+            return None
+        retval = {}
+        for key, sub in node.items():
+            for k in (fnmatch.filter(value, key) if '*' in key else [key]):
+                if k in value:
+                    v = apply(value[k], sub)
+                    if v not in ({}, [], None):
+                        retval[k] = v
+        return retval
+    return apply(response, tree)
+
+class FakeElasticsearch(object):
+    """
+    A fake Elasticsearch cluster, served over HTTP on localhost.
+
+    :arg indices: A list of index names to create, open, with
+        ``number_of_shards`` shards and ``number_of_replicas`` replicas each.
+    :arg nodes: The number of data nodes.  Shards are spread over them.
+    :arg repositories: A list of snapshot repository names to create.
+    :arg snapshots: A list of snapshot names to create in each repository,
+        each of all `indices`.
+    :arg latency: Seconds to wait before answering each request, keyed by
+        client method name, with ``*`` for any other method.
+    :arg failures: The fraction (0 to 1) of requests to fail, keyed as
+        `latency`.
+    :arg failure_status: The HTTP status of a failed request.  Note that
+        elasticsearch-py retries requests which fail with 502, 503 or 504.
+    :arg max_initial_line_length: Refuse requests whose request line is
+        longer than this many bytes.
+    :arg number_of_shards: Primary shards per index
+    :arg number_of_replicas: Replicas per index
+    :arg seed: The seed of the random failures
+    """
+    def __init__(self, indices=None, nodes=3, repositories=None,
+                 snapshots=None, latency=None, failures=None,
+                 failure_status=500,
+                 max_initial_line_length=DEFAULT_MAX_INITIAL_LINE_LENGTH,
+                 number_of_shards=DEFAULT_SHARDS,
+                 number_of_replicas=DEFAULT_REPLICAS, seed=0):
+        self.lock = threading.RLock()
+        self.nodes = ['node-{0}'.format(i) for i in range(0, max(1, nodes))]
+        self.latency = dict(latency or {})
+        self.failures = dict(failures or {})
+        self.failure_status = failure_status
+        self.max_initial_line_length = max_initial_line_length
+        self.number_of_shards = number_of_shards
+        self.number_of_replicas = number_of_replicas
+        self.random = random.Random(seed)
+        self.version = 1
+        self.indices = {}
+        self.repositories = {}
+        self.cluster_settings = {'persistent': {}, 'transient': {}}
+        self.server = None
+        self.thread = None
+        self.reset_stats()
+        created = int(time.time() * 1000)
+        for i, name in enumerate(indices or []):
+            self.create_index(name, creation_date=created - i * 1000)
+        for repository in repositories or []:
+            self.repositories[repository] = {
+                'type': 'fs', 'settings': {'location': '/tmp/' + repository},
+                'snapshots': {},
+            }
+            everything = sorted(self.indices)
+            for name in snapshots or []:
+                self.take_snapshot(repository, name, everything)
+
+    def create_index(self, name, creation_date=None, settings=None):
+        """
+        Create the open index `name`.
+
+        :arg name: The index name
+        :arg creation_date: The ``index.creation_date``, in milliseconds
+        :arg settings: Other flat index settings
+        """
+        flat = {
+            'index.number_of_shards': str(self.number_of_shards),
+            'index.number_of_replicas': str(self.number_of_replicas),
+            'index.uuid': 'uuid-{0}'.format(len(self.indices)),
+            'index.version.created': '1070399',
+            'index.creation_date': str(creation_date or int(time.time() * 1000)),
+        }
+        flat.update(settings or {})
+        with self.lock:
+            self.indices[name] = {
+                'state': 'open', 'settings': flat, 'aliases': [],
+                'docs': DOCS_PER_INDEX, 'segments': SEGMENTS_PER_SHARD,
+                'first_node': len(self.indices) % len(self.nodes),
+            }
+            self.version += 1
+
+    def shards(self, name):
+        """
+        Yield ``(shard, primary, node)`` for each copy of each shard of the
+        index `name`.
+        """
+        index = self.indices[name]
+        shards = int(index['settings']['index.number_of_shards'])
+        copies = min(1 + int(index['settings']['index.number_of_replicas']), len(self.nodes))
+        for shard in range(0, shards):
+            for copy in range(0, copies):
+                node = self.nodes[(index['first_node'] + shard + copy) % len(self.nodes)]
+                yield shard, copy == 0, node
+
+    def take_snapshot(self, repository, name, indices, state='SUCCESS'):
+        """
+        Record a finished snapshot of `indices`.
+
+        :arg repository: The repository name
+        :arg name: The snapshot name
+        :arg indices: A list of index names, which is kept, not copied
+        :arg state: The snapshot state
+        """
+        now = int(time.time() * 1000)
+        shards = self.number_of_shards * len(indices)
+        with self.lock:
+            self.repositories[repository]['snapshots'][name] = {
+                'snapshot': name, 'indices': indices, 'state': state,
+                'start_time': datetime.utcfromtimestamp(now / 1000.0).isoformat() + 'Z',
+                'start_time_in_millis': now, 'end_time_in_millis': now,
+                'duration_in_millis': 0, 'failures': [],
+                'shards': {'total': shards, 'failed': 0, 'successful': shards},
+            }
+
+    def size(self, name):
+        """Return the primary store size of the index `name`, in bytes."""
+        return self.indices[name]['docs'] * BYTES_PER_DOC
+
+    # Serving
+
+    def start(self, port=0):
+        """
+        Start serving on localhost, in a background thread.
+
+        :arg port: The port, or 0 for any free port
+        """
+        self.server = FakeHTTPServer(('127.0.0.1', port), FakeRequestHandler)
+        self.server.fake = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        """Forget the requests counted so far."""
+        self.requests = {}
+        self.request_time = {}
+        self.errors = {}
+
+    def stats(self):
+        """
+        Return the number of requests, errors and seconds spent answering
+        them, keyed by client method name.
+
+        :rtype: dict
+        """
+        with self.lock:
+            return dict(
+                (name, {
+                    'count': count,
+                    'errors': self.errors.get(name, 0),
+                    'time': self.request_time.get(name, 0.0),
+                })
+                for name, count in self.requests.items()
+            )
+
+    def _count(self, name, duration, error):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            self.request_time[name] = self.request_time.get(name, 0.0) + duration
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def handle(self, method, url, body, line_length=0):
+        """
+        Answer one request, and return the HTTP status and the response body,
+        a dictionary or (for ``_cat``) a string.
+
+        :arg method: The HTTP method
+        :arg url: The request path and query string
+        :arg body: The request body, or `None`
+        :arg line_length: The length of the request line, in bytes
+        :rtype: tuple
+        """
+        start = time.time()
+        parsed = urlparse(url)
+        params = dict(parse_qsl(parsed.query, keep_blank_values=True))
+        name = 'unknown'
+        status = 200
+        try:
+            for m, pattern, route in ROUTES:
+                match = pattern.match(parsed.path)
+                if match and m == method:
+                    name = route
+                    break
+            else:
+                raise FakeError(400, 'No handler found for uri [{0}] and method [{1}]'.format(parsed.path, method))
+            if line_length > self.max_initial_line_length:
+                raise FakeError(400, 'TooLongFrameException[An HTTP line is larger than {0} bytes.]'.format(self.max_initial_line_length))
+            delay = self.latency.get(name, self.latency.get('*', 0))
+            if delay:
+                time.sleep(delay)
+            rate = self.failures.get(name, self.failures.get('*', 0))
+            if rate:
+                with self.lock:
+                    fail = self.random.random() < rate
+                if fail:
+                    raise FakeError(self.failure_status, 'Injected failure of {0}'.format(name))
+            kwargs = dict(
+                (k, unquote_plus(v)) for k, v in match.groupdict().items() if v is not None)
+            with self.lock:
+                response = getattr(self, name.replace('.', '_'))(params, body, **kwargs)
+            if isinstance(response, tuple):
+                status, response = response
+            if 'filter_path' in params and isinstance(response, dict):
+                response = filter_path(response, params['filter_path'])
+        except FakeError as e:
+            status, response = e.status, {'error': e.error, 'status': e.status}
+        self._count(name, time.time() - start, status >= 400)
+        return status, response
+
+    def resolve(self, expression, params=None, closed=True):
+        """
+        Return the sorted index names matched by a comma-separated list of
+        names, aliases and wildcards.
+
+        :arg expression: The index expression, or `None` for all indices
+        :arg params: The query parameters, for ``ignore_unavailable``
+        :arg closed: Include closed indices matched by wildcards
+        :rtype: list
+        """
+        params = params or {}
+        if not expression or expression in ('_all', '*'):
+            names = set(self.indices)
+        else:
+            names = set()
+            for part in expression.split(','):
+                if '*' in part:
+                    names.update(fnmatch.filter(self.indices, part))
+                elif part in self.indices:
+                    names.add(part)
+                else:
+                    aliased = [i for i, v in self.indices.items() if part in v['aliases']]
+                    if aliased:
+                        names.update(aliased)
+                    elif params.get('ignore_unavailable') != 'true':
+                        raise FakeError(404, 'IndexMissingException[[{0}] missing]'.format(part))
+        if not closed:
+            names = set(n for n in names if self.indices[n]['state'] == 'open')
+        return sorted(names)
+
+    def _open_indices(self, index, params):
+        names = self.resolve(index, params)
+        for name in names:
+            if self.indices[name]['state'] == 'close' and params.get('ignore_unavailable') != 'true':
+                raise FakeError(403, 'IndexClosedException[[{0}] closed]'.format(name))
+        return [n for n in names if self.indices[n]['state'] == 'open']
+
+    def _body(self, body):
+        if not body:
+            return {}
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise FakeError(400, 'Failed to parse request body')
+
+    # Cluster and nodes
+
+    def info(self, params, body):
+        return {
+            'status': 200, 'name': self.nodes[0], 'cluster_name': 'fake',
+            'version': {'number': VERSION, 'lucene_version': '4.10.4'},
+            'tagline': 'You Know, for Search',
+        }
+
+    def ping(self, params, body):
+        return {}
+
+    def cluster_state(self, params, body, metric='_all', index=None):
+        metrics = set(metric.split(','))
+        everything = '_all' in metrics
+        response = {'cluster_name': 'fake'}
+        if everything or 'version' in metrics:
+            response['version'] = self.version
+        if everything or 'master_node' in metrics:
+            response['master_node'] = self.nodes[0]
+        if everything or 'nodes' in metrics:
+            response['nodes'] = dict((n, {'name': n}) for n in self.nodes)
+        if everything or 'metadata' in metrics:
+            names = self.resolve(index, {'ignore_unavailable': 'true'})
+            response['metadata'] = {
+                'cluster_uuid': 'fake-cluster-uuid',
+                'indices': dict(
+                    (n, {
+                        'state': self.indices[n]['state'],
+                        'settings': nest(self.indices[n]['settings']),
+                        'aliases': list(self.indices[n]['aliases']),
+                    }) for n in names
+                ),
+            }
+        return response
+
+    def cluster_get_settings(self, params, body):
+        if params.get('flat_settings') == 'true':
+            return dict((k, dict(v)) for k, v in self.cluster_settings.items())
+        return dict((k, nest(v)) for k, v in self.cluster_settings.items())
+
+    def cluster_put_settings(self, params, body):
+        body = self._body(body)
+        for scope in ('persistent', 'transient'):
+            self.cluster_settings[scope].update(flatten(body.get(scope, {})))
+        return dict(body, acknowledged=True)
+
+    def nodes_info(self, params, body):
+        return {'cluster_name': 'fake', 'nodes': dict(
+            (n, {'name': n, 'version': VERSION, 'settings': {}})
+            for n in self.nodes
+        )}
+
+    def nodes_stats(self, params, body):
+        return {'cluster_name': 'fake', 'nodes': dict(
+            (n, {
+                'name': n,
+                'indices': {'merges': {'current': 0}},
+                'jvm': {'mem': {'heap_used_percent': 50}},
+                'fs': {'total': {'total_in_bytes': 2**40, 'available_in_bytes': 2**39}},
+                'thread_pool': dict(
+                    (pool, {'rejected': 0}) for pool in ('search', 'index', 'bulk')),
+            }) for n in self.nodes
+        )}
+
+    # _cat
+
+    def _cat(self, params, rows, default):
+        columns = params.get('h', default).split(',')
+        lines = []
+        for row in rows:
+            lines.append(' '.join(str(row.get(c, '')) for c in columns).rstrip())
+        return ''.join(line + '\n' for line in lines)
+
+    def cat_indices(self, params, body, index=None):
+        rows = []
+        for name in self.resolve(index, params):
+            i = self.indices[name]
+            row = {'index': name, 'status': i['state']}
+            if i['state'] == 'open':
+                replicas = int(i['settings']['index.number_of_replicas'])
+                row.update({
+                    'health': 'green',
+                    'pri': i['settings']['index.number_of_shards'],
+                    'rep': replicas, 'docs.count': i['docs'],
+                    'pri.store.size': self.size(name),
+                    'store.size': self.size(name) * (1 + replicas),
+                })
+            rows.append(row)
+        return 200, self._cat(params, rows, 'health,status,index,pri,rep,docs.count,store.size,pri.store.size')
+
+    def cat_shards(self, params, body, index=None):
+        rows = []
+        for name in self.resolve(index, params, closed=False):
+            shards = int(self.indices[name]['settings']['index.number_of_shards'])
+            for shard, primary, node in self.shards(name):
+                rows.append({
+                    'index': name, 'shard': shard, 'prirep': 'p' if primary else 'r',
+                    'state': 'STARTED', 'docs': self.indices[name]['docs'] // shards,
+                    'store': self.size(name) // shards, 'ip': '127.0.0.1',
+                    'node': node,
+                })
+        return 200, self._cat(params, rows, 'index,shard,prirep,state,docs,store,ip,node')
+
+    # Indices
+
+    def indices_exists(self, params, body, index):
+        self.resolve(index)
+        return {}
+
+    def indices_get_settings(self, params, body, index=None):
+        closed = 'closed' in params.get('expand_wildcards', 'open,closed')
+        flat = params.get('flat_settings') == 'true'
+        return dict(
+            (n, {'settings': dict(self.indices[n]['settings']) if flat else nest(self.indices[n]['settings'])})
+            for n in self.resolve(index, params, closed=closed)
+        )
+
+    def indices_put_settings(self, params, body, index=None):
+        try:
+            settings = flatten(self._body(body))
+        except FakeError:
+            settings = dict(
+                line.split('=', 1) for line in body.splitlines() if '=' in line)
+        settings = dict(
+            (k if k.startswith('index.') else 'index.' + k, v)
+            for k, v in settings.items()
+        )
+        for name in self._open_indices(index, params):
+            self.indices[name]['settings'].update(settings)
+        self.version += 1
+        return {'acknowledged': True}
+
+    def _set_state(self, params, index, state):
+        names = self.resolve(index, params)
+        for name in names:
+            self.indices[name]['state'] = state
+        self.version += 1
+        return {'acknowledged': True}
+
+    def indices_close(self, params, body, index=None):
+        return self._set_state(params, index, 'close')
+
+    def indices_open(self, params, body, index=None):
+        return self._set_state(params, index, 'open')
+
+    def indices_delete(self, params, body, index):
+        for name in self.resolve(index, params):
+            del self.indices[name]
+        self.version += 1
+        return {'acknowledged': True}
+
+    def indices_flush(self, params, body, index=None):
+        names = self._open_indices(index, params)
+        return {'_shards': self._shard_counts(names)}
+
+    def _shard_counts(self, names):
+        total = sum(len(list(self.shards(n))) for n in names)
+        return {'total': total, 'successful': total, 'failed': 0}
+
+    def indices_optimize(self, params, body, index=None):
+        names = self._open_indices(index, params)
+        segments = int(params.get('max_num_segments', 1))
+        for name in names:
+            self.indices[name]['segments'] = min(self.indices[name]['segments'], segments)
+        return {'_shards': self._shard_counts(names)}
+
+    def indices_segments(self, params, body, index=None):
+        names = self._open_indices(index, params)
+        response = {'_shards': self._shard_counts(names), 'indices': {}}
+        for name in names:
+            shards = {}
+            for shard, primary, node in self.shards(name):
+                shards.setdefault(str(shard), []).append({
+                    'routing': {'state': 'STARTED', 'primary': primary, 'node': node},
+                    'num_committed_segments': self.indices[name]['segments'],
+                    'num_search_segments': self.indices[name]['segments'],
+                    'segments': {},
+                })
+            response['indices'][name] = {'shards': shards}
+        return response
+
+    def indices_stats(self, params, body, index=None):
+        names = self._open_indices(index, params)
+        indices = {}
+        for name in names:
+            replicas = int(self.indices[name]['settings']['index.number_of_replicas'])
+            primaries = {
+                'docs': {'count': self.indices[name]['docs'], 'deleted': 0},
+                'store': {'size_in_bytes': self.size(name)},
+            }
+            total = {
+                'docs': {'count': self.indices[name]['docs'] * (1 + replicas), 'deleted': 0},
+                'store': {'size_in_bytes': self.size(name) * (1 + replicas)},
+            }
+            indices[name] = {'primaries': primaries, 'total': total}
+        return {'_shards': self._shard_counts(names), 'indices': indices}
+
+    def indices_recovery(self, params, body, index=None):
+        response = {}
+        for name in self._open_indices(index, params):
+            shards = int(self.indices[name]['settings']['index.number_of_shards'])
+            size = self.size(name) // shards
+            response[name] = {'shards': [
+                {
+                    'id': shard, 'primary': primary, 'stage': 'DONE',
+                    'type': 'SNAPSHOT' if self.indices[name].get('restored') else 'GATEWAY',
+                    'target': {'name': node},
+                    'index': {'size': {
+                        'total_in_bytes': size, 'recovered_in_bytes': size,
+                        'percent': '100.0%',
+                    }},
+                } for shard, primary, node in self.shards(name)
+            ]}
+        return response
+
+    # Aliases
+
+    def indices_update_aliases(self, params, body):
+        for action in self._body(body).get('actions', []):
+            for verb, spec in action.items():
+                alias = spec.get('alias')
+                for name in self.resolve(spec.get('index')):
+                    aliases = self.indices[name]['aliases']
+                    if verb == 'add' and not alias in aliases:
+                        aliases.append(alias)
+                    elif verb == 'remove':
+                        if not alias in aliases:
+                            raise FakeError(404, 'AliasesMissingException[aliases [[{0}]] missing]'.format(alias))
+                        aliases.remove(alias)
+        self.version += 1
+        return {'acknowledged': True}
+
+    def indices_get_alias(self, params, body, index=None, name=None):
+        response = {}
+        for n in self.resolve(index, params):
+            aliases = self.indices[n]['aliases']
+            matched = fnmatch.filter(aliases, name) if name else aliases
+            if matched:
+                response[n] = {'aliases': dict((a, {}) for a in matched)}
+        if name and not response:
+            raise FakeError(404, 'alias [{0}] missing'.format(name))
+        return response
+
+    def indices_exists_alias(self, params, body, index=None, name=None):
+        return self.indices_get_alias(params, body, index=index, name=name)
+
+    # Snapshots
+
+    def _repository(self, repository):
+        if not repository in self.repositories:
+            raise FakeError(404, 'RepositoryMissingException[[{0}] missing]'.format(repository))
+        return self.repositories[repository]
+
+    def snapshot_get_repository(self, params, body, repository=None):
+        names = sorted(self.repositories) if repository in (None, '_all') else repository.split(',')
+        return dict(
+            (n, {'type': self._repository(n)['type'], 'settings': self._repository(n)['settings']})
+            for n in names
+        )
+
+    def snapshot_create_repository(self, params, body, repository):
+        body = self._body(body)
+        old = self.repositories.get(repository, {})
+        self.repositories[repository] = {
+            'type': body.get('type', 'fs'), 'settings': body.get('settings', {}),
+            'snapshots': old.get('snapshots', {}),
+        }
+        return {'acknowledged': True}
+
+    def snapshot_delete_repository(self, params, body, repository):
+        self._repository(repository)
+        del self.repositories[repository]
+        return {'acknowledged': True}
+
+    def snapshot_verify_repository(self, params, body, repository):
+        self._repository(repository)
+        return {'nodes': dict((n, {'name': n}) for n in self.nodes)}
+
+    def _snapshot(self, repository, snapshot):
+        snapshots = self._repository(repository)['snapshots']
+        if not snapshot in snapshots:
+            raise FakeError(404, 'SnapshotMissingException[[{0}:{1}] is missing]'.format(repository, snapshot))
+        return snapshots[snapshot]
+
+    def snapshot_get(self, params, body, repository, snapshot):
+        snapshots = self._repository(repository)['snapshots']
+        if snapshot == '_all':
+            found = sorted(snapshots.values(), key=lambda s: s['start_time_in_millis'])
+        else:
+            found = [self._snapshot(repository, s) for s in snapshot.split(',')]
+        return {'snapshots': [s for s in found]}
+
+    def snapshot_create(self, params, body, repository, snapshot):
+        self._repository(repository)
+        if snapshot in self.repositories[repository]['snapshots']:
+            raise FakeError(400, 'InvalidSnapshotNameException[[{0}:{1}] Invalid snapshot name [{1}], snapshot with such name already exists]'.format(repository, snapshot))
+        body = self._body(body)
+        indices = body.get('indices', '_all')
+        if isinstance(indices, list):
+            indices = ','.join(indices)
+        names = self._open_indices(indices, {
+            'ignore_unavailable': 'true' if body.get('ignore_unavailable') else 'false'})
+        self.take_snapshot(repository, snapshot, names)
+        if params.get('wait_for_completion') == 'true':
+            return {'snapshot': self._snapshot(repository, snapshot)}
+        return {'accepted': True}
+
+    def snapshot_delete(self, params, body, repository, snapshot):
+        self._snapshot(repository, snapshot)
+        del self.repositories[repository]['snapshots'][snapshot]
+        return {'acknowledged': True}
+
+    def snapshot_status(self, params, body, repository, snapshot):
+        snap = self._snapshot(repository, snapshot)
+        size = sum(self.size(i) for i in snap['indices'] if i in self.indices)
+        shards = snap['shards']['total']
+        return {'snapshots': [{
+            'snapshot': snapshot, 'repository': repository, 'state': 'SUCCESS',
+            'shards_stats': {
+                'initializing': 0, 'started': 0, 'finalizing': 0,
+                'done': shards, 'failed': 0, 'total': shards,
+            },
+            'stats': {
+                'number_of_files': shards, 'processed_files': shards,
+                'total_size_in_bytes': size, 'processed_size_in_bytes': size,
+                'start_time_in_millis': snap['start_time_in_millis'],
+                'time_in_millis': 0,
+            },
+        }]}
+
+    def snapshot_restore(self, params, body, repository, snapshot):
+        snap = self._snapshot(repository, snapshot)
+        body = self._body(body)
+        names = snap['indices']
+        if body.get('indices'):
+            wanted = body['indices']
+            wanted = wanted.split(',') if not isinstance(wanted, list) else wanted
+            names = [n for n in names if any(fnmatch.fnmatch(n, w) for w in wanted)]
+        renamed = names
+        if body.get('rename_pattern'):
+            pattern = re.compile(body['rename_pattern'])
+            replacement = re.sub(r'\$(\d+)', r'\\g<\1>', body.get('rename_replacement', ''))
+            renamed = [pattern.sub(replacement, n) for n in names]
+        for name in renamed:
+            if name in self.indices and self.indices[name]['state'] == 'open':
+                raise FakeError(500, "SnapshotRestoreException[[{0}:{1}] cannot restore index [{2}] because it's open]".format(repository, snapshot, name))
+        for name in renamed:
+            self.create_index(name)
+            self.indices[name]['restored'] = True
+        if params.get('wait_for_completion') == 'true':
+            return {'snapshot': {'snapshot': snapshot, 'indices': renamed}}
+        return {'accepted': True}
+
+class FakeHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections open, as elasticsearch-py expects.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        if body is not None:
+            body = body.decode('utf-8')
+        status, response = fake.handle(
+            self.command, self.path, body, line_length=len(self.requestline))
+        if isinstance(response, dict):
+            data = json.dumps(response).encode('utf-8')
+            content_type = 'application/json; charset=UTF-8'
+        else:
+            data = response.encode('utf-8')
+            content_type = 'text/plain; charset=UTF-8'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _handle
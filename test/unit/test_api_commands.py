@@ -1,7 +1,13 @@
 from datetime import datetime, timedelta
 from unittest import TestCase
-from mock import Mock
+from mock import Mock, call, patch
 import sys
+import json
+import time
+import threading
+import shutil
+import tempfile
+import os
 try:
     from StringIO import StringIO
 except ImportError:
@@ -75,6 +81,12 @@ snap_body       = {
                     "indices" : "index1,index2"
                   }
 verified_nodes  = {'nodes': {'nodeid1': {'name': 'node1'}, 'nodeid2': {'name': 'node2'}}}
+alias_state     = { 'metadata': { 'indices': {
+                    'index1': { 'state': 'open', 'aliases': [ named_alias ] },
+                    'index2': { 'state': 'open', 'aliases': [] },
+                    'index3': { 'state': 'close', 'aliases': [] },
+                    'index4': { 'state': 'open', 'aliases': [ named_alias ] },
+                  }}}
 
 class TestAlias(TestCase):
     def test_add_to_alias_bad_csv(self):
@@ -123,6 +135,54 @@ class TestAlias(TestCase):
         client.indices.get_alias.return_value = aliases_retval
         self.assertFalse(curator.remove_from_alias(client, "foo", alias=named_alias))
 
+    def test_alias_add_single_request(self):
+        client = Mock()
+        client.cluster.state.return_value = alias_state
+        self.assertTrue(curator.alias(client, ['index1', 'index2'], alias=named_alias))
+        client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            { 'add': { 'index': 'index2', 'alias': named_alias }}]})
+        self.assertFalse(client.indices.exists_alias.called)
+    def test_alias_add_closed(self):
+        client = Mock()
+        client.cluster.state.return_value = alias_state
+        self.assertFalse(curator.alias(client, ['index2', 'index3'], alias=named_alias))
+        client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            { 'add': { 'index': 'index2', 'alias': named_alias }}]})
+    def test_alias_remove_single_request(self):
+        client = Mock()
+        client.cluster.state.return_value = alias_state
+        self.assertTrue(curator.alias(client, ['index1', 'index4'], alias=named_alias, remove=True))
+        client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            { 'remove': { 'index': 'index1', 'alias': named_alias }},
+            { 'remove': { 'index': 'index4', 'alias': named_alias }}]})
+    def test_alias_remove_not_in_alias(self):
+        client = Mock()
+        client.cluster.state.return_value = alias_state
+        self.assertFalse(curator.alias(client, ['index1', 'index2'], alias=named_alias, remove=True))
+    def test_alias_not_found(self):
+        client = Mock()
+        client.cluster.state.return_value = alias_state
+        self.assertFalse(curator.alias(client, ['index2'], alias='foo'))
+        self.assertFalse(client.indices.update_aliases.called)
+    def test_alias_no_alias_arg(self):
+        client = Mock()
+        self.assertFalse(curator.alias(client, named_indices))
+    def test_alias_exception(self):
+        client = Mock()
+        client.cluster.state.return_value = alias_state
+        client.indices.update_aliases.side_effect = fake_fail
+        self.assertFalse(curator.alias(client, ['index2'], alias=named_alias))
+    def test_chunk_alias_actions(self):
+        actions = [
+            { 'add': { 'index': 'index{0}'.format(i), 'alias': named_alias }}
+            for i in range(0, 100)
+        ]
+        chunks = curator.chunk_alias_actions(actions, max_body_size=1024)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(actions, [a for chunk in chunks for a in chunk])
+        for chunk in chunks:
+            self.assertTrue(len(json.dumps({'actions': chunk})) <= 1024)
+
 class TestAllocate(TestCase):
     def test_apply_allocation_rule_param_check(self):
         client = Mock()
@@ -201,6 +261,17 @@ class TestBloom(TestCase):
         client.indices.put_settings.side_effect = fake_fail
         self.assertFalse(curator.bloom(client, named_index))
 
+    def test_loop_bloom_checks_version_once(self):
+        client = Mock()
+        client.info.return_value = {'version': {'number': '1.3.4'} }
+        client.cluster.state.return_value = open_indices
+        self.assertTrue(curator.disable_bloom_filter(
+            client, named_indices, delay=0.001
+            ))
+        self.assertEqual(1, client.info.call_count)
+        self.assertEqual(1, client.cluster.state.call_count)
+        self.assertEqual(2, client.indices.put_settings.call_count)
+
 class TestClose(TestCase):
     def test_close_indices_positive(self):
         client = Mock()
@@ -295,6 +366,158 @@ class TestOptimize(TestCase):
         client.indices.optimize.side_effect = fake_fail
         self.assertFalse(curator.optimize(client, named_index, max_num_segments=2))
 
+    def test_optimize_missing_arg(self):
+        client = Mock()
+        self.assertFalse(curator.optimize(client, named_index))
+    def test_optimize_single_segments_request(self):
+        client = Mock()
+        client.cluster.state.return_value = open_indices
+        client.indices.segments.return_value = { 'indices': {
+            'index1': shards['indices'][named_index],
+            'index2': shards['indices'][named_index] }}
+        self.assertTrue(curator.optimize(client, named_indices, max_num_segments=2))
+        # One preflight request, then one per index to report the reduction
+        self.assertEqual(call(index='index1,index2'), client.indices.segments.call_args_list[0])
+        self.assertEqual(3, client.indices.segments.call_count)
+        self.assertEqual(1, client.cluster.state.call_count)
+        self.assertEqual(2, client.indices.optimize.call_count)
+    def test_optimize_all_closed(self):
+        client = Mock()
+        client.cluster.state.return_value = closed_indices
+        self.assertTrue(curator.optimize(client, named_indices, max_num_segments=2))
+        self.assertFalse(client.indices.segments.called)
+    def test_optimize_missing_segments(self):
+        client = Mock()
+        client.cluster.state.return_value = open_indices
+        client.indices.segments.return_value = { 'indices': {
+            'index1': shards['indices'][named_index] }}
+        with patch.object(sys.modules['curator.api.optimize'].logger, 'warn') as warn:
+            self.assertTrue(curator.optimize(client, named_indices, max_num_segments=2))
+        self.assertEqual(1, client.indices.optimize.call_count)
+        self.assertTrue('index2' in warn.call_args[0][0])
+    def test_get_segmentcounts_chunked(self):
+        indices = ['index{0:04d}'.format(i) for i in range(0, 1000)]
+        client = Mock()
+        client.indices.segments.side_effect = lambda index=None: { 'indices': dict(
+            (i, shards['indices'][named_index]) for i in index.split(',')) }
+        counts = curator.get_segmentcounts(client, indices)
+        self.assertEqual(indices, sorted(counts))
+        self.assertTrue(client.indices.segments.call_count > 1)
+        for c in client.indices.segments.call_args_list:
+            self.assertTrue(len(c[1]['index']) <= curator.DEFAULT_MAX_INITIAL_LINE_LENGTH)
+
+def scheduler_client(names):
+    client = Mock()
+    client.cluster.state.return_value = { 'metadata': { 'indices': dict(
+        (i, { 'state': 'open' }) for i in names) }}
+    client.indices.segments.side_effect = lambda index=None: { 'indices': {
+        index: shards['indices'][named_index] }}
+    return client
+
+class TestOptimizeScheduler(TestCase):
+    def test_get_shard_nodes(self):
+        client = Mock()
+        client.cat.shards.return_value = (
+            'index1 node1\nindex1 node 2\nindex2 node1\nindex2 \n')
+        self.assertEqual(
+            {'index1': set(['node1', 'node 2']), 'index2': set(['node1'])},
+            curator.get_shard_nodes(client, named_indices))
+    def test_get_shard_copies_chunked(self):
+        indices = ['index{0:04d}'.format(i) for i in range(0, 1000)]
+        client = Mock()
+        client.cat.shards.side_effect = lambda index=None, h=None: ''.join(
+            '{0} node1\n'.format(i) for i in index.split(','))
+        copies = curator.get_shard_copies(client, indices)
+        self.assertEqual(indices, sorted(copies))
+        self.assertTrue(client.cat.shards.call_count > 1)
+        for c in client.cat.shards.call_args_list:
+            self.assertTrue(len(c[1]['index']) <= curator.DEFAULT_MAX_INITIAL_LINE_LENGTH)
+    def test_node_concurrency(self):
+        placement = {'index1': 'node1', 'index2': 'node1', 'index3': 'node2', 'index4': 'node2'}
+        client = scheduler_client(placement)
+        client.cat.shards.return_value = (
+            'index1 node1\nindex2 node1\nindex3 node2\nindex4 node2\n')
+        state = { 'running': 0, 'max': 0, 'nodes': {} }
+        lock = threading.Lock()
+        def fake_optimize(index=None, **kwargs):
+            with lock:
+                node = placement[index]
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+                state['nodes'][node] = state['nodes'].get(node, 0) + 1
+                self.assertTrue(state['nodes'][node] <= 1)
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+                state['nodes'][node] -= 1
+        client.indices.optimize.side_effect = fake_optimize
+        counts = dict((i, (4, 71)) for i in placement)
+        scheduler = curator.OptimizeScheduler(
+            client, sorted(placement), max_num_segments=2, concurrency=4,
+            node_concurrency=1, segmentcounts=counts,
+            metadata=curator.ClusterMetadataSnapshot(client))
+        self.assertTrue(scheduler.run())
+        self.assertEqual(2, state['max'])
+        self.assertEqual(4, client.indices.optimize.call_count)
+        self.assertEqual(71, scheduler.results['index1']['segments_before'])
+        self.assertEqual(71, scheduler.results['index1']['segments_after'])
+    def test_cluster_concurrency(self):
+        client = scheduler_client(['index1', 'index2', 'index3'])
+        client.cat.shards.return_value = (
+            'index1 node1\nindex2 node2\nindex3 node3\n')
+        state = { 'running': 0, 'max': 0 }
+        lock = threading.Lock()
+        def fake_optimize(index=None, **kwargs):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+        client.indices.optimize.side_effect = fake_optimize
+        counts = dict((i, (4, 71)) for i in ['index1', 'index2', 'index3'])
+        scheduler = curator.OptimizeScheduler(
+            client, ['index1', 'index2', 'index3'], max_num_segments=2,
+            concurrency=2, node_concurrency=1, segmentcounts=counts,
+            metadata=curator.ClusterMetadataSnapshot(client))
+        self.assertTrue(scheduler.run())
+        self.assertEqual(2, state['max'])
+    def test_throttle_excludes_own_merges(self):
+        client = scheduler_client(['index1', 'index2'])
+        client.cat.shards.return_value = (
+            'index1 node1\nindex1 node1\nindex1 node2\nindex2 node3\n')
+        started = threading.Event()
+        finish = threading.Event()
+        def fake_optimize(index=None, **kwargs):
+            if index == 'index1':
+                started.set()
+                finish.wait(5)
+        client.indices.optimize.side_effect = fake_optimize
+        throttle = Mock()
+        def wait(own_merges=None):
+            if throttle.wait.call_count == 2:
+                started.wait(5)
+                finish.set()
+        throttle.wait.side_effect = wait
+        counts = dict((i, (4, 71)) for i in ['index1', 'index2'])
+        scheduler = curator.OptimizeScheduler(
+            client, ['index1', 'index2'], max_num_segments=2, concurrency=2,
+            segmentcounts=counts, metadata=curator.ClusterMetadataSnapshot(client),
+            throttle=throttle)
+        self.assertTrue(scheduler.run())
+        self.assertEqual(
+            [{}, {'node1': 2, 'node2': 1}],
+            [c[1]['own_merges'] for c in throttle.wait.call_args_list])
+    def test_failure(self):
+        client = Mock()
+        client.cluster.state.return_value = open_index
+        client.indices.optimize.side_effect = fake_fail
+        scheduler = curator.OptimizeScheduler(
+            client, [named_index], max_num_segments=2,
+            segmentcounts={named_index: optimize_tuple})
+        self.assertFalse(scheduler.run())
+        self.assertFalse(scheduler.results[named_index]['success'])
+
 class TestReplicas(TestCase):
     def test_change_replicas_param_check(self):
         client = Mock()
@@ -440,3 +663,310 @@ class TestDeleteSnapshot(TestCase):
         client = Mock()
         client.snapshot.delete.side_effect = elasticsearch.RequestError
         self.assertFalse(curator.delete_snapshot(client, repository=repo_name, snapshot=snap_name))
+
+concurrent_snapshot_error = elasticsearch.TransportError(
+    503, 'ConcurrentSnapshotExecutionException[[repo_name:snap1] another snapshot is currently running cannot delete]')
+
+class TestDeleteSnapshots(TestCase):
+    def test_delete_snapshots_missing_arg_repository(self):
+        client = Mock()
+        self.assertFalse(curator.delete_snapshots(client, snapshots=['snap1']))
+    def test_delete_snapshots_missing_arg_snapshots(self):
+        client = Mock()
+        self.assertFalse(curator.delete_snapshots(client, repository=repo_name))
+    def test_delete_snapshots_positive(self):
+        client = Mock()
+        snaps = ['snap{0}'.format(i) for i in range(10)]
+        with patch.object(curator.snapshot.logger, 'info') as info:
+            self.assertTrue(curator.delete_snapshots(client, snapshots=snaps, repository=repo_name))
+        self.assertEqual(
+            snaps,
+            [c[1]['snapshot'] for c in client.snapshot.delete.call_args_list])
+        self.assertTrue('Deleted 10 of 10 snapshots in' in info.call_args[0][0])
+        self.assertTrue('snapshots/min' in info.call_args[0][0])
+    def test_delete_snapshots_retry_concurrent(self):
+        client = Mock()
+        client.snapshot.delete.side_effect = [concurrent_snapshot_error, None]
+        self.assertTrue(curator.delete_snapshots(client, snapshots=['snap1'], repository=repo_name, retry_delay=0))
+        self.assertEqual(2, client.snapshot.delete.call_count)
+    def test_delete_snapshots_retries_exhausted(self):
+        client = Mock()
+        client.snapshot.delete.side_effect = concurrent_snapshot_error
+        self.assertFalse(curator.delete_snapshots(client, snapshots=['snap1'], repository=repo_name, retries=2, retry_delay=0))
+        self.assertEqual(3, client.snapshot.delete.call_count)
+    def test_delete_snapshots_other_error(self):
+        client = Mock()
+        client.snapshot.delete.side_effect = [elasticsearch.TransportError(404, 'SnapshotMissingException'), None]
+        self.assertFalse(curator.delete_snapshots(client, snapshots=['snap1', 'snap2'], repository=repo_name, retry_delay=0))
+        self.assertEqual(2, client.snapshot.delete.call_count)
+
+def snapshot_status(state, done=2, total=4, processed=50):
+    return {'snapshots': [{
+        'snapshot': snap_name, 'repository': repo_name, 'state': state,
+        'shards_stats': {'initializing': 0, 'started': total - done,
+                         'finalizing': 0, 'done': done, 'failed': 0,
+                         'total': total},
+        'stats': {'total_size_in_bytes': 100,
+                  'processed_size_in_bytes': processed},
+    }]}
+
+def snapshot_info(state):
+    return {'snapshots': [{'snapshot': snap_name, 'state': state}]}
+
+class TestMonitorSnapshot(TestCase):
+    def test_monitor_snapshot_missing_arg_repository(self):
+        client = Mock()
+        self.assertFalse(curator.monitor_snapshot(client, snapshot=snap_name))
+    def test_monitor_snapshot_success(self):
+        client = Mock()
+        client.snapshot.status.side_effect = [
+            snapshot_status('STARTED'), snapshot_status('STARTED', done=3, processed=75),
+            snapshot_status('SUCCESS', done=4, processed=100),
+        ]
+        client.snapshot.get.return_value = snapshot_info('SUCCESS')
+        self.assertTrue(curator.monitor_snapshot(client, repository=repo_name, snapshot=snap_name, poll_interval=0))
+        self.assertEqual(3, client.snapshot.status.call_count)
+    def test_monitor_snapshot_partial(self):
+        client = Mock()
+        client.snapshot.status.return_value = snapshot_status('SUCCESS')
+        client.snapshot.get.return_value = snapshot_info('PARTIAL')
+        self.assertFalse(curator.monitor_snapshot(client, repository=repo_name, snapshot=snap_name, poll_interval=0))
+        self.assertTrue(curator.monitor_snapshot(client, repository=repo_name, snapshot=snap_name, poll_interval=0, partial=True))
+    def test_monitor_snapshot_failed(self):
+        client = Mock()
+        client.snapshot.status.return_value = snapshot_status('FAILED')
+        client.snapshot.get.return_value = snapshot_info('FAILED')
+        self.assertFalse(curator.monitor_snapshot(client, repository=repo_name, snapshot=snap_name, poll_interval=0))
+    def test_monitor_snapshot_timeout(self):
+        client = Mock()
+        client.snapshot.status.return_value = snapshot_status('STARTED')
+        self.assertFalse(curator.monitor_snapshot(client, repository=repo_name, snapshot=snap_name, poll_interval=0, timeout=0))
+        self.assertFalse(client.snapshot.get.called)
+    def test_monitor_snapshot_status_error(self):
+        client = Mock()
+        client.snapshot.status.side_effect = elasticsearch.TransportError(500, 'Simulated Failure')
+        self.assertFalse(curator.monitor_snapshot(client, repository=repo_name, snapshot=snap_name, poll_interval=0))
+    def test_create_snapshot_monitor(self):
+        client = Mock()
+        client.info.return_value = {'version': {'number': '1.4.4'} }
+        client.cluster.state.return_value = open_indices
+        client.snapshot.get.side_effect = [snapshots, snapshot_info('SUCCESS')]
+        client.snapshot.verify_repository.return_value = verified_nodes
+        client.snapshot.status.return_value = snapshot_status('SUCCESS')
+        with patch.object(time, 'sleep'):
+            self.assertTrue(curator.create_snapshot(client, indices=named_indices, repository=repo_name, name='not_snap_name', monitor=True))
+        self.assertFalse(client.snapshot.create.call_args[1]['wait_for_completion'])
+    def test_create_snapshot_records_duration(self):
+        client = Mock()
+        client.info.return_value = {'version': {'number': '1.4.4'} }
+        client.cluster.state.return_value = open_indices
+        client.snapshot.get.side_effect = [snapshots, snapshot_info('FAILED')]
+        client.snapshot.verify_repository.return_value = verified_nodes
+        client.snapshot.status.return_value = snapshot_status('FAILED')
+        metrics = curator.RunMetrics()
+        with patch.object(curator.snapshot, 'get_run_metrics', return_value=metrics):
+            with patch.object(time, 'sleep'):
+                self.assertFalse(curator.create_snapshot(client, indices=named_indices, repository=repo_name, name='not_snap_name', monitor=True))
+        self.assertTrue('curator_snapshot_duration_seconds_count{repository="repo_name",result="failure"} 1\n' in metrics.render())
+
+fingerprint_state = {'metadata': {'indices': {
+    'index1': {'state': 'open', 'settings': {'index.uuid': 'uuid1'}},
+    'index2': {'state': 'open', 'settings': {'index.uuid': 'uuid2'}},
+}}}
+fingerprint_sizes = 'index1 10 1024\nindex2 20 2048\n'
+fingerprint_catalogue = {'snapshots': [
+    {'snapshot': 'snap1', 'state': 'SUCCESS', 'start_time_in_millis': 1000},
+    {'snapshot': 'snap2', 'state': 'SUCCESS', 'start_time_in_millis': 2000},
+    {'snapshot': 'snap3', 'state': 'FAILED', 'start_time_in_millis': 3000},
+]}
+
+class TestPlanSnapshot(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.manifest = curator.SnapshotManifest(self.path, repo_name)
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    def client(self):
+        client = Mock()
+        client.cluster.state.return_value = fingerprint_state
+        client.cat.indices.return_value = fingerprint_sizes
+        client.snapshot.get.return_value = fingerprint_catalogue
+        return client
+    def test_plan_snapshot_unchanged(self):
+        self.manifest.record('snap2', {'index1': 'uuid1:10:1024', 'index2': 'uuid2:19:2000'})
+        self.assertEqual(['index2'], curator.plan_snapshot(self.client(), named_indices, repo_name, self.manifest))
+    def test_plan_snapshot_last(self):
+        self.manifest.record('snap1', {'index1': 'uuid1:10:1024'})
+        self.assertEqual(named_indices, curator.plan_snapshot(self.client(), named_indices, repo_name, self.manifest, last=1))
+        self.assertEqual(['index2'], curator.plan_snapshot(self.client(), named_indices, repo_name, self.manifest, last=2))
+    def test_plan_snapshot_ignores_failed(self):
+        self.manifest.record('snap3', {'index1': 'uuid1:10:1024'})
+        self.assertEqual(named_indices, curator.plan_snapshot(self.client(), named_indices, repo_name, self.manifest, last=3))
+    def test_plan_snapshot_prunes_deleted(self):
+        self.manifest.record('gone', {'index1': 'uuid1:10:1024'})
+        curator.plan_snapshot(self.client(), named_indices, repo_name, self.manifest)
+        self.assertEqual({}, curator.SnapshotManifest(self.path, repo_name).fingerprints('gone'))
+    def test_manifest_per_cluster(self):
+        for cluster in ('test-es1_9200', 'test-es2_9200'):
+            curator.SnapshotManifest(self.path, repo_name, cluster=cluster).record('snap1', {'index1': cluster})
+        self.assertEqual(
+            {'index1': 'test-es1_9200'},
+            curator.SnapshotManifest(self.path, repo_name, cluster='test-es1_9200').fingerprints('snap1'))
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'test-es2_9200-repo_name.snapshots.json')))
+    def test_create_snapshot_records_manifest(self):
+        client = self.client()
+        client.info.return_value = {'version': {'number': '1.4.4'} }
+        client.snapshot.get.side_effect = [fingerprint_catalogue, {}]
+        client.snapshot.verify_repository.return_value = verified_nodes
+        self.manifest.record('snap2', {'index1': 'uuid1:10:1024'})
+        self.assertTrue(curator.create_snapshot(client, indices=named_indices, repository=repo_name, name='snap4', manifest=self.manifest, skip_unchanged=1))
+        self.assertEqual('index2', client.snapshot.create.call_args[1]['body']['indices'])
+        self.assertEqual(
+            {'index2': 'uuid2:20:2048'},
+            curator.SnapshotManifest(self.path, repo_name).fingerprints('snap4'))
+    def test_create_snapshot_nothing_changed(self):
+        client = self.client()
+        self.manifest.record('snap2', {'index1': 'uuid1:10:1024', 'index2': 'uuid2:20:2048'})
+        self.assertTrue(curator.create_snapshot(client, indices=named_indices, repository=repo_name, name='snap4', manifest=self.manifest, skip_unchanged=1))
+        self.assertFalse(client.snapshot.create.called)
+
+def multi_snapshot_client():
+    client = Mock()
+    client.info.return_value = {'version': {'number': '1.4.4'} }
+    client.cluster.state.return_value = open_indices
+    client.snapshot.get.return_value = {}
+    client.snapshot.verify_repository.return_value = verified_nodes
+    return client
+
+class TestCreateSnapshots(TestCase):
+    def test_create_snapshots_missing_arg_repositories(self):
+        client = Mock()
+        self.assertFalse(curator.create_snapshots(client, indices=named_indices))
+    def test_create_snapshots_same_name(self):
+        client = multi_snapshot_client()
+        self.assertTrue(curator.create_snapshots(client, indices=named_indices, repositories=('fs', 's3'), concurrency=2))
+        calls = sorted((c[1]['repository'], c[1]['snapshot']) for c in client.snapshot.create.call_args_list)
+        self.assertEqual(['fs', 's3'], [c[0] for c in calls])
+        self.assertEqual(calls[0][1], calls[1][1])
+    def test_create_snapshots_queued(self):
+        client = multi_snapshot_client()
+        client.snapshot.create.side_effect = [None, concurrent_snapshot_error, None]
+        with patch.object(time, 'sleep'):
+            self.assertTrue(curator.create_snapshots(client, indices=named_indices, repositories=['fs', 's3']))
+        self.assertEqual(3, client.snapshot.create.call_count)
+    def test_create_snapshots_one_fails(self):
+        client = multi_snapshot_client()
+        client.snapshot.create.side_effect = [None, elasticsearch.TransportError(500, 'Simulated Failure')]
+        self.assertFalse(curator.create_snapshots(client, indices=named_indices, repositories=['fs', 's3']))
+    def test_create_snapshots_exception(self):
+        client = multi_snapshot_client()
+        client.snapshot.create.side_effect = [None, fake_fail]
+        self.assertFalse(curator.create_snapshots(client, indices=named_indices, repositories=['fs', 's3']))
+        self.assertEqual(2, client.snapshot.create.call_count)
+    def test_create_snapshot_not_queued(self):
+        client = multi_snapshot_client()
+        client.snapshot.create.side_effect = concurrent_snapshot_error
+        self.assertFalse(curator.create_snapshot(client, indices=named_indices, repository='fs'))
+        self.assertEqual(1, client.snapshot.create.call_count)
+    def test_create_snapshot_queue_timeout(self):
+        client = multi_snapshot_client()
+        client.snapshot.create.side_effect = concurrent_snapshot_error
+        with patch.object(time, 'sleep'):
+            self.assertFalse(curator.create_snapshot(client, indices=named_indices, repository='fs', queue=True, request_timeout=0))
+        self.assertEqual(1, client.snapshot.create.call_count)
+
+restore_snapshot_info = {'snapshots': [
+    {'snapshot': 'snap1', 'state': 'SUCCESS', 'start_time_in_millis': 2000,
+     'indices': ['index1', 'index2', 'other']},
+]}
+restore_state = {'metadata': {'indices': {
+    'restored_index1': {'settings': {'index.number_of_replicas': '1'}},
+    'restored_index2': {'settings': {'index': {'number_of_replicas': '2'}}},
+}}}
+restore_done = {'restored_index1': {'shards': [
+    {'stage': 'DONE', 'index': {'size': {'total_in_bytes': 100, 'recovered_in_bytes': 100}}},
+]}}
+
+def restore_client():
+    client = Mock()
+    client.info.return_value = {'version': {'number': '1.4.4'} }
+    client.snapshot.get.return_value = restore_snapshot_info
+    client.cluster.state.return_value = restore_state
+    client.cluster.get_settings.return_value = {
+        'persistent': {'indices.recovery.max_bytes_per_sec': '40mb'},
+        'transient': {},
+    }
+    client.indices.recovery.return_value = restore_done
+    return client
+
+class TestRestore(TestCase):
+    def test_restored_index_names(self):
+        self.assertEqual(
+            ['restored_index1', 'restored_index2'],
+            curator.restored_index_names(
+                ['other', 'index2', 'index1'], indices=['index*'],
+                rename_pattern='(.+)', rename_replacement='restored_$1')
+        )
+    def test_restored_index_names_unchanged(self):
+        self.assertEqual(['index1', 'index2'], curator.restored_index_names(['index2', 'index1']))
+    def test_set_recovery_settings(self):
+        client = restore_client()
+        previous = curator.set_recovery_settings(client, max_bytes_per_sec='100mb', concurrent_recoveries=4)
+        self.assertEqual('40mb', previous['indices.recovery.max_bytes_per_sec'])
+        self.assertEqual(2, previous['cluster.routing.allocation.node_concurrent_recoveries'])
+        self.assertEqual('100mb', client.cluster.put_settings.call_args[1]['body']['transient']['indices.recovery.max_bytes_per_sec'])
+    def test_set_recovery_settings_none(self):
+        client = Mock()
+        self.assertEqual({}, curator.set_recovery_settings(client))
+        self.assertFalse(client.cluster.put_settings.called)
+    def test_get_latest_snapshot(self):
+        client = Mock()
+        client.snapshot.get.return_value = {'snapshots': [
+            {'snapshot': 'snap1', 'start_time_in_millis': 3000},
+            {'snapshot': 'snap2', 'start_time_in_millis': 1000},
+        ]}
+        self.assertEqual('snap1', curator.get_latest_snapshot(client, 'repo', ['snap1', 'snap2']))
+    def test_get_recovery_progress(self):
+        client = Mock()
+        client.indices.recovery.return_value = {'index1': {'shards': [
+            {'stage': 'DONE', 'index': {'size': {'total_in_bytes': 100, 'recovered_in_bytes': 100}}},
+            {'stage': 'INDEX', 'index': {'bytes': {'total': 50, 'recovered': 10}}},
+        ]}}
+        self.assertEqual(
+            {'shards': 2, 'done': 1, 'total_bytes': 150, 'recovered_bytes': 110},
+            curator.get_recovery_progress(client, ['index1'])
+        )
+    def test_restore_snapshot_missing_arg_repository(self):
+        client = Mock()
+        self.assertFalse(curator.restore_snapshot(client, snapshot='snap1'))
+    def test_restore_snapshot_nothing_to_restore(self):
+        client = restore_client()
+        self.assertFalse(curator.restore_snapshot(client, snapshot='snap1', repository='repo', indices=['nomatch*']))
+        self.assertFalse(client.snapshot.restore.called)
+    def test_restore_snapshot(self):
+        client = restore_client()
+        with patch.object(time, 'sleep'):
+            self.assertTrue(curator.restore_snapshot(
+                client, snapshot='snap1', repository='repo', indices=['index*'],
+                rename_pattern='(.+)', rename_replacement='restored_$1',
+                max_bytes_per_sec='100mb'))
+        self.assertEqual(
+            [call(index='restored_index1,restored_index2', body='number_of_replicas=0'),
+             call(index='restored_index1', body='number_of_replicas=1'),
+             call(index='restored_index2', body='number_of_replicas=2')],
+            client.indices.put_settings.call_args_list
+        )
+        self.assertEqual(
+            call(body={'transient': {'indices.recovery.max_bytes_per_sec': '40mb'}}),
+            client.cluster.put_settings.call_args
+        )
+    def test_restore_snapshot_keep_replicas(self):
+        client = restore_client()
+        with patch.object(time, 'sleep'):
+            self.assertTrue(curator.restore_snapshot(client, snapshot='snap1', repository='repo', indices=['index1'], no_replicas=False))
+        self.assertFalse(client.indices.put_settings.called)
+    def test_restore_snapshot_exception(self):
+        client = restore_client()
+        client.snapshot.restore.side_effect = elasticsearch.TransportError(500, 'Simulated Failure')
+        self.assertFalse(curator.restore_snapshot(client, snapshot='snap1', repository='repo', max_bytes_per_sec='100mb'))
+        self.assertEqual(2, client.cluster.put_settings.call_count)
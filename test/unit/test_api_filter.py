@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 from unittest import TestCase
-from mock import Mock
+from mock import Mock, patch
 
 from curator import api as curator
 
@@ -13,9 +13,7 @@ open_indices   = { 'metadata': { 'indices' : { 'index1' : { 'state' : 'open' },
 closed_indices = { 'metadata': { 'indices' : { 'index1' : { 'state' : 'close' },
                                                'index2' : { 'state' : 'close' }}}}
 fake_fail      = Exception('Simulated Failure')
-indices_space  = { 'indices' : {
-        'index1' : { 'index' : { 'primary_size_in_bytes': 1083741824 }},
-        'index2' : { 'index' : { 'primary_size_in_bytes': 1083741824 }}}}
+indices_space  = 'index1 1083741824 \nindex2 1083741824 \n'
 re_test_indices = [
     "logstash-2014.12.31", "logstash-2014.12.30", "logstash-2014.12.29",
     ".marvel-2015.12.31", ".marvel-2015.12.30", ".marvel-2015.12.29",
@@ -45,23 +43,40 @@ class FilterBySpace(TestCase):
         ds = 10.0
         client.cluster.state.return_value = open_indices
         # Build return value of over 1G in size for each index
-        client.indices.status.return_value = indices_space
+        client.cat.indices.return_value = indices_space
         self.assertEqual([], curator.filter_by_space(client, named_indices, disk_space=ds))
     def test_filter_by_space_one_deletion(self):
         client = Mock()
         ds = 2.0
         client.cluster.state.return_value = open_indices
         # Build return value of over 1G in size for each index
-        client.indices.status.return_value = indices_space
+        client.cat.indices.return_value = indices_space
         self.assertEqual(["index1"], curator.filter_by_space(client, named_indices, disk_space=ds))
     def test_filter_by_space_one_deletion_no_reverse(self):
         client = Mock()
         ds = 2.0
         client.cluster.state.return_value = open_indices
         # Build return value of over 1G in size for each index
-        client.indices.status.return_value = indices_space
+        client.cat.indices.return_value = indices_space
         self.assertEqual(["index2"], curator.filter_by_space(client, named_indices, disk_space=ds, reverse=False))
 
+    def test_filter_by_space_metadata(self):
+        client = Mock()
+        ds = 2.0
+        client.cluster.state.return_value = open_indices
+        metadata = curator.ClusterMetadataSnapshot(client)
+        client.cat.indices.return_value = indices_space
+        self.assertEqual(["index1"], curator.filter_by_space(client, named_indices, disk_space=ds, metadata=metadata))
+        self.assertEqual(1, client.cluster.state.call_count)
+    def test_filter_by_space_include_replicas(self):
+        client = Mock()
+        ds = 4.0
+        client.cluster.state.return_value = open_indices
+        client.cat.indices.return_value = 'index1 2167483648\nindex2 2167483648\n'
+        self.assertEqual(["index1"], curator.filter_by_space(client, named_indices, disk_space=ds, include_replicas=True))
+        client.cat.indices.assert_called_once_with(
+            index='index1,index2', bytes='b', h='index,store.size')
+
 class TestRegexIterate(TestCase):
     def test_regex_iterate_missing_param_pattern(self):
         self.assertFalse(curator.regex_iterate(re_test_indices))
@@ -160,6 +175,38 @@ class TestRegexIterate(TestCase):
             pattern=pattern, exclude=True)
         )
 
+class TestFilterPipeline(TestCase):
+    def test_filter_pipeline_empty(self):
+        self.assertEqual(re_test_indices, curator.FilterPipeline([]).apply(re_test_indices))
+    def test_filter_pipeline_same_as_regex_iterate(self):
+        t = datetime(2015, 2, 1, 2, 34, 56)
+        filters = [
+            { 'pattern': r'^logstash-.*$' },
+            { 'pattern': r'(?P<date>\d{4}.\d{2}.\d{2})', 'groupname': 'date',
+              'timestring': '%Y.%m.%d', 'time_unit': 'days',
+              'method': 'older_than', 'value': 2 },
+            { 'pattern': r'12\.29', 'exclude': True },
+            ]
+        expected = re_test_indices
+        for f in filters:
+            expected = curator.regex_iterate(expected, utc_now=t, **f)
+        self.assertEqual(
+            ['logstash-2014.12.31', 'logstash-2014.12.30'], expected)
+        self.assertEqual(
+            expected, curator.FilterPipeline(filters, utc_now=t).apply(re_test_indices))
+    def test_filter_pipeline_cutoff_calculated_once(self):
+        t = datetime(2015, 2, 1, 2, 34, 56)
+        filters = [
+            { 'pattern': r'(?P<date>\d{4}.\d{2}.\d{2})', 'groupname': 'date',
+              'timestring': '%Y.%m.%d', 'time_unit': 'days',
+              'method': 'older_than', 'value': 2 },
+            ]
+        with patch('curator.api.filter.get_cutoff', wraps=curator.get_cutoff) as cutoff:
+            curator.FilterPipeline(filters, utc_now=t).apply(re_test_indices)
+            self.assertEqual(1, cutoff.call_count)
+    def test_filter_pipeline_missing_pattern(self):
+        self.assertEqual([], curator.FilterPipeline([{}]).apply(re_test_indices))
+
 class TestGetDateRegex(TestCase):
     def test_get_date_regex_arbitrary(self):
         self.assertEqual('\\a\\a\\a\\a', curator.get_date_regex('aaaa'))
@@ -192,6 +239,45 @@ class TestGetIndexTime(TestCase):
         weeknow  = utc_now.strftime('%Y-%m-%d')
         self.assertEqual(expected, curator.get_datetime(weeknow, '%Y-%m-%d'))
 
+class TestTimestringParser(TestCase):
+    def test_parser_matches_strptime(self):
+        for timestring, compensate in [
+            ('%Y.%m.%d', ''), ('%Y.%m.%d.%H', ''), ('%y-%m-%d', ''),
+            ('%Y%m%d%H%M%S', ''), ('%Y.%m', '%d'), ('%Y.%W', '%w'),
+            ('%Y-%U', '%w'),
+                ]:
+            parser = curator.TimestringParser(timestring)
+            d = datetime(2012, 12, 25, 7, 8, 9)
+            for i in range(0, 800):
+                timestamp = d.strftime(timestring)
+                expected = datetime.strptime(
+                    timestamp + ('1' if compensate else ''),
+                    timestring + compensate)
+                self.assertEqual(expected, parser.parse(timestamp))
+                d += timedelta(days=1, hours=1)
+    def test_parser_week_zero(self):
+        parser = curator.TimestringParser('%Y.%W')
+        self.assertEqual(datetime(2012, 12, 31), parser.parse('2013.00'))
+    def test_parser_invalid_timestamp(self):
+        parser = curator.TimestringParser('%Y.%m.%d')
+        self.assertRaises(ValueError, parser.parse, '2015.13.01')
+        self.assertRaises(ValueError, parser.parse, '2015.02.30')
+        self.assertRaises(ValueError, parser.parse, 'foo')
+    def test_parser_unsupported_directive(self):
+        parser = curator.TimestringParser('%Y.%j')
+        self.assertIsNone(parser.regex)
+        self.assertEqual(datetime(2015, 2, 1), parser.parse('2015.032'))
+    def test_parser_cache_is_bounded(self):
+        parser = curator.TimestringParser('%Y.%m.%d', cache_size=2)
+        for timestamp in ['2015.01.01', '2015.01.02', '2015.01.01', '2015.01.03']:
+            parser.parse(timestamp)
+        self.assertEqual(['2015.01.01', '2015.01.03'], list(parser.cache))
+    def test_get_timestring_parser_reused(self):
+        self.assertTrue(
+            curator.get_timestring_parser('%Y.%m.%d') is
+            curator.get_timestring_parser('%Y.%m.%d')
+        )
+
 class TestGetTargetMonth(TestCase):
     def test_get_target_month_same_year(self):
         before = datetime(2015, 2, 1, 2, 34, 56)
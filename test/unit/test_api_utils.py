@@ -1,7 +1,14 @@
 from datetime import datetime, timedelta
 from unittest import TestCase
-from mock import Mock
+from mock import Mock, patch
+import sys
+import threading
 import elasticsearch
+import shutil
+import tempfile
+import time
+import os
+import json
 
 from curator import api as curator
 
@@ -17,6 +24,13 @@ repo_name      = 'repo_name'
 test_repo      = {repo_name: {'type': 'fs', 'settings': {'compress': 'true', 'location': '/tmp/repos/repo_name'}}}
 test_repos     = {'TESTING': {'type': 'fs', 'settings': {'compress': 'true', 'location': '/tmp/repos/TESTING'}},
                   repo_name: {'type': 'fs', 'settings': {'compress': 'true', 'location': '/rmp/repos/repo_name'}}}
+cluster_state  = { 'metadata': { 'indices': {
+        'index1': { 'state': 'open', 'aliases': [ named_alias ],
+            'settings': { 'index': { 'creation_date': '1420070400000',
+                'routing': { 'allocation': { 'require': { 'tag': 'ssd' }}}}}},
+        'index2': { 'state': 'close', 'aliases': [],
+            'settings': { 'index.routing.allocation.require.tag': 'hdd' }},
+        }}}
 snap_name      = 'snap_name'
 snapshot       = { 'snapshots': [
                     {
@@ -69,6 +83,111 @@ class TestGetAlias(TestCase):
         client.indices.exists_alias.return_value = False
         self.assertFalse(curator.get_alias(client, named_alias))
 
+    def test_get_alias_metadata_positive(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertEqual(['index1'], curator.get_alias(client, named_alias, metadata=metadata))
+        self.assertFalse(client.indices.exists_alias.called)
+    def test_get_alias_metadata_negative(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertFalse(curator.get_alias(client, 'foo', metadata=metadata))
+
+class TestClusterMetadataSnapshot(TestCase):
+    def test_single_request(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertEqual(named_indices, metadata.indices())
+        self.assertFalse(metadata.is_closed('index1'))
+        self.assertTrue(metadata.is_closed('index2'))
+        self.assertEqual(1, client.cluster.state.call_count)
+    def test_limited_to_indices(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        curator.ClusterMetadataSnapshot(client, indices=named_indices)
+        client.cluster.state.assert_called_once_with(
+            index='index1,index2', metric='metadata')
+    def test_get_setting_nested_and_flat(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        key = 'index.routing.allocation.require.tag'
+        self.assertEqual('ssd', metadata.get_setting('index1', key))
+        self.assertEqual('hdd', metadata.get_setting('index2', key))
+        self.assertIsNone(metadata.get_setting('index1', 'index.foo'))
+    def test_aliases(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertEqual([named_alias], metadata.aliases('index1'))
+        self.assertEqual(['index1'], metadata.alias_indices(named_alias))
+    def test_creation_date(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertEqual(datetime(2015, 1, 1), metadata.creation_date('index1'))
+        self.assertIsNone(metadata.creation_date('index2'))
+    def test_get_metadata_negative(self):
+        client = Mock()
+        client.cluster.state.side_effect = fake_fail
+        self.assertFalse(curator.get_metadata(client))
+    def test_get_indices_from_metadata(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertEqual(named_indices, curator.get_indices(client, metadata=metadata))
+        self.assertFalse(client.indices.get_settings.called)
+
+class TestPruneWithMetadata(TestCase):
+    def test_prune_closed_one_request(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        self.assertEqual(['index1'], curator.prune_closed(client, named_indices))
+        self.assertEqual(1, client.cluster.state.call_count)
+    def test_prune_closed_metadata(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertEqual(['index1'], curator.prune_closed(client, named_indices, metadata=metadata))
+        self.assertEqual(1, client.cluster.state.call_count)
+    def test_index_closed_metadata(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertTrue(curator.index_closed(client, 'index2', metadata=metadata))
+        self.assertEqual(1, client.cluster.state.call_count)
+    def test_prune_allocated_metadata(self):
+        client = Mock()
+        client.cluster.state.return_value = cluster_state
+        metadata = curator.ClusterMetadataSnapshot(client)
+        self.assertEqual(['index2'], curator.prune_allocated(
+            client, named_indices, 'tag', 'ssd', metadata=metadata))
+        self.assertFalse(client.indices.get_settings.called)
+    def test_prune_closed_chunks_long_lists(self):
+        indices = ['index-{0:05d}'.format(i) for i in range(0, 1000)]
+        client = Mock()
+        client.cluster.state.side_effect = lambda metric, index: {'metadata': {'indices': dict(
+            (i, {'state': 'close' if i == 'index-00500' else 'open'}) for i in index.split(','))}}
+        pruned = curator.prune_closed(client, indices)
+        self.assertTrue(client.cluster.state.call_count > 1)
+        self.assertEqual(999, len(pruned))
+        self.assertFalse('index-00500' in pruned)
+        for c in client.cluster.state.call_args_list:
+            self.assertTrue(len(c[1]['index']) <= curator.DEFAULT_MAX_INITIAL_LINE_LENGTH - curator.REQUEST_LINE_OVERHEAD)
+    def test_prune_allocated_chunks_long_lists(self):
+        indices = ['index-{0:05d}'.format(i) for i in range(0, 1000)]
+        client = Mock()
+        client.indices.get_settings.side_effect = lambda index: dict(
+            (i, {'settings': {'index': {'routing': {'allocation': {'require': {'tag': 'ssd'}}}}}})
+            for i in index.split(',') if i == 'index-00001')
+        pruned = curator.prune_allocated(client, indices, 'tag', 'ssd')
+        self.assertTrue(client.indices.get_settings.call_count > 1)
+        self.assertEqual(999, len(pruned))
+        self.assertFalse('index-00001' in pruned)
+
 class TestEnsureList(TestCase):
     def test_ensure_list_returns_lists(self):
         l = ["a", "b", "c", "d"]
@@ -143,6 +262,46 @@ class TestPruneKibana(TestCase):
         r = []
         self.assertEqual(r, curator.prune_kibana(l))
 
+class TestGetIndexSizes(TestCase):
+    def test_primaries(self):
+        client = Mock()
+        client.cat.indices.return_value = 'index1 1024 \nindex2 2048 \n'
+        self.assertEqual(
+            {'index1': 1024, 'index2': 2048},
+            curator.get_index_sizes(client, named_indices)
+        )
+        client.cat.indices.assert_called_once_with(
+            index='index1,index2', bytes='b', h='index,pri.store.size')
+    def test_chunked(self):
+        client = Mock()
+        client.cat.indices.side_effect = ['index1 1\n', 'index2 2\n']
+        self.assertEqual(
+            {'index1': 1, 'index2': 2},
+            curator.get_index_sizes(client, named_indices, max_length=8)
+        )
+        self.assertEqual(2, client.cat.indices.call_count)
+    def test_missing_size(self):
+        client = Mock()
+        client.cat.indices.return_value = 'index1 \nindex2 2048\n'
+        self.assertEqual(
+            {'index1': 0, 'index2': 2048},
+            curator.get_index_sizes(client, named_indices)
+        )
+
+class TestGetIndexFingerprints(TestCase):
+    def test_fingerprints(self):
+        client = Mock()
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'index1': {'settings': {'index': {'uuid': 'abc'}}},
+            'index2': {'settings': {'index.uuid': 'def'}},
+            'index3': {'settings': {}},
+        }}}
+        client.cat.indices.return_value = 'index1 10 1024\nindex2 20 2048\nindex3 30 3072\nindex4 \n'
+        self.assertEqual(
+            {'index1': 'abc:10:1024', 'index2': 'def:20:2048'},
+            curator.get_index_fingerprints(client, ['index1', 'index2', 'index3', 'index4'])
+        )
+
 class TestGetVersion(TestCase):
     def test_positive(self):
         client = Mock()
@@ -264,6 +423,40 @@ class TestGetSnapshots(TestCase):
         client.snapshot.get.side_effect = elasticsearch.NotFoundError
         self.assertFalse(curator.get_snapshots(client, repository=repo_name))
 
+class TestSnapshotCatalogue(TestCase):
+    def test_get_snapshots_filtered(self):
+        client = Mock()
+        client.snapshot.get.return_value = snapshots
+        curator.get_snapshots(client, repository=repo_name)
+        client.snapshot.get.assert_called_once_with(
+            repository=repo_name, snapshot='_all',
+            filter_path='snapshots.snapshot')
+    def test_get_snapshots_empty_filtered(self):
+        client = Mock()
+        client.snapshot.get.return_value = {}
+        self.assertEqual([], curator.get_snapshots(client, repository=repo_name))
+    def test_catalogue(self):
+        client = Mock()
+        client.snapshot.get.return_value = snapshots
+        self.assertEqual(
+            [{'snapshot': snap_name, 'state': 'SUCCESS', 'start_time_in_millis': 0},
+             {'snapshot': 'snapshot2', 'state': 'SUCCESS', 'start_time_in_millis': 0}],
+            list(curator.get_snapshot_catalogue(client, repo_name)))
+        client.snapshot.get.assert_called_once_with(
+            repository=repo_name, snapshot='_all',
+            filter_path='snapshots.snapshot,snapshots.start_time_in_millis,snapshots.state')
+    def test_snapshot_exists(self):
+        client = Mock()
+        client.snapshot.get.return_value = {'snapshots': [{'snapshot': snap_name}]}
+        self.assertTrue(curator.snapshot_exists(client, repo_name, snap_name))
+        client.snapshot.get.assert_called_once_with(
+            repository=repo_name, snapshot=snap_name,
+            filter_path='snapshots.snapshot')
+    def test_snapshot_exists_missing(self):
+        client = Mock()
+        client.snapshot.get.side_effect = elasticsearch.NotFoundError
+        self.assertFalse(curator.snapshot_exists(client, repo_name, snap_name))
+
 class TestCreateSnapshotBody(TestCase):
     def test_create_snapshot_body_empty_arg(self):
         self.assertFalse(curator.create_snapshot_body([]))
@@ -271,3 +464,435 @@ class TestCreateSnapshotBody(TestCase):
         self.assertEqual(snap_body_all, curator.create_snapshot_body('_all'))
     def test_create_snapshot_body_positive(self):
         self.assertEqual(snap_body, curator.create_snapshot_body(named_indices))
+
+def node_stats(merges=0, heap=50, available=50, rejected=0):
+    return { 'nodes': {
+        'node1': {
+            'indices': { 'merges': { 'current': merges }},
+            'jvm': { 'mem': { 'heap_used_percent': heap }},
+            'fs': { 'total': { 'total_in_bytes': 100, 'available_in_bytes': available }},
+            'thread_pool': { 'search': { 'rejected': rejected },
+                             'index': { 'rejected': 0 },
+                             'bulk': { 'rejected': 0 }},
+        },
+        'node2': {
+            'indices': { 'merges': { 'current': 0 }},
+            'jvm': { 'mem': { 'heap_used_percent': 10 }},
+            'fs': { 'total': { 'total_in_bytes': 100, 'available_in_bytes': 90 }},
+            'thread_pool': { 'search': { 'rejected': 1 }},
+        },
+    }}
+
+class TestGetNodeLoad(TestCase):
+    def test_get_node_load(self):
+        client = Mock()
+        client.nodes.stats.return_value = node_stats(merges=2, heap=70, available=25, rejected=3)
+        self.assertEqual(
+            {'merges': 2, 'node_merges': {'node1': 2, 'node2': 0},
+             'heap_percent': 70, 'disk_percent': 75.0, 'rejected': 4},
+            curator.get_node_load(client))
+    def test_get_disk_watermark(self):
+        client = Mock()
+        client.cluster.get_settings.return_value = {'persistent': {}, 'transient': {}}
+        self.assertEqual(85, curator.get_disk_watermark(client))
+        client.cluster.get_settings.return_value = {
+            'persistent': {'cluster.routing.allocation.disk.watermark.low': '70%'},
+            'transient': {'cluster.routing.allocation.disk.watermark.low': '0.9'}}
+        self.assertEqual(90, curator.get_disk_watermark(client))
+        client.cluster.get_settings.return_value = {
+            'persistent': {'cluster.routing.allocation.disk.watermark.low': '500mb'}}
+        self.assertEqual(85, curator.get_disk_watermark(client))
+
+class TestThrottle(TestCase):
+    def test_throttle_healthy(self):
+        client = Mock()
+        client.nodes.stats.return_value = node_stats()
+        throttle = curator.Throttle(client)
+        with patch('curator.api.throttle.time.sleep') as sleep:
+            throttle.wait()
+            self.assertFalse(sleep.called)
+    def test_throttle_pauses_until_healthy(self):
+        client = Mock()
+        client.nodes.stats.side_effect = [
+            node_stats(heap=90), node_stats(merges=4), node_stats()]
+        throttle = curator.Throttle(client)
+        with patch('curator.api.throttle.time.sleep') as sleep:
+            throttle.wait()
+            self.assertEqual([((1,),), ((2,),), ((1.0,),)], sleep.call_args_list)
+        self.assertEqual(1.0, throttle.delay)
+    def test_throttle_delay_returns_to_zero(self):
+        client = Mock()
+        client.nodes.stats.side_effect = [node_stats(heap=90), node_stats(), node_stats()]
+        throttle = curator.Throttle(client)
+        with patch('curator.api.throttle.time.sleep') as sleep:
+            throttle.wait()
+            self.assertEqual([((1,),)], sleep.call_args_list)
+            self.assertEqual(0, throttle.delay)
+            throttle.wait()
+            self.assertEqual(1, sleep.call_count)
+    def test_throttle_rejections(self):
+        client = Mock()
+        client.nodes.stats.side_effect = [
+            node_stats(rejected=1), node_stats(rejected=5), node_stats(rejected=5)]
+        throttle = curator.Throttle(client)
+        with patch('curator.api.throttle.time.sleep') as sleep:
+            throttle.wait()
+            throttle.wait()
+            self.assertEqual([((1,),)], sleep.call_args_list)
+    def test_throttle_max_wait(self):
+        client = Mock()
+        client.nodes.stats.return_value = node_stats(available=5)
+        throttle = curator.Throttle(client, max_delay=10, max_wait=30)
+        with patch('curator.api.throttle.time.sleep') as sleep:
+            throttle.wait()
+            self.assertEqual(30, sum(c[0][0] for c in sleep.call_args_list))
+    def test_throttle_ignores_own_merges(self):
+        client = Mock()
+        client.nodes.stats.return_value = node_stats(merges=5)
+        throttle = curator.Throttle(client)
+        with patch('curator.api.throttle.time.sleep') as sleep:
+            throttle.wait(own_merges={'node1': 5})
+            self.assertFalse(sleep.called)
+        self.assertEqual(
+            ['5 merges running'],
+            throttle.overloaded(curator.get_node_load(client), own_merges={'node1': 0}))
+    def test_overloaded_has_no_side_effects(self):
+        client = Mock()
+        throttle = curator.Throttle(client, max_disk_percent=85)
+        throttle.rejected = 1
+        load = {'merges': 0, 'heap_percent': 0, 'disk_percent': 0, 'rejected': 3}
+        self.assertEqual(['2 requests rejected'], throttle.overloaded(load))
+        self.assertEqual(['2 requests rejected'], throttle.overloaded(load))
+        self.assertEqual(1, throttle.rejected)
+    def test_throttle_reads_disk_watermark(self):
+        client = Mock()
+        client.cluster.get_settings.return_value = {
+            'transient': {'cluster.routing.allocation.disk.watermark.low': '95%'}}
+        client.nodes.stats.return_value = node_stats(available=10)
+        throttle = curator.Throttle(client)
+        with patch('curator.api.throttle.time.sleep') as sleep:
+            throttle.wait()
+            self.assertFalse(sleep.called)
+        self.assertEqual(95, throttle.max_disk_percent)
+    def test_throttle_stats_failure(self):
+        client = Mock()
+        client.nodes.stats.side_effect = fake_fail
+        throttle = curator.Throttle(client)
+        with patch('curator.api.throttle.time.sleep') as sleep:
+            throttle.wait()
+            self.assertFalse(sleep.called)
+
+cached_indices = {'index1': {'state': 'open'}, 'index2': {'state': 'close'}}
+
+def cache_client(version=1, uuid='abc'):
+    client = Mock()
+    def state(metric=None, **kwargs):
+        retval = {'cluster_name': 'test', 'version': version, 'master_node': 'node1'}
+        if 'metadata' in metric:
+            retval['metadata'] = {'cluster_uuid': uuid, 'indices': cached_indices}
+        return retval
+    client.cluster.state.side_effect = state
+    client.info.return_value = {'version': {'number': '1.4.4'}}
+    client.snapshot.get.return_value = {'snapshots': [{'snapshot': 'snap1'}]}
+    return client
+
+class TestMetadataCache(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    def metadata_calls(self, client):
+        return [c for c in client.cluster.state.call_args_list
+                if 'metadata' in c[1]['metric']]
+    def test_reused_between_runs(self):
+        client = cache_client()
+        for run in range(3):
+            cache = curator.MetadataCache(self.path)
+            metadata = curator.get_metadata(client, cache=cache)
+            self.assertEqual(['index1', 'index2'], metadata.indices())
+            self.assertTrue(metadata.is_closed('index2'))
+        self.assertEqual(1, len(self.metadata_calls(client)))
+    def test_file_per_address(self):
+        for port in (9200, 9201):
+            client = cache_client()
+            client.transport.hosts = [{'host': 'es1', 'port': port}]
+            curator.get_metadata(client, cache=curator.MetadataCache(self.path))
+        self.assertEqual(
+            ['test-es1_9200.json', 'test-es1_9201.json'],
+            sorted(os.listdir(self.path)))
+    def test_cluster_key(self):
+        client = cache_client()
+        client.transport.hosts = [{'host': 'es1', 'port': 9200}]
+        self.assertEqual('test-es1_9200', curator.MetadataCache(self.path).cluster_key(client))
+    def test_mappings_not_cached(self):
+        client = cache_client()
+        cached_indices['index1']['mappings'] = {'doc': {'properties': {}}}
+        try:
+            cache = curator.MetadataCache(self.path)
+            curator.get_metadata(client, cache=cache)
+        finally:
+            del cached_indices['index1']['mappings']
+        with open(cache.filename) as f:
+            indices = json.load(f)['entries']['metadata']['value']['metadata']['indices']
+        self.assertEqual({'state': 'open'}, indices['index1'])
+    def test_version_change(self):
+        client = cache_client()
+        curator.get_metadata(client, cache=curator.MetadataCache(self.path))
+        client = cache_client(version=2)
+        curator.get_metadata(client, cache=curator.MetadataCache(self.path))
+        self.assertEqual(1, len(self.metadata_calls(client)))
+    def test_uuid_change(self):
+        client = cache_client()
+        curator.get_version(client, cache=curator.MetadataCache(self.path))
+        curator.get_metadata(client, cache=curator.MetadataCache(self.path))
+        cache = curator.MetadataCache(self.path, ttl=-1)
+        client = cache_client(uuid='def')
+        curator.get_metadata(client, cache=cache)
+        self.assertEqual({}, dict(
+            (k, v) for k, v in cache.data['entries'].items() if k != 'metadata'))
+    def test_ttl(self):
+        client = cache_client()
+        curator.get_metadata(client, cache=curator.MetadataCache(self.path))
+        curator.get_metadata(client, cache=curator.MetadataCache(self.path, ttl=-1))
+        self.assertEqual(2, len(self.metadata_calls(client)))
+    def test_invalidate(self):
+        client = cache_client()
+        cache = curator.MetadataCache(self.path)
+        curator.get_metadata(client, cache=cache)
+        cache.invalidate()
+        curator.get_metadata(client, cache=curator.MetadataCache(self.path))
+        self.assertEqual(2, len(self.metadata_calls(client)))
+    def test_version_and_snapshots(self):
+        client = cache_client()
+        for run in range(2):
+            cache = curator.MetadataCache(self.path)
+            self.assertEqual((1, 4, 4), curator.get_version(client, cache=cache))
+            self.assertEqual(
+                ['snap1'],
+                curator.get_snapshots(client, repository='repo', cache=cache))
+        self.assertEqual(1, client.info.call_count)
+        self.assertEqual(1, client.snapshot.get.call_count)
+
+class TestParallelMap(TestCase):
+    def test_parallel_map_order(self):
+        self.assertEqual(
+            [2, 4, 6, 8],
+            curator.parallel_map(lambda x: x * 2, iter([1, 2, 3, 4]), concurrency=3)
+        )
+    def test_parallel_map_exception(self):
+        def func(x):
+            if x == 2:
+                raise fake_fail
+            return True
+        self.assertEqual([True, False, True], curator.parallel_map(func, [1, 2, 3], concurrency=2))
+    def test_parallel_map_empty(self):
+        self.assertEqual([], curator.parallel_map(lambda x: x, []))
+
+class TestActionPool(TestCase):
+    def test_map(self):
+        client = Mock()
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'index1': {'state': 'close'}, 'index2': {'state': 'open'}}}}
+        with curator.ActionPool(client, concurrency=4) as pool:
+            pending = pool.map(curator.index_closed, named_indices)
+            self.assertEqual([True, False], [p.result() for p in pending])
+    def test_submit_passes_client(self):
+        client = Mock()
+        pool = curator.ActionPool(client, concurrency=2)
+        action = pool.submit(lambda c, x, y=0: (c, x, y), 1, y=2)
+        self.assertEqual((client, 1, 2), action.result())
+        self.assertTrue(action.done())
+        self.assertTrue(pool.close())
+        self.assertEqual([], pool.workers)
+    def test_exception(self):
+        pool = curator.ActionPool(Mock())
+        def fail(client):
+            raise fake_fail
+        action = pool.submit(fail)
+        self.assertFalse(pool.wait())
+        self.assertRaises(Exception, action.result)
+        pool.close()
+
+class TestGetPooledClient(TestCase):
+    def test_get_pooled_client(self):
+        with patch.object(elasticsearch, 'Elasticsearch') as es:
+            curator.get_pooled_client(concurrency=50, hosts=['localhost'])
+            es.assert_called_with(hosts=['localhost'], maxsize=50)
+
+class TestRequestStats(TestCase):
+    def test_record_by_phase(self):
+        stats = curator.RequestStats()
+        curator.set_request_phase('select', action='delete')
+        stats.record('cluster.state', 'get_metadata', 0.02, bytes_in=100)
+        curator.set_request_phase('act')
+        stats.record('indices.delete', 'delete_indices', 0.3, bytes_in=20)
+        stats.record('indices.delete', 'delete_indices', 20, error=True)
+        endpoints = stats.to_dict()['endpoints']
+        self.assertEqual(
+            [('delete', 'select', 'cluster.state', 1),
+             ('delete', 'act', 'indices.delete', 2)],
+            [(e['action'], e['phase'], e['endpoint'], e['count']) for e in endpoints]
+        )
+        self.assertEqual(1, endpoints[1]['errors'])
+        self.assertEqual(20, endpoints[1]['max_time'])
+        self.assertEqual(1, endpoints[0]['histogram'][2])
+        self.assertEqual(1, endpoints[1]['histogram'][-1])
+        self.assertEqual(
+            {'count': 3, 'errors': 1, 'time': 20.32, 'bytes_out': 0, 'bytes_in': 120},
+            stats.totals()
+        )
+    def test_report_lists_repeated_callers(self):
+        stats = curator.RequestStats()
+        curator.set_request_phase('select', action='close')
+        for i in range(0, 3):
+            stats.record('cluster.state', 'index_closed', 0.001)
+        report = stats.report()
+        self.assertTrue(report.startswith('Elasticsearch requests: 3 in'))
+        self.assertTrue('index_closed -> cluster.state: 3 calls' in report)
+    def test_instrumented_connection(self):
+        stats = curator.RequestStats()
+        client = elasticsearch.Elasticsearch(
+            connection_class=curator.InstrumentedConnection, stats=stats)
+        curator.set_request_phase('select', action='show')
+        with patch.object(elasticsearch.Urllib3HttpConnection, 'perform_request',
+                          return_value=(200, {}, '{"index1": {}}')):
+            client.indices.get_settings(index='index1')
+        self.assertEqual(
+            [{'caller': 'test_instrumented_connection', 'endpoint': 'indices.get_settings', 'count': 1}],
+            stats.to_dict()['callers']
+        )
+        self.assertEqual(14, stats.totals()['bytes_in'])
+    def test_instrumented_connection_error(self):
+        stats = curator.RequestStats()
+        client = elasticsearch.Elasticsearch(
+            connection_class=curator.InstrumentedConnection, stats=stats,
+            max_retries=0)
+        with patch.object(elasticsearch.Urllib3HttpConnection, 'perform_request',
+                          side_effect=elasticsearch.NotFoundError(404, 'IndexMissingException')):
+            self.assertRaises(elasticsearch.NotFoundError, client.indices.delete, index='index1')
+        self.assertEqual(1, stats.totals()['errors'])
+    def test_phase_by_thread(self):
+        stats = curator.RequestStats()
+        curator.set_request_phase('select', action='close')
+        def other():
+            curator.set_request_phase('act', action='delete')
+            stats.record('indices.delete', 'delete_indices', 0.01)
+        t = threading.Thread(target=other)
+        t.start()
+        t.join()
+        stats.record('cluster.state', 'get_metadata', 0.01)
+        self.assertEqual(
+            [('close', 'select', 'cluster.state'), ('delete', 'act', 'indices.delete')],
+            sorted((e['action'], e['phase'], e['endpoint']) for e in stats.to_dict()['endpoints'])
+        )
+    def test_parallel_map_workers_take_phase(self):
+        stats = curator.RequestStats()
+        curator.set_request_phase('act', action='close')
+        curator.parallel_map(
+            lambda i: stats.record('indices.close', 'close_indices', 0.01),
+            [1, 2, 3], concurrency=3)
+        self.assertEqual(
+            [('close', 'act', 'indices.close', 3)],
+            [(e['action'], e['phase'], e['endpoint'], e['count']) for e in stats.to_dict()['endpoints']]
+        )
+    def test_action_pool_workers_take_phase(self):
+        stats = curator.RequestStats()
+        curator.set_request_phase('act', action='snapshot')
+        with curator.ActionPool(Mock(), concurrency=2) as pool:
+            pool.map(lambda c, i: stats.record('snapshot.status', 'monitor_snapshot', 0.01), [1, 2, 3])
+        self.assertEqual(
+            [('snapshot', 'act', 'snapshot.status', 3)],
+            [(e['action'], e['phase'], e['endpoint'], e['count']) for e in stats.to_dict()['endpoints']]
+        )
+
+class TestRunMetrics(TestCase):
+    def test_render_action(self):
+        metrics = curator.RunMetrics()
+        metrics.inc('curator_indices_matched_total', 2, action='delete')
+        metrics.record_index_sizes({'index1': 100, 'index3': 50})
+        metrics.record_action('delete', named_indices, True, 1.5)
+        metrics.record_action('delete', named_indices, False, 0.25)
+        text = metrics.render()
+        self.assertTrue('# TYPE curator_indices_matched_total counter\n' in text)
+        self.assertTrue('curator_indices_matched_total{action="delete"} 2\n' in text)
+        self.assertTrue('curator_indices_acted_total{action="delete"} 2\n' in text)
+        self.assertTrue('curator_deleted_bytes_total 100\n' in text)
+        self.assertTrue('curator_action_duration_seconds_sum{action="delete",result="success"} 1.5\n' in text)
+        self.assertTrue('curator_action_duration_seconds_count{action="delete",result="failure"} 1\n' in text)
+        self.assertFalse('curator_snapshot_duration_seconds' in text)
+    def test_render_requests(self):
+        stats = curator.RequestStats()
+        curator.set_request_phase('act', action='close')
+        stats.record('indices.close', 'close_indices', 0.02)
+        stats.record('indices.close', 'close_indices', 3, error=True)
+        text = curator.RunMetrics().render(request_stats=stats)
+        labels = 'action="close",endpoint="indices.close",phase="act"'
+        self.assertTrue('curator_http_requests_total{' + labels + '} 2\n' in text)
+        self.assertTrue('curator_http_request_errors_total{' + labels + '} 1\n' in text)
+        self.assertTrue('curator_http_request_duration_seconds_bucket{' + labels + ',le="0.025"} 1\n' in text)
+        self.assertTrue('curator_http_request_duration_seconds_bucket{' + labels + ',le="+Inf"} 2\n' in text)
+        self.assertTrue('curator_http_request_duration_seconds_count{' + labels + '} 2\n' in text)
+    def test_format_labels_escapes(self):
+        self.assertEqual(
+            '{repository="a\\"b\\\\c"}',
+            curator.format_labels([('repository', 'a"b\\c')])
+        )
+
+def fake_frame(module, name, back=None):
+    frame = Mock()
+    frame.f_globals = {'__name__': module}
+    frame.f_code.co_name = name
+    frame.f_back = back
+    return frame
+
+class TestSamplingProfiler(TestCase):
+    def test_sample_categories(self):
+        profiler = curator.SamplingProfiler()
+        main = fake_frame('curator.cli.index_selection', 'indices')
+        regex = fake_frame('curator.api.filter', 'regex_iterate', main)
+        request = fake_frame('elasticsearch.connection.http_urllib3', 'perform_request', main)
+        profiler.sample(regex)
+        profiler.sample(regex)
+        profiler.sample(fake_frame('socket', 'readinto', request))
+        profiler.sample(fake_frame('threading', 'wait', main))
+        profiler.sample(fake_frame('threading', '_wait_for_tstate_lock', main))
+        self.assertEqual({
+            'local;curator.cli.index_selection.indices;curator.api.filter.regex_iterate': 2,
+            'elasticsearch;curator.cli.index_selection.indices;elasticsearch.connection.http_urllib3.perform_request;socket.readinto': 1,
+        }, profiler.stacks)
+        self.assertEqual({'local': 2, 'elasticsearch': 1, 'sleep': 0}, profiler.summary())
+    def test_sample_sleep(self):
+        t = threading.Thread(target=curator.loop_bloom, args=(Mock(), ['index1'], 0.2))
+        t.start()
+        try:
+            time.sleep(0.05)
+            profiler = curator.SamplingProfiler()
+            profiler.sample(sys._current_frames()[t.ident])
+        finally:
+            t.join()
+        self.assertEqual({'local': 0, 'elasticsearch': 0, 'sleep': 1}, profiler.summary())
+        self.assertTrue(list(profiler.stacks)[0].endswith('curator.api.bloom.loop_bloom'))
+    def test_sample_sleep_by_frame(self):
+        profiler = curator.SamplingProfiler()
+        main = fake_frame('curator.cli.index_selection', 'indices')
+        profiler.sample(fake_frame('curator.api.throttle', 'wait', main))
+        profiler.sample(fake_frame('curator.api.filter', 'compute_sleep', main))
+        self.assertEqual({'local': 1, 'elasticsearch': 0, 'sleep': 1}, profiler.summary())
+    def test_dump_stats(self):
+        profiler = curator.SamplingProfiler(interval=0.001)
+        profiler.enable()
+        deadline = time.time() + 5
+        while not profiler.stacks and time.time() < deadline:
+            sum(range(0, 10000))
+        profiler.disable()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'curator.folded')
+            profiler.dump_stats(filename)
+            with open(filename) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines)
+            self.assertTrue(all(l.startswith('local;') for l in lines))
+            self.assertTrue(any('test_dump_stats' in l for l in lines))
+        finally:
+            shutil.rmtree(tmpdir)
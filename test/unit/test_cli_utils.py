@@ -1,7 +1,13 @@
 from datetime import datetime, timedelta
 from unittest import TestCase
-from mock import Mock
+from mock import Mock, call, patch
 import sys
+import time
+import threading
+import json
+import tempfile
+import shutil
+import os
 import click
 from click import testing as clicktest
 
@@ -9,6 +15,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 import curator
+from curator.cli import multi
+daemon = sys.modules['curator.cli.daemon']
 
 named_indices  = [ "index1", "index2" ]
 named_alias    = 'alias_name'
@@ -111,3 +119,597 @@ class TestInList(TestCase):
         v = ['a', 'b', 'q']
         s = ['a', 'b', 'c', 'd']
         self.assertEqual(['a', 'b'], curator.in_list(v, s))
+
+class TestChunkIndexList(TestCase):
+    def test_chunk_index_list_is_lazy(self):
+        chunks = curator.chunk_index_list(iter(named_indices))
+        self.assertEqual([named_indices], list(chunks))
+    def test_chunk_index_list_max_length(self):
+        indices = ['index{0:04d}'.format(i) for i in range(0, 1000)]
+        chunks = list(curator.chunk_index_list(indices, max_length=100))
+        self.assertEqual(indices, [i for chunk in chunks for i in chunk])
+        for chunk in chunks:
+            self.assertTrue(curator.index_list_length(chunk) <= 100)
+        # Each chunk is as full as it can be
+        self.assertEqual(10, len(chunks[0]))
+    def test_chunk_index_list_encoded_length(self):
+        indices = ['a b', 'c+d', '\u00e9', 'e,f']
+        self.assertEqual(
+            [3, 5, 6, 3], [curator.encoded_length(i) for i in indices])
+        self.assertEqual(20, curator.index_list_length(indices))
+        chunks = list(curator.chunk_index_list(indices, max_length=9))
+        self.assertEqual([['a b', 'c+d'], ['\u00e9'], ['e,f']], chunks)
+    def test_chunk_index_list_oversized_name(self):
+        chunks = list(curator.chunk_index_list(['a' * 20, 'b'], max_length=10))
+        self.assertEqual([['a' * 20], ['b']], chunks)
+
+class TestMaxInitialLineLength(TestCase):
+    def test_byte_size(self):
+        self.assertEqual(4096, curator.byte_size('4kb'))
+        self.assertEqual(8192, curator.byte_size('8K'))
+        self.assertEqual(1000, curator.byte_size(1000))
+        self.assertIsNone(curator.byte_size('4 parsecs'))
+    def test_default(self):
+        client = Mock()
+        client.nodes.info.return_value = {'nodes': {'node1': {'settings': {}}}}
+        self.assertEqual(4096, curator.get_max_initial_line_length(client))
+    def test_smallest_of_all_nodes(self):
+        client = Mock()
+        client.nodes.info.return_value = {'nodes': {
+            'node1': {'settings': {'http': {'max_initial_line_length': '16kb'}}},
+            'node2': {'settings': {'http.max_initial_line_length': '8kb'}},
+        }}
+        self.assertEqual(8192, curator.get_max_initial_line_length(client))
+    def test_failure(self):
+        client = Mock()
+        client.nodes.info.side_effect = fake_fail
+        self.assertEqual(4096, curator.get_max_initial_line_length(client))
+
+class TestRequestStats(TestCase):
+    def test_stats_file_written_at_exit(self):
+        client = Mock()
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'index1': {'state': 'open', 'settings': {}, 'aliases': []}}}}
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'stats.json')
+        handlers = list(logging.root.handlers)
+        try:
+            with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client) as get_client:
+                result = clicktest.CliRunner().invoke(
+                    curator.cli,
+                    ['--logfile', os.devnull, '--request_stats_file', filename,
+                     'show', 'indices', '--all-indices'],
+                    obj={'filters': []},
+                )
+            self.assertEqual(0, result.exit_code)
+            self.assertTrue(isinstance(get_client.call_args[1]['stats'], curator.RequestStats))
+            with open(filename) as f:
+                self.assertEqual(0, json.load(f)['totals']['count'])
+        finally:
+            logging.root.handlers = handlers
+            os.remove(filename)
+            os.rmdir(tmpdir)
+    def test_no_stats_by_default(self):
+        client = Mock()
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'index1': {'state': 'open', 'settings': {}, 'aliases': []}}}}
+        handlers = list(logging.root.handlers)
+        try:
+            with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client) as get_client:
+                clicktest.CliRunner().invoke(
+                    curator.cli,
+                    ['--logfile', os.devnull, 'show', 'indices', '--all-indices'],
+                    obj={'filters': []},
+                )
+            self.assertIsNone(get_client.call_args[1]['stats'])
+        finally:
+            logging.root.handlers = handlers
+
+class TestConnectionPoolSize(TestCase):
+    def invoke(self, args):
+        client = Mock()
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'index1': {'state': 'open', 'settings': {}, 'aliases': []}}}}
+        handlers = list(logging.root.handlers)
+        try:
+            with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client) as get_client:
+                clicktest.CliRunner().invoke(
+                    curator.cli, ['--logfile', os.devnull] + args,
+                    obj={'filters': []},
+                )
+        finally:
+            logging.root.handlers = handlers
+        return get_client.call_args[1]['concurrency']
+    def test_default(self):
+        self.assertEqual(1, self.invoke(['show', 'indices', '--all-indices']))
+    def test_chunk_concurrency(self):
+        self.assertEqual(
+            20,
+            self.invoke(['--chunk_concurrency', '20', 'show', 'indices', '--all-indices'])
+        )
+    def test_command_concurrency(self):
+        self.assertEqual(
+            30,
+            self.invoke(['--chunk_concurrency', '2', 'snapshot', '--repository', 'repo', '--concurrency', '30', 'indices', '--all-indices'])
+        )
+    def test_get_client_maxsize(self):
+        client = Mock()
+        client.info.return_value = {'version': {'number': '1.4.4'}}
+        with patch.object(sys.modules['curator.cli.utils'], 'get_pooled_client', return_value=client) as get_pooled_client:
+            curator.get_client(host='localhost', chunk_concurrency=4, concurrency=25)
+        self.assertEqual(25, get_pooled_client.call_args[1]['concurrency'])
+
+class TestMetrics(TestCase):
+    def test_metrics_file_written_at_exit(self):
+        client = Mock()
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'index1': {'state': 'open', 'settings': {}, 'aliases': []}}}}
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'curator.prom')
+        handlers = list(logging.root.handlers)
+        try:
+            with patch.object(sys.modules['curator.api.metrics'], '_run_metrics', curator.RunMetrics()):
+                with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client) as get_client:
+                    result = clicktest.CliRunner().invoke(
+                        curator.cli,
+                        ['--logfile', os.devnull, '--metrics_file', filename,
+                         'show', 'indices', '--all-indices'],
+                        obj={'filters': []},
+                    )
+            self.assertEqual(0, result.exit_code)
+            self.assertTrue(isinstance(get_client.call_args[1]['stats'], curator.RequestStats))
+            with open(filename) as f:
+                self.assertTrue('curator_indices_matched_total{action="show"} 1\n' in f.read())
+            self.assertEqual(['curator.prom'], os.listdir(tmpdir))
+        finally:
+            logging.root.handlers = handlers
+            shutil.rmtree(tmpdir)
+    def test_do_command_records_action(self):
+        client = Mock()
+        metrics = curator.RunMetrics()
+        with patch.object(sys.modules['curator.cli.utils'], 'get_run_metrics', return_value=metrics):
+            self.assertTrue(curator.do_command(client, 'close', named_indices))
+        text = metrics.render()
+        self.assertTrue('curator_indices_acted_total{action="close"} 2\n' in text)
+        self.assertTrue('curator_action_duration_seconds_count{action="close",result="success"} 1\n' in text)
+    def test_serve_metrics(self):
+        try:
+            from urllib.request import urlopen
+        except ImportError:
+            from urllib2 import urlopen
+        metrics = curator.RunMetrics()
+        metrics.inc('curator_indices_matched_total', 3, action='delete')
+        with patch.object(sys.modules['curator.api.metrics'], '_run_metrics', metrics):
+            server = curator.serve_metrics(0, address='127.0.0.1')
+            try:
+                response = urlopen('http://127.0.0.1:{0}/metrics'.format(server.server_address[1]))
+                self.assertTrue(response.info()['Content-Type'].startswith('text/plain; version=0.0.4'))
+                self.assertTrue(b'curator_indices_matched_total{action="delete"} 3\n' in response.read())
+            finally:
+                server.shutdown()
+                server.server_close()
+
+class TestProfile(TestCase):
+    def run_profile(self, filename, *args):
+        client = Mock()
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'index1': {'state': 'open', 'settings': {}, 'aliases': []}}}}
+        handlers = list(logging.root.handlers)
+        try:
+            with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client) as get_client:
+                result = clicktest.CliRunner().invoke(
+                    curator.cli,
+                    ['--logfile', os.devnull, '--profile', filename] + list(args) +
+                    ['show', 'indices', '--all-indices'],
+                    obj={'filters': []},
+                )
+        finally:
+            logging.root.handlers = handlers
+        self.assertEqual(0, result.exit_code)
+        self.assertTrue(isinstance(get_client.call_args[1]['stats'], curator.RequestStats))
+        return result
+    def test_profile_pstats(self):
+        import pstats
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'curator.pstats')
+        try:
+            result = self.run_profile(filename)
+            self.assertTrue('Profile written to {0}'.format(filename) in result.output)
+            self.assertTrue('0 Elasticsearch requests' in result.output)
+            functions = [f[2] for f in pstats.Stats(filename).stats]
+            self.assertTrue('get_indices' in functions)
+        finally:
+            shutil.rmtree(tmpdir)
+    def test_profile_collapsed(self):
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'curator.folded')
+        try:
+            result = self.run_profile(filename, '--profile_format', 'collapsed')
+            self.assertTrue('Samples: ' in result.output)
+            self.assertTrue(os.path.exists(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
+class TestIndexSelectionChunking(TestCase):
+    def run_command(self, args, indices, max_length=['--max_initial_line_length', '1200']):
+        client = Mock()
+        client.nodes.info.return_value = {'nodes': {'node1': {'settings': {}}}}
+        client.cluster.state.return_value = {'metadata': {'indices': dict(
+            (i, {'state': 'open', 'settings': {}, 'aliases': []}) for i in indices)}}
+        client.info.return_value = {'version': {'number': '1.4.4'}}
+        client.snapshot.get.return_value = {'snapshots': []}
+        client.snapshot.verify_repository.return_value = {'nodes': {}}
+        handlers = list(logging.root.handlers)
+        try:
+            with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client):
+                result = clicktest.CliRunner().invoke(
+                    curator.cli,
+                    ['--logfile', os.devnull] + max_length + args,
+                    obj={'filters': []},
+                )
+        finally:
+            logging.root.handlers = handlers
+        return client, result
+    def test_snapshot_not_chunked(self):
+        indices = ['logstash-{0:04d}'.format(i) for i in range(0, 100)]
+        client, result = self.run_command(
+            ['snapshot', '--repository', 'repo', 'indices', '--all-indices'], indices)
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(1, client.snapshot.create.call_count)
+        self.assertEqual(
+            ','.join(indices),
+            client.snapshot.create.call_args[1]['body']['indices'])
+    def test_close_chunked(self):
+        indices = ['logstash-{0:04d}'.format(i) for i in range(0, 100)]
+        client, result = self.run_command(['close', 'indices', '--all-indices'], indices)
+        self.assertEqual(0, result.exit_code)
+        self.assertTrue(client.indices.close.call_count > 1)
+    def test_short_list_limit_not_read(self):
+        client, result = self.run_command(
+            ['close', 'indices', '--all-indices'], named_indices, max_length=[])
+        self.assertEqual(0, result.exit_code)
+        self.assertFalse(client.nodes.info.called)
+    def test_long_list_limit_read(self):
+        indices = ['logstash-{0:04d}'.format(i) for i in range(0, 400)]
+        client, result = self.run_command(
+            ['close', 'indices', '--all-indices'], indices, max_length=[])
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(1, client.nodes.info.call_count)
+        self.assertTrue(client.indices.close.call_count > 1)
+
+class TestDoCommand(TestCase):
+    def test_do_command_throttled(self):
+        client = Mock()
+        throttle = Mock()
+        self.assertTrue(curator.do_command(
+            client, 'replicas', named_indices, {'count': 0}, throttle=throttle))
+        self.assertEqual(1, throttle.wait.call_count)
+    def test_do_command_not_throttled(self):
+        client = Mock()
+        throttle = Mock()
+        self.assertTrue(curator.do_command(
+            client, 'close', named_indices, {}, throttle=throttle))
+        self.assertFalse(throttle.wait.called)
+
+class TestDoChunkedCommand(TestCase):
+    def test_concurrency(self):
+        client = Mock()
+        state = { 'running': 0, 'max': 0 }
+        lock = threading.Lock()
+        def fake_delete(index=None):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+        client.indices.delete.side_effect = fake_delete
+        chunks = [['index{0}'.format(i)] for i in range(0, 6)]
+        self.assertTrue(curator.do_chunked_command(
+            client, 'delete', chunks, {}, concurrency=3))
+        self.assertEqual(3, state['max'])
+        self.assertEqual(6, client.indices.delete.call_count)
+    def test_not_parallel_command(self):
+        client = Mock()
+        client.info.return_value = {'version': {'number': '1.4.4'} }
+        client.cluster.state.return_value = {'metadata': {'indices': {}}}
+        chunks = [['index1'], ['index2']]
+        with patch('threading.Thread', wraps=threading.Thread) as thread:
+            self.assertTrue(curator.do_chunked_command(
+                client, 'bloom', chunks, {'delay': 0}, concurrency=4))
+            self.assertEqual(1, thread.call_count)
+    def test_retries(self):
+        client = Mock()
+        client.indices.delete.side_effect = [fake_fail, fake_fail, None]
+        with patch('time.sleep') as sleep:
+            self.assertTrue(curator.do_chunked_command(
+                client, 'delete', [named_indices], {}, retries=2))
+            self.assertEqual([((1,),), ((2,),)], sleep.call_args_list)
+    def test_retries_exhausted(self):
+        client = Mock()
+        client.indices.delete.side_effect = fake_fail
+        with patch('time.sleep'):
+            self.assertFalse(curator.do_chunked_command(
+                client, 'delete', [['index1'], ['index2']], {},
+                concurrency=2, retries=1))
+        self.assertEqual(4, client.indices.delete.call_count)
+    def test_retry_leaves_out_deleted(self):
+        client = Mock()
+        client.indices.delete.side_effect = [fake_fail, None]
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'index2': {'state': 'open'}}}}
+        with patch('time.sleep'):
+            self.assertTrue(curator.do_chunked_command(
+                client, 'delete', [named_indices], {}, retries=1))
+        self.assertEqual(
+            [call(index='index1,index2'), call(index='index2')],
+            client.indices.delete.call_args_list)
+    def test_retry_all_deleted(self):
+        client = Mock()
+        client.indices.delete.side_effect = fake_fail
+        client.cluster.state.return_value = {'metadata': {'indices': {}}}
+        with patch('time.sleep'):
+            self.assertTrue(curator.do_chunked_command(
+                client, 'delete', [named_indices], {}, retries=2))
+        self.assertEqual(1, client.indices.delete.call_count)
+
+class TestMulti(TestCase):
+    def test_parse_endpoint_host(self):
+        self.assertEqual(['--host', 'es1', '--port', '9200'], multi.parse_endpoint('es1'))
+    def test_parse_endpoint_url(self):
+        self.assertEqual(
+            ['--host', 'es1', '--port', '9201', '--url_prefix', 'es', '--use_ssl'],
+            multi.parse_endpoint('https://es1:9201/es/')
+        )
+    def test_parse_endpoint_invalid(self):
+        self.assertRaises(ValueError, multi.parse_endpoint, 'es1:port')
+    def test_run_cluster(self):
+        with patch.object(multi.cli, 'main', side_effect=SystemExit(1)) as m:
+            result = multi.run_cluster('es2:9201', ('show', 'indices', '--all-indices'))
+        self.assertEqual(('es2:9201', 1), result[:2])
+        self.assertEqual(
+            ['--host', 'es2', '--port', '9201', 'show', 'indices', '--all-indices'],
+            m.call_args[1]['args']
+        )
+    def test_run_clusters(self):
+        def main(args=None, **kwargs):
+            if args[1] == 'es2':
+                sys.exit(1)
+            sys.exit(0)
+        with patch.object(multi.cli, 'main', side_effect=main):
+            results = multi.run_clusters(['es1', 'es2:9201'], ['show', 'indices', '--all-indices'])
+        self.assertEqual([('es1', 0), ('es2:9201', 1)], [r[:2] for r in results])
+    def test_run_clusters_one_worker(self):
+        with patch.object(multi.multiprocessing, 'Pool') as pool:
+            pool.return_value.map.return_value = [('es1', 0, 1.0)]
+            multi.run_clusters(['es1', 'es2'], ['show', 'indices'], workers=1)
+        pool.assert_called_with(processes=1, maxtasksperchild=1)
+    def test_cluster_args(self):
+        self.assertEqual(
+            ['--metrics_file', '/tmp/curator-es1_9200.prom',
+             '--request_stats_file=stats-es1_9200.json', 'show', 'indices'],
+            multi.cluster_args('es1:9200', [
+                '--metrics_file', '/tmp/curator.prom',
+                '--request_stats_file=stats.json', 'show', 'indices'])
+        )
+    def test_cluster_filename_url(self):
+        self.assertEqual(
+            'curator-es1_9201_es.prof',
+            multi.cluster_filename('https://es1:9201/es/', 'curator.prof')
+        )
+    def test_multicli_exit_code(self):
+        with patch.object(multi, 'run_clusters', return_value=[('es1', 0, 1.0), ('es2', 1, 2.0)]):
+            result = clicktest.CliRunner().invoke(multi.multicli, ['--cluster', 'es1', '--cluster', 'es2', '--', 'show', 'indices'])
+        self.assertEqual(1, result.exit_code)
+        self.assertTrue('1 of 2 clusters failed' in result.output)
+    def test_multicli_no_clusters(self):
+        result = clicktest.CliRunner().invoke(multi.multicli, ['show', 'indices'])
+        self.assertEqual(1, result.exit_code)
+
+class TestCronSchedule(TestCase):
+    def test_daily(self):
+        s = daemon.CronSchedule('30 3 * * *')
+        self.assertEqual(datetime(2015, 3, 10, 3, 30), s.next_run(datetime(2015, 3, 10, 1, 0)))
+        self.assertEqual(datetime(2015, 3, 11, 3, 30), s.next_run(datetime(2015, 3, 10, 3, 30)))
+    def test_seconds(self):
+        s = daemon.CronSchedule('*/15 * * * * *')
+        self.assertEqual(datetime(2015, 3, 10, 1, 0, 30), s.next_run(datetime(2015, 3, 10, 1, 0, 16, 500)))
+        self.assertEqual(datetime(2015, 3, 10, 1, 1, 0), s.next_run(datetime(2015, 3, 10, 1, 0, 45)))
+    def test_weekday(self):
+        # 10 March 2015 was a Tuesday
+        s = daemon.CronSchedule('0 0 * * 7')
+        self.assertEqual(datetime(2015, 3, 15), s.next_run(datetime(2015, 3, 10)))
+    def test_day_or_weekday(self):
+        s = daemon.CronSchedule('0 0 1 * 3')
+        self.assertEqual(datetime(2015, 3, 11), s.next_run(datetime(2015, 3, 10)))
+        self.assertEqual(datetime(2015, 4, 1), s.next_run(datetime(2015, 3, 25)))
+    def test_year_end(self):
+        s = daemon.CronSchedule('0 0 1 1 *')
+        self.assertEqual(datetime(2016, 1, 1), s.next_run(datetime(2015, 3, 10)))
+    def test_invalid(self):
+        self.assertRaises(ValueError, daemon.CronSchedule, '* * * *')
+        self.assertRaises(ValueError, daemon.CronSchedule, '60 * * * *')
+        self.assertRaises(ValueError, daemon.CronSchedule('0 0 31 2 *').next_run, datetime(2015, 3, 10))
+
+class TestDaemon(TestCase):
+    def test_params_to_args(self):
+        params = dict(sys.modules['curator.cli.cli'].DEFAULT_ARGS)
+        params.update({'host': 'es1', 'port': 9201, 'dry_run': True, 'http_auth': None})
+        args = daemon.params_to_args(curator.cli, params)
+        self.assertEqual(['--host', 'es1', '--port', '9201', '--dry-run'], args)
+    def test_load_jobs(self):
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'jobs': [
+                {'name': 'expire', 'schedule': '0 3 * * *', 'command': 'delete indices --older-than 30'},
+                {'schedule': '*/30 * * * * *', 'command': ['show', 'indices', '--all-indices']},
+            ]}, f)
+        try:
+            jobs = daemon.load_jobs(filename)
+        finally:
+            os.remove(filename)
+        self.assertEqual(['expire', 'job2'], [j.name for j in jobs])
+        self.assertEqual(set([0, 30]), jobs[1].schedule.seconds)
+    def test_job_command_string(self):
+        job = daemon.Job('expire', '0 3 * * *', "delete indices --timestring '%Y.%m.%d'")
+        self.assertEqual(['delete', 'indices', '--timestring', '%Y.%m.%d'], job.args)
+    def test_run_job_uses_client(self):
+        client = Mock()
+        job = daemon.Job('show', '* * * * *', ['show', 'indices', '--all-indices'])
+        with patch.object(daemon.cli, 'main', side_effect=SystemExit(0)) as m:
+            self.assertEqual(0, daemon.run_job(job, ['--host', 'es1'], client))
+        self.assertEqual(['--host', 'es1', 'show', 'indices', '--all-indices'], m.call_args[1]['args'])
+        self.assertTrue(m.call_args[1]['obj']['client'] is client)
+    def fake_clock(self):
+        clock = {'now': datetime(2015, 3, 10)}
+        fake_datetime = Mock()
+        fake_datetime.now.side_effect = lambda: clock['now']
+        def sleep(seconds):
+            clock['now'] += timedelta(seconds=seconds)
+        return patch.object(daemon, 'datetime', fake_datetime), patch.object(time, 'sleep', side_effect=sleep)
+    def test_run_daemon_master_only(self):
+        client = Mock()
+        client.nodes.info.return_value = {'nodes': {'foo': {}}}
+        client.cluster.state.return_value = {'master_node': 'bar'}
+        job = daemon.Job('show', '* * * * * *', ['show', 'indices', '--all-indices'])
+        fake_datetime, fake_sleep = self.fake_clock()
+        with patch.object(daemon, 'run_job') as run_job:
+            with fake_datetime:
+                with fake_sleep:
+                    daemon.run_daemon([job], [], client, master_only=True, max_runs=2)
+        self.assertFalse(run_job.called)
+    def test_run_daemon(self):
+        client = Mock()
+        jobs = [
+            daemon.Job('often', '*/10 * * * * *', ['show', 'indices', '--all-indices']),
+            daemon.Job('seldom', '* * * * *', ['show', 'snapshots', '--all-snapshots']),
+        ]
+        fake_datetime, fake_sleep = self.fake_clock()
+        with patch.object(daemon, 'run_job') as run_job:
+            with fake_datetime:
+                with fake_sleep:
+                    daemon.run_daemon(jobs, [], client, max_runs=8)
+        self.assertEqual(
+            ['often'] * 6 + ['seldom', 'often'],
+            [c[0][0].name for c in run_job.call_args_list]
+        )
+    def test_run_daemon_writes_metrics(self):
+        client = Mock()
+        stats = curator.RequestStats()
+        job = daemon.Job('show', '* * * * * *', ['show', 'indices', '--all-indices'])
+        fake_datetime, fake_sleep = self.fake_clock()
+        with patch.object(daemon, 'run_job'):
+            with patch.object(daemon, 'report_metrics') as report_metrics:
+                with fake_datetime:
+                    with fake_sleep:
+                        daemon.run_daemon([job], [], client, max_runs=2, metrics_file='curator.prom', stats=stats)
+        self.assertEqual(2, report_metrics.call_count)
+        report_metrics.assert_called_with('curator.prom', stats)
+
+plan = sys.modules['curator.cli.plan']
+
+def plan_step(name, action, indices, **options):
+    return {
+        'name': name, 'action': action, 'indices': indices,
+        'params': plan.command_params(action, options),
+    }
+
+class TestPlan(TestCase):
+    def test_selection_filters(self):
+        filters = plan.selection_filters({
+            'prefix': 'logstash-', 'older_than': 30, 'time_unit': 'days',
+            'timestring': '%Y.%m.%d', 'exclude': ['logstash-keep'],
+        })
+        self.assertEqual(3, len(filters))
+        self.assertEqual('older_than', filters[0]['method'])
+        self.assertEqual({'pattern': '^logstash-.*$'}, filters[1])
+        self.assertEqual({'pattern': 'logstash-keep', 'exclude': True}, filters[2])
+    def test_selection_filters_invalid(self):
+        self.assertRaises(ValueError, plan.selection_filters, {'older_than': 30})
+        self.assertRaises(ValueError, plan.selection_filters, {'prefixx': 'foo'})
+        self.assertRaises(ValueError, plan.selection_filters, {})
+    def test_command_params(self):
+        params = plan.command_params('snapshot', {'repository': 'backups'})
+        self.assertEqual(('backups',), params['repository'])
+        self.assertEqual('curator-', params['prefix'])
+    def test_command_params_missing_required(self):
+        self.assertRaises(ValueError, plan.command_params, 'replicas', {})
+        self.assertRaises(ValueError, plan.command_params, 'optimize', {'segments': 1})
+    def test_optimize_plan(self):
+        client = Mock()
+        steps = [
+            plan_step('merge', 'optimize', ['a', 'b', 'c']),
+            plan_step('warm', 'allocation', ['b', 'c'], rule='box=warm'),
+            plan_step('shrink', 'replicas', ['c', 'd'], count=0),
+            plan_step('expire', 'delete', ['a']),
+            plan_step('backup', 'snapshot', ['a', 'b'], repository='backups'),
+        ]
+        tasks = plan.optimize_plan(client, steps, metadata=curator.ClusterMetadataSnapshot(client, state={'metadata': {'indices': {}}}))
+        self.assertEqual(['merge', 'warm+shrink', 'expire', 'backup'], [t['name'] for t in tasks])
+        self.assertEqual(['b', 'c'], tasks[0]['indices'])
+        self.assertEqual([
+            ({'index.routing.allocation.require.box': 'warm'}, ['b']),
+            ({'index.number_of_replicas': 0, 'index.routing.allocation.require.box': 'warm'}, ['c']),
+            ({'index.number_of_replicas': 0}, ['d']),
+        ], sorted(tasks[1]['settings'], key=lambda s: s[1]))
+        self.assertEqual(['b'], tasks[3]['indices'])
+    def test_plan_waves(self):
+        tasks = [
+            {'action': 'optimize', 'indices': ['a']},
+            {'action': 'close', 'indices': ['b']},
+            {'action': 'delete', 'indices': ['a']},
+            {'action': 'show', 'indices': ['c']},
+            {'action': 'open', 'indices': ['d']},
+        ]
+        self.assertEqual([2, 1, 1, 1], [len(w) for w in plan.plan_waves(tasks)])
+    def test_plan_command(self):
+        client = Mock()
+        client.cluster.state.return_value = {'metadata': {'indices': {
+            'logstash-2015.01.01': {'state': 'open', 'settings': {}},
+            'logstash-2015.01.02': {'state': 'open', 'settings': {}},
+        }}}
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'steps': [
+                {'action': 'replicas', 'options': {'count': 0}, 'indices': {'all_indices': True}},
+                {'action': 'delete', 'indices': {'index': ['logstash-2015.01.01']}},
+            ]}, f)
+        try:
+            with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client):
+                result = clicktest.CliRunner().invoke(
+                    curator.cli,
+                    ['--logfile', os.devnull, '--max_initial_line_length', '4096', 'plan', '--file', filename],
+                    obj={'filters': []},
+                )
+        finally:
+            os.remove(filename)
+        self.assertEqual(0, result.exit_code)
+        client.indices.put_settings.assert_called_once_with(
+            index='logstash-2015.01.02', body={'index.number_of_replicas': 0})
+        client.indices.delete.assert_called_once_with(index='logstash-2015.01.01')
+    def test_plan_metadata_read_after_close(self):
+        client = Mock()
+        states = [
+            {'metadata': {'indices': {'index1': {'state': state, 'settings': {}}}}}
+            for state in ['open', 'close']
+        ]
+        client.cluster.state.side_effect = states
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'steps': [
+                {'action': 'close', 'indices': {'index': ['index1']}},
+                {'action': 'optimize', 'indices': {'index': ['index1']}},
+            ]}, f)
+        try:
+            with patch.object(sys.modules['curator.cli.utils'], 'get_client', return_value=client):
+                result = clicktest.CliRunner().invoke(
+                    curator.cli,
+                    ['--logfile', os.devnull, '--max_initial_line_length', '4096', 'plan', '--file', filename],
+                    obj={'filters': []},
+                )
+        finally:
+            os.remove(filename)
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(2, client.cluster.state.call_count)
+        client.indices.close.assert_called_once_with(index='index1', ignore_unavailable=True)
+        self.assertFalse(client.indices.optimize.called)